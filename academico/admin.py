@@ -1,12 +1,256 @@
-from django.contrib import admin
-from .models import Competencia, Planificacion, Curso, Clase, PeriodoAcademico, Grado, Cargo, Pago
+from itertools import chain
+
+from django.contrib import admin, messages
+from django.http import StreamingHttpResponse
+from .models import Competencia, Planificacion, Curso, CategoriaCalificacion, Clase, PeriodoAcademico, Grado, Cargo, Pago, ConciliacionBancaria, ExcepcionConciliacion, AntiguedadSaldo, DisponibilidadMaestro, ResumenAsistencia, ResumenCalificaciones, AlertaAusentismo, ClasificacionEstudiante
+from .finanzas import generar_cargos, actualizar_antiguedad
+from .inscripciones import sincronizar_inscripciones
+from .asistencia import reconstruir_resumenes_asistencia
+from .calificaciones import reconstruir_resumen_calificaciones
+from .boletas import estudiantes_del_periodo, generar_boletas, zip_de_boletas
+from .clasificacion import cerrar_periodo
 
 # Register your models here.
 admin.site.register(Competencia)
 admin.site.register(Planificacion)
-admin.site.register(Curso)
 admin.site.register(Clase)
-admin.site.register(PeriodoAcademico)
-admin.site.register(Grado)
 admin.site.register(Cargo)
-admin.site.register(Pago)
\ No newline at end of file
+admin.site.register(Pago)
+
+
+def _mensaje_cargos_generados(resumen):
+    detalle = ", ".join(f"{concepto}: {total}" for concepto, total in resumen['por_concepto'].items())
+    mensaje = f"Se crearon {resumen['cargos_creados']} cargos para {resumen['estudiantes']} estudiantes."
+    return f"{mensaje} ({detalle})" if detalle else mensaje
+
+
+# Dentro de una petición web el pool de PDF es chico y solo para lotes
+# chicos; el resto se genera con el comando generar_boletas
+PROCESOS_BOLETAS_WEB = 2
+MAXIMO_BOLETAS_WEB = 300
+
+
+def _descargar_boletas(modeladmin, request, lotes, nombre):
+    """
+    Envía en un ZIP, a medida que se generan los PDF, las boletas de
+    `lotes`: tuplas (periodo, estudiantes, argumento del comando).
+    """
+    total = sum(estudiantes.count() for _, estudiantes, _ in lotes)
+    if total > MAXIMO_BOLETAS_WEB:
+        argumentos = " ; ".join(f"python manage.py generar_boletas {argumento}" for _, _, argumento in lotes)
+        modeladmin.message_user(
+            request, f"Son {total} boletas, demasiadas para generarlas aquí. Use el comando: {argumentos}", messages.WARNING,
+        )
+        return None
+    boletas = chain.from_iterable(
+        generar_boletas(periodo, estudiantes, procesos=PROCESOS_BOLETAS_WEB) for periodo, estudiantes, _ in lotes
+    )
+    response = StreamingHttpResponse(zip_de_boletas(boletas), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return response
+
+
+class CategoriaCalificacionInline(admin.TabularInline):
+    model = CategoriaCalificacion
+    extra = 0
+
+
+@admin.register(Curso)
+class CursoAdmin(admin.ModelAdmin):
+    """Los pesos de las categorías se aplican al vuelo a las notas finales."""
+    list_display = ('nombre', 'codigo', 'creditos')
+    search_fields = ('nombre', 'codigo')
+    inlines = [CategoriaCalificacionInline]
+
+
+@admin.register(PeriodoAcademico)
+class PeriodoAcademicoAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'fecha_inicio', 'fecha_fin', 'cerrado')
+    readonly_fields = ('cerrado',)
+    actions = ['generar_cargos_faltantes', 'reconstruir_asistencia', 'reconstruir_calificaciones', 'descargar_boletas', 'cerrar_periodos']
+
+    @admin.action(description="Generar cargos faltantes de todos los grados")
+    def generar_cargos_faltantes(self, request, queryset):
+        for periodo in queryset:
+            resumen = generar_cargos(periodo=periodo)
+            self.message_user(request, f"{periodo}: {_mensaje_cargos_generados(resumen)}")
+
+    @admin.action(description="Recalcular los resúmenes de asistencia")
+    def reconstruir_asistencia(self, request, queryset):
+        procesadas, creados = reconstruir_resumenes_asistencia(Clase.objects.filter(periodo__in=queryset))
+        self.message_user(request, f"{procesadas} clases procesadas, {creados} resúmenes generados.")
+
+    @admin.action(description="Conciliar los resúmenes de calificaciones")
+    def reconstruir_calificaciones(self, request, queryset):
+        procesadas, corregidos = reconstruir_resumen_calificaciones(Clase.objects.filter(periodo__in=queryset))
+        self.message_user(request, f"{procesadas} clases procesadas, {corregidos} resúmenes corregidos.")
+
+    @admin.action(description="Descargar las boletas de calificaciones (ZIP)")
+    def descargar_boletas(self, request, queryset):
+        lotes = [(periodo, estudiantes_del_periodo(periodo), f"--periodo {periodo.pk}") for periodo in queryset]
+        return _descargar_boletas(self, request, lotes, "boletas_periodos.zip")
+
+    @admin.action(description="Cerrar el periodo y guardar las clasificaciones")
+    def cerrar_periodos(self, request, queryset):
+        for periodo in queryset:
+            filas = cerrar_periodo(periodo)
+            self.message_user(request, f"{periodo}: cerrado, {filas} clasificaciones guardadas.")
+
+
+@admin.register(Grado)
+class GradoAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'periodo', 'monto_inscripcion', 'monto_utiles', 'monto_colegiatura_mensual')
+    list_filter = ('periodo',)
+    filter_horizontal = ('clases', 'cursos')
+    actions = ['generar_cargos_faltantes', 'sincronizar_inscripciones', 'descargar_boletas']
+
+    @admin.action(description="Generar cargos faltantes para los estudiantes")
+    def generar_cargos_faltantes(self, request, queryset):
+        for grado in queryset.select_related('periodo'):
+            resumen = generar_cargos(grado)
+            self.message_user(request, f"{grado}: {_mensaje_cargos_generados(resumen)}")
+
+    @admin.action(description="Sincronizar inscripciones con la plantilla de clases")
+    def sincronizar_inscripciones(self, request, queryset):
+        clases = Grado.clases.through.objects.filter(grado__in=queryset).values_list('clase_id', flat=True)
+        creadas, _ = sincronizar_inscripciones(clases=set(clases))
+        self.message_user(request, f"Inscripciones creadas: {creadas}.")
+
+    @admin.action(description="Descargar las boletas de calificaciones (ZIP)")
+    def descargar_boletas(self, request, queryset):
+        lotes = [
+            (grado.periodo, grado.estudiantes.all(), f"--grado {grado.pk}") for grado in queryset.select_related('periodo')
+        ]
+        return _descargar_boletas(self, request, lotes, "boletas_grados.zip")
+
+
+@admin.register(DisponibilidadMaestro)
+class DisponibilidadMaestroAdmin(admin.ModelAdmin):
+    list_display = ('maestro', 'dia_semana', 'hora_inicio', 'hora_fin')
+    list_filter = ('dia_semana',)
+
+
+class ExcepcionConciliacionInline(admin.TabularInline):
+    model = ExcepcionConciliacion
+    extra = 0
+    fields = ('numero_fila', 'matricula', 'referencia', 'monto', 'motivo', 'resuelta')
+    readonly_fields = ('numero_fila', 'matricula', 'referencia', 'monto', 'motivo')
+
+
+@admin.register(ConciliacionBancaria)
+class ConciliacionBancariaAdmin(admin.ModelAdmin):
+    list_display = ('archivo', 'fecha', 'usuario', 'filas_leidas', 'pagos_creados', 'total_conciliado')
+    readonly_fields = ('archivo', 'usuario', 'filas_leidas', 'pagos_creados', 'total_conciliado')
+    inlines = [ExcepcionConciliacionInline]
+
+
+@admin.register(ExcepcionConciliacion)
+class ExcepcionConciliacionAdmin(admin.ModelAdmin):
+    list_display = ('conciliacion', 'numero_fila', 'matricula', 'referencia', 'monto', 'motivo', 'resuelta')
+    list_filter = ('resuelta', 'conciliacion')
+    search_fields = ('matricula', 'referencia')
+    actions = ['marcar_resueltas']
+
+    @admin.action(description="Marcar como resueltas")
+    def marcar_resueltas(self, request, queryset):
+        actualizadas = queryset.update(resuelta=True)
+        self.message_user(request, f"{actualizadas} excepciones marcadas como resueltas.")
+
+
+@admin.register(AntiguedadSaldo)
+class AntiguedadSaldoAdmin(admin.ModelAdmin):
+    """
+    Reporte de antigüedad de saldos por periodo y grado. Antes de mostrar
+    la lista se recalculan solo las filas que quedaron desactualizadas.
+    """
+    list_display = ('periodo', 'grado', 'corriente', 'dias_0_30', 'dias_31_60', 'dias_61_90', 'dias_mas_90', 'total', 'cantidad_cargos', 'fecha_calculo')
+    list_filter = ('periodo', 'grado')
+    actions = ['recalcular_todo']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        actualizar_antiguedad()
+        return super().changelist_view(request, extra_context)
+
+    @admin.action(description="Recalcular todo el reporte")
+    def recalcular_todo(self, request, queryset):
+        filas = actualizar_antiguedad(completo=True)
+        self.message_user(request, f"Reporte recalculado ({filas} filas).")
+
+
+@admin.register(ResumenAsistencia)
+class ResumenAsistenciaAdmin(admin.ModelAdmin):
+    """Consulta de los resúmenes de asistencia; se mantienen solos."""
+    list_display = ('estudiante', 'clase', 'presentes', 'ausentes', 'tardanzas', 'justificados', 'tasa_asistencia')
+    list_filter = ('clase__periodo',)
+    list_select_related = ('estudiante__user', 'clase__curso')
+    search_fields = ('estudiante__user__first_name', 'estudiante__user__last_name', 'estudiante__matricula')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="% Asistencia")
+    def tasa_asistencia(self, obj):
+        return obj.tasa_asistencia
+
+
+@admin.register(ResumenCalificaciones)
+class ResumenCalificacionesAdmin(admin.ModelAdmin):
+    """Consulta de los resúmenes de calificaciones; se mantienen solos."""
+    list_display = ('estudiante', 'clase', 'cantidad', 'suma', 'promedio')
+    list_filter = ('clase__periodo',)
+    list_select_related = ('estudiante__user', 'clase__curso')
+    search_fields = ('estudiante__user__first_name', 'estudiante__user__last_name', 'estudiante__matricula')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="Promedio")
+    def promedio(self, obj):
+        return round(obj.promedio, 2) if obj.cantidad else None
+
+
+@admin.register(AlertaAusentismo)
+class AlertaAusentismoAdmin(admin.ModelAdmin):
+    """Estudiantes con ausentismo crónico, generados por el comando alertas_ausentismo."""
+    list_display = ('estudiante', 'desde', 'hasta', 'registros', 'ausencias', 'tasa_ausencia', 'atendida')
+    list_filter = ('atendida', 'hasta')
+    list_select_related = ('estudiante__user',)
+    search_fields = ('estudiante__user__first_name', 'estudiante__user__last_name', 'estudiante__matricula')
+    readonly_fields = ('estudiante', 'desde', 'hasta', 'registros', 'ausencias', 'tasa_ausencia')
+    actions = ['marcar_atendidas']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Marcar como atendidas")
+    def marcar_atendidas(self, request, queryset):
+        actualizadas = queryset.update(atendida=True)
+        self.message_user(request, f"{actualizadas} alertas marcadas como atendidas.")
+
+
+@admin.register(ClasificacionEstudiante)
+class ClasificacionEstudianteAdmin(admin.ModelAdmin):
+    """Cuadros de honor: clasificaciones guardadas al cerrar cada periodo."""
+    list_display = ('posicion', 'estudiante', 'ambito', 'grado', 'clase', 'promedio', 'percentil', 'participantes')
+    list_filter = ('periodo', 'ambito', 'grado')
+    list_select_related = ('estudiante__user', 'grado', 'clase__curso')
+    search_fields = ('estudiante__user__first_name', 'estudiante__user__last_name', 'estudiante__matricula')
+    ordering = ('periodo', 'ambito', 'grado', 'clase', 'posicion')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
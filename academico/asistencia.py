@@ -0,0 +1,289 @@
+"""
+Guardado de la hoja de asistencia de una clase en un día y mantenimiento
+de los resúmenes de asistencia.
+
+En lugar de un update_or_create por estudiante (dos o tres consultas por
+fila), se lee lo que ya hay guardado para la clase y la fecha, se
+descartan las filas que no cambiaron y el resto se escribe con un solo
+INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE. Lo mismo sirve para
+varios días a la vez (la vista semanal y su endpoint JSON).
+
+ResumenAsistencia y ResumenAsistenciaMensual guardan los conteos por
+estado; cada cambio de asistencia les suma o resta con UPDATE ... F().
+Los cambios de una hoja se agrupan por transición de estado, así que una
+hoja completa cuesta unos pocos UPDATE sin importar cuántos estudiantes
+tenga. reconstruir_resumenes_asistencia() los recalcula desde cero.
+"""
+import datetime
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from portal.models import Notificacion
+
+from .finanzas import _lotes_de_ids
+from .models import AlertaAusentismo, AsistenciaClase, Clase, ResumenAsistencia, ResumenAsistenciaMensual, tasa_asistencia
+
+CAMPO_POR_ESTADO = {
+    AsistenciaClase.EstadoAsistencia.PRESENTE: 'presentes',
+    AsistenciaClase.EstadoAsistencia.AUSENTE: 'ausentes',
+    AsistenciaClase.EstadoAsistencia.TARDANZA: 'tardanzas',
+    AsistenciaClase.EstadoAsistencia.JUSTIFICADO: 'justificados',
+}
+
+
+def _mes(fecha):
+    return datetime.date(fecha.year, fecha.month, 1)
+
+
+def actualizar_resumenes(cambios):
+    """
+    Aplica a los resúmenes una lista de cambios de asistencia, tuplas
+    (estudiante_id, clase_id, fecha, estado_anterior, estado_nuevo); un
+    estado None significa que el registro no existía o se borró.
+    """
+    # Un estudiante puede repetir la misma transición en varios días del
+    # mes: se agrupa también por cuántas veces, que es lo que se suma
+    veces = Counter(
+        (clase_id, _mes(fecha), anterior, nuevo, estudiante_id)
+        for estudiante_id, clase_id, fecha, anterior, nuevo in cambios
+        if anterior != nuevo
+    )
+    if not veces:
+        return
+    grupos = defaultdict(list)
+    for (clase_id, mes, anterior, nuevo, estudiante_id), n in veces.items():
+        grupos[(clase_id, mes, anterior, nuevo, n)].append(estudiante_id)
+
+    # Las filas que van a recibir un +n deben existir
+    por_clase, por_mes = set(), set()
+    for (clase_id, mes, _, nuevo, _), ids in grupos.items():
+        if nuevo:
+            por_clase.update((estudiante_id, clase_id) for estudiante_id in ids)
+            por_mes.update((estudiante_id, clase_id, mes) for estudiante_id in ids)
+    ResumenAsistencia.objects.bulk_create(
+        [ResumenAsistencia(estudiante_id=e, clase_id=c) for e, c in por_clase],
+        ignore_conflicts=True,
+    )
+    ResumenAsistenciaMensual.objects.bulk_create(
+        [ResumenAsistenciaMensual(estudiante_id=e, clase_id=c, mes=m) for e, c, m in por_mes],
+        ignore_conflicts=True,
+    )
+
+    quitados = []
+    for (clase_id, mes, anterior, nuevo, n), ids in grupos.items():
+        delta = {}
+        if anterior:
+            delta[CAMPO_POR_ESTADO[anterior]] = F(CAMPO_POR_ESTADO[anterior]) - n
+        if nuevo:
+            delta[CAMPO_POR_ESTADO[nuevo]] = F(CAMPO_POR_ESTADO[nuevo]) + n
+        else:
+            quitados.append((clase_id, mes, ids))
+        ResumenAsistencia.objects.filter(clase_id=clase_id, estudiante_id__in=ids).update(**delta)
+        ResumenAsistenciaMensual.objects.filter(clase_id=clase_id, mes=mes, estudiante_id__in=ids).update(**delta)
+
+    # Un registro borrado (o movido de fecha) puede dejar resúmenes en cero
+    vacio = {campo: 0 for campo in CAMPO_POR_ESTADO.values()}
+    for clase_id, mes, ids in quitados:
+        ResumenAsistencia.objects.filter(clase_id=clase_id, estudiante_id__in=ids, **vacio).delete()
+        ResumenAsistenciaMensual.objects.filter(clase_id=clase_id, mes=mes, estudiante_id__in=ids, **vacio).delete()
+
+
+def guardar_asistencias_lote(clase, registros):
+    """
+    Guarda varios días de asistencia de `clase` de una vez. `registros` es
+    un dict (estudiante_id, fecha) -> estado; se ignoran los estudiantes
+    que no están inscritos en la clase. Devuelve cuántas filas se escribieron.
+    """
+    inscritos = set(clase.estudiantes.values_list('pk', flat=True))
+    fechas = {fecha for _, fecha in registros}
+    with transaction.atomic():
+        # Bloquear la clase serializa dos envíos simultáneos de la misma
+        # hoja, que si no contarían dos veces el mismo cambio en el resumen
+        Clase.objects.select_for_update().get(pk=clase.pk)
+        asistencia_map = {
+            (estudiante_id, fecha): estado
+            for estudiante_id, fecha, estado in AsistenciaClase.objects.filter(
+                clase=clase, fecha__in=fechas,
+            ).values_list('estudiante_id', 'fecha', 'estado')
+        }
+        cambios = [
+            AsistenciaClase(clase=clase, estudiante_id=estudiante_id, fecha=fecha, estado=estado)
+            for (estudiante_id, fecha), estado in registros.items()
+            if estudiante_id in inscritos and asistencia_map.get((estudiante_id, fecha)) != estado
+        ]
+        if cambios:
+            opciones = {'update_conflicts': True, 'update_fields': ['estado']}
+            # MySQL (ON DUPLICATE KEY UPDATE) no acepta indicar la clave única
+            if connection.features.supports_update_conflicts_with_target:
+                opciones['unique_fields'] = ['clase', 'estudiante', 'fecha']
+            AsistenciaClase.objects.bulk_create(cambios, batch_size=1000, **opciones)
+            # bulk_create no dispara las señales: el resumen se ajusta aquí
+            actualizar_resumenes(
+                (a.estudiante_id, clase.pk, a.fecha, asistencia_map.get((a.estudiante_id, a.fecha)), a.estado)
+                for a in cambios
+            )
+    return len(cambios)
+
+
+def guardar_asistencias(clase, fecha, estados):
+    """
+    Guarda la asistencia de `clase` en `fecha`. `estados` es un dict
+    estudiante_id -> estado. Devuelve cuántas filas se escribieron.
+    """
+    return guardar_asistencias_lote(
+        clase, {(estudiante_id, fecha): estado for estudiante_id, estado in estados.items()},
+    )
+
+
+def _conteos():
+    return {
+        campo: Count('pk', filter=Q(estado=estado))
+        for estado, campo in CAMPO_POR_ESTADO.items()
+    }
+
+
+def reconstruir_resumenes_asistencia(clases=None, tamano_lote=200):
+    """
+    Recalcula los resúmenes de asistencia desde AsistenciaClase, por lotes
+    de `tamano_lote` clases (cada lote en su propia transacción). Devuelve
+    (clases_procesadas, resumenes_creados).
+    """
+    if clases is None:
+        clases = Clase.objects.all()
+
+    procesadas = creados = 0
+    for ids in _lotes_de_ids(clases, tamano_lote):
+        with transaction.atomic():
+            list(Clase.objects.select_for_update().filter(pk__in=ids).values_list('pk', flat=True))
+            registros = AsistenciaClase.objects.filter(clase_id__in=ids).order_by()
+
+            ResumenAsistencia.objects.filter(clase_id__in=ids).delete()
+            resumenes = [
+                ResumenAsistencia(**fila)
+                for fila in registros.values('estudiante_id', 'clase_id').annotate(**_conteos())
+            ]
+            ResumenAsistencia.objects.bulk_create(resumenes, batch_size=1000)
+
+            ResumenAsistenciaMensual.objects.filter(clase_id__in=ids).delete()
+            mensuales = [
+                ResumenAsistenciaMensual(**fila)
+                for fila in registros.annotate(mes=TruncMonth('fecha')).values('estudiante_id', 'clase_id', 'mes').annotate(**_conteos())
+            ]
+            ResumenAsistenciaMensual.objects.bulk_create(mensuales, batch_size=1000)
+        procesadas += len(ids)
+        creados += len(resumenes)
+    return procesadas, creados
+
+
+def _sumas():
+    return {campo: Sum(campo) for campo in CAMPO_POR_ESTADO.values()}
+
+
+def con_tasa_asistencia(clases, estudiante=None):
+    """
+    Devuelve las `clases` como lista, cada una con el atributo
+    `tasa_asistencia` (del `estudiante` o de toda la clase), leído de los
+    resúmenes en una sola consulta.
+    """
+    clases = list(clases)
+    resumenes = ResumenAsistencia.objects.filter(clase__in=[clase.pk for clase in clases])
+    if estudiante is not None:
+        resumenes = resumenes.filter(estudiante=estudiante)
+    tasas = {
+        fila['clase_id']: tasa_asistencia(fila['presentes'], fila['ausentes'], fila['tardanzas'])
+        for fila in resumenes.values('clase_id').annotate(**_sumas()).order_by()
+    }
+    for clase in clases:
+        clase.tasa_asistencia = tasas.get(clase.pk)
+    return clases
+
+
+def asistencia_del_periodo(estudiante, periodo):
+    """
+    Asistencia del estudiante en el periodo: un dict con la `tasa` total y
+    la lista `meses` (mes, conteos y tasa de cada mes).
+    """
+    meses = list(
+        ResumenAsistenciaMensual.objects.filter(estudiante=estudiante, clase__periodo=periodo)
+        .values('mes').annotate(**_sumas()).order_by('mes')
+    )
+    for fila in meses:
+        fila['tasa'] = tasa_asistencia(fila['presentes'], fila['ausentes'], fila['tardanzas'])
+    totales = {campo: sum(fila[campo] for fila in meses) for campo in CAMPO_POR_ESTADO.values()}
+    return {
+        **totales,
+        'tasa': tasa_asistencia(totales['presentes'], totales['ausentes'], totales['tardanzas']),
+        'meses': meses,
+    }
+
+
+ESTADOS_AUSENCIA = [AsistenciaClase.EstadoAsistencia.AUSENTE, AsistenciaClase.EstadoAsistencia.JUSTIFICADO]
+
+
+def detectar_ausentismo(dias=20, umbral=10, minimo_registros=5, hoy=None, notificar=True):
+    """
+    Marca a los estudiantes con ausentismo crónico: los que faltaron (con o
+    sin justificación) a más del `umbral` % de sus registros de asistencia
+    en los últimos `dias` días lectivos (días con asistencia registrada en
+    la escuela) hasta `hoy`.
+
+    Todo sale de una consulta agrupada por estudiante sobre el índice de
+    fecha. Guarda una AlertaAusentismo por estudiante (si se vuelve a correr
+    el mismo día, se actualiza) y, si hay estudiantes que no tenían una
+    alerta pendiente, envía una Notificacion a los maestros. Devuelve
+    (alertas, nuevas).
+    """
+    hoy = hoy or timezone.localdate()
+    fechas = list(
+        AsistenciaClase.objects.filter(fecha__lte=hoy).order_by('-fecha')
+        .values_list('fecha', flat=True).distinct()[:dias]
+    )
+    if not fechas:
+        return [], []
+    desde, hasta = fechas[-1], fechas[0]
+
+    por_estudiante = (
+        AsistenciaClase.objects.filter(fecha__range=(desde, hasta)).order_by()
+        .values('estudiante_id')
+        .annotate(registros=Count('pk'), ausencias=Count('pk', filter=Q(estado__in=ESTADOS_AUSENCIA)))
+        .filter(registros__gte=minimo_registros)
+    )
+    alertas = []
+    for fila in por_estudiante:
+        tasa = Decimal(fila['ausencias'] * 100) / fila['registros']
+        if tasa >= umbral:
+            alertas.append(AlertaAusentismo(
+                estudiante_id=fila['estudiante_id'], desde=desde, hasta=hasta,
+                registros=fila['registros'], ausencias=fila['ausencias'],
+                tasa_ausencia=tasa.quantize(Decimal('0.1')),
+            ))
+    if not alertas:
+        return [], []
+
+    with transaction.atomic():
+        # Los que ya tenían una alerta sin atender no se vuelven a anunciar
+        pendientes = set(
+            AlertaAusentismo.objects.filter(atendida=False, hasta__lte=hasta).values_list('estudiante_id', flat=True)
+        )
+        nuevas = [alerta for alerta in alertas if alerta.estudiante_id not in pendientes]
+
+        opciones = {'update_conflicts': True, 'update_fields': ['desde', 'registros', 'ausencias', 'tasa_ausencia']}
+        if connection.features.supports_update_conflicts_with_target:
+            opciones['unique_fields'] = ['estudiante', 'hasta']
+        AlertaAusentismo.objects.bulk_create(alertas, batch_size=1000, **opciones)
+
+        if notificar and nuevas:
+            Notificacion.objects.create(
+                audiencia=Notificacion.TargetAudiencia.MAESTROS,
+                mensaje=(
+                    f"Alerta de ausentismo: {len(nuevas)} estudiante(s) faltaron a más del {umbral}% "
+                    f"de sus clases entre el {desde:%d/%m/%Y} y el {hasta:%d/%m/%Y}. "
+                    "Consulte la lista en Alertas de Ausentismo."
+                ),
+            )
+    return alertas, nuevas
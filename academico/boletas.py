@@ -0,0 +1,104 @@
+"""
+Boletas de calificaciones en PDF para un grado o un periodo completo.
+
+Los datos salen de los resúmenes de calificaciones y de asistencia con
+unas pocas consultas agrupadas por lote de estudiantes, la plantilla se
+compila una sola vez y cada boleta se renderiza a HTML en este proceso. Lo caro,
+HTML.write_pdf, se reparte entre los procesos de un ProcessPoolExecutor;
+los PDF se van agregando a un ZIP que se envía en streaming.
+
+Antes de crear el pool se cierran las conexiones a la base de datos, para
+que los procesos hijos no hereden el socket abierto del padre (que la
+vuelve a abrir en la siguiente consulta). Desde el admin se usan pocos
+procesos y solo para lotes chicos; los grandes van por el comando
+generar_boletas.
+"""
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections
+from django.db.models import Sum
+from django.template.loader import get_template
+from django.utils import timezone
+
+from users.models import Estudiante
+
+from .calificaciones import notas_finales_por_curso
+from .exportacion import _Buffer
+from .models import Clase, ResumenAsistencia, tasa_asistencia
+from .pdf import escribir_pdf
+
+PLANTILLA_BOLETA = 'academico/boleta_pdf.html'
+
+
+def estudiantes_del_periodo(periodo):
+    """Estudiantes inscritos en alguna clase del periodo."""
+    inscritos = Clase.estudiantes.through.objects.filter(clase__periodo=periodo).values('estudiante_id')
+    return Estudiante.objects.filter(pk__in=inscritos)
+
+
+def _datos_de_boletas(periodo, estudiantes):
+    """Promedios por curso y tasa de asistencia de cada estudiante del lote."""
+    ids = [estudiante.pk for estudiante in estudiantes]
+    cursos = notas_finales_por_curso(ids, periodo)
+    asistencia = {
+        fila['estudiante_id']: tasa_asistencia(fila['presentes'], fila['ausentes'], fila['tardanzas'])
+        for fila in ResumenAsistencia.objects.filter(clase__periodo=periodo, estudiante_id__in=ids)
+        .values('estudiante_id')
+        .annotate(presentes=Sum('presentes'), ausentes=Sum('ausentes'), tardanzas=Sum('tardanzas')).order_by()
+    }
+    return cursos, asistencia
+
+
+def generar_boletas(periodo, estudiantes, procesos=None, tamano_lote=200):
+    """
+    Genera las boletas del `periodo` para `estudiantes` (un queryset) como
+    pares (nombre_de_archivo, bytes_del_pdf), en orden alfabético.
+    `procesos` limita los procesos del pool (por defecto, uno por CPU).
+    """
+    plantilla = get_template(PLANTILLA_BOLETA)
+    fecha_generacion = timezone.localdate()
+    estudiantes = estudiantes.select_related('user', 'grado').order_by('user__last_name', 'user__first_name', 'pk')
+
+    # Los hijos no usan la base de datos: que no se lleven la conexión del padre
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        lote = []
+        for estudiante in estudiantes.iterator(chunk_size=tamano_lote):
+            lote.append(estudiante)
+            if len(lote) >= tamano_lote:
+                yield from _boletas_del_lote(pool, plantilla, periodo, lote, fecha_generacion)
+                lote = []
+        if lote:
+            yield from _boletas_del_lote(pool, plantilla, periodo, lote, fecha_generacion)
+
+
+def _boletas_del_lote(pool, plantilla, periodo, estudiantes, fecha_generacion):
+    cursos, asistencia = _datos_de_boletas(periodo, estudiantes)
+    documentos = [
+        plantilla.render({
+            'estudiante': estudiante,
+            'periodo': periodo,
+            'reporte_notas': cursos.get(estudiante.pk, []),
+            'tasa_asistencia': asistencia.get(estudiante.pk),
+            'fecha_generacion': fecha_generacion,
+        })
+        for estudiante in estudiantes
+    ]
+    pdfs = pool.map(escribir_pdf, documentos, chunksize=4)
+    for estudiante, pdf in zip(estudiantes, pdfs):
+        yield f"boleta_{estudiante.matricula}.pdf", pdf
+
+
+def zip_de_boletas(boletas):
+    """
+    Empaqueta los pares (nombre, pdf) en un ZIP que se genera como bytes,
+    archivo por archivo. Los PDF ya vienen comprimidos: se guardan sin
+    volver a comprimir.
+    """
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archivo:
+        for nombre, pdf in boletas:
+            archivo.writestr(nombre, pdf)
+            yield buffer.vaciar()
+    yield buffer.vaciar()
@@ -0,0 +1,452 @@
+"""
+Libro de calificaciones de una clase: la matriz estudiantes x actividades.
+
+Las notas salen de una sola consulta sobre Entrega filtrada por
+actividad__clase y se acomodan en memoria: cada estudiante y cada
+actividad tienen un índice de fila o de columna, y cada entrega va a su
+celda. Con las actividades y los estudiantes, la página completa cuesta
+tres consultas sin importar el tamaño de la clase.
+
+ResumenCalificaciones guarda la suma y la cantidad de notas de cada
+estudiante en cada clase; cada nota guardada les suma o resta con
+UPDATE ... F(), así que los promedios del estudiante y la boleta se leen
+ya agregados. reconstruir_resumen_calificaciones() los concilia con las
+entregas.
+
+Los cursos con categorías de calificación (CategoriaCalificacion) no usan
+el promedio simple sino uno ponderado: el promedio de cada categoría por
+su peso. Se calcula al vuelo con NumPy sobre una matriz (estudiante,
+clase) x categoría, así que un cambio de pesos se ve de inmediato.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Sum, Value, When
+
+from .finanzas import _lotes_de_ids
+from .models import Actividad, CategoriaCalificacion, Clase, Entrega, ResumenCalificaciones
+
+DOS_DECIMALES = Decimal('0.01')
+
+
+def _promedio(notas):
+    notas = [nota for nota in notas if nota is not None]
+    if not notas:
+        return None
+    return (sum(notas) / len(notas)).quantize(DOS_DECIMALES)
+
+
+def libro_de_calificaciones(clase):
+    """
+    Devuelve un dict con las `actividades` (columnas), las `filas` (una por
+    estudiante, con sus `celdas` y su `promedio`), los `promedios` de cada
+    columna y el `promedio_general` de la clase.
+    """
+    actividades = list(Actividad.objects.filter(clase=clase).select_related('categoria').order_by('fecha_entrega', 'pk'))
+    estudiantes = list(
+        clase.estudiantes.select_related('user').order_by('user__last_name', 'user__first_name')
+    )
+    columna = {actividad.pk: j for j, actividad in enumerate(actividades)}
+    fila = {estudiante.pk: i for i, estudiante in enumerate(estudiantes)}
+
+    matriz = [[None] * len(actividades) for _ in estudiantes]
+    notas = []
+    for entrega_id, estudiante_id, actividad_id, calificacion in Entrega.objects.filter(
+        actividad__clase=clase,
+    ).values_list('pk', 'estudiante_id', 'actividad_id', 'calificacion'):
+        if estudiante_id in fila:
+            matriz[fila[estudiante_id]][columna[actividad_id]] = (entrega_id, calificacion)
+            if calificacion is not None:
+                notas.append((estudiante_id, actividad_id, calificacion))
+    finales = _notas_finales(
+        notas,
+        [(actividad.pk, clase.pk, actividad.categoria_id) for actividad in actividades],
+        {clase.pk: clase.curso_id},
+        _categorias_por_curso([clase.curso_id]),
+    )
+
+    filas = []
+    for estudiante, celdas in zip(estudiantes, matriz):
+        filas.append({
+            'estudiante': estudiante,
+            'celdas': [
+                {'actividad': actividad, 'entrega_id': celda[0] if celda else None, 'calificacion': celda[1] if celda else None}
+                for actividad, celda in zip(actividades, celdas)
+            ],
+            'promedio': finales.get((estudiante.pk, clase.pk)),
+        })
+
+    promedios = [
+        _promedio(celdas[j][1] if celdas[j] else None for celdas in matriz)
+        for j in range(len(actividades))
+    ]
+    return {
+        'actividades': actividades,
+        'filas': filas,
+        'promedios': promedios,
+        'promedio_general': _promedio(fila['promedio'] for fila in filas),
+    }
+
+
+def guardar_calificaciones(clase, cambios):
+    """
+    Guarda varias notas de `clase` de una vez. `cambios` es un dict
+    (estudiante_id, actividad_id) -> calificación (None la borra). Las
+    celdas sin entrega crean una (actividades calificadas en el aula).
+    Se ignoran estudiantes y actividades ajenos a la clase. Devuelve
+    cuántas notas se escribieron.
+
+    Las entregas que se crean quedan marcadas como solo_calificacion, para
+    no mostrarlas como entregadas por el estudiante.
+    """
+    inscritos = set(clase.estudiantes.values_list('pk', flat=True))
+    actividades = set(Actividad.objects.filter(clase=clase).values_list('pk', flat=True))
+    cambios = {
+        (estudiante_id, actividad_id): nota
+        for (estudiante_id, actividad_id), nota in cambios.items()
+        if estudiante_id in inscritos and actividad_id in actividades
+    }
+    if not cambios:
+        return 0
+
+    with transaction.atomic():
+        existentes = {
+            (entrega.estudiante_id, entrega.actividad_id): entrega
+            # Bloqueadas, para que la nota anterior que se resta sea la vigente
+            for entrega in Entrega.objects.select_for_update().filter(
+                actividad_id__in={actividad_id for _, actividad_id in cambios},
+                estudiante_id__in={estudiante_id for estudiante_id, _ in cambios},
+            )
+        }
+        anteriores = {entrega.pk: entrega.calificacion for entrega in existentes.values()}
+        actualizadas, nuevas = [], []
+        for (estudiante_id, actividad_id), nota in cambios.items():
+            entrega = existentes.get((estudiante_id, actividad_id))
+            if entrega is None:
+                if nota is not None:
+                    nuevas.append(Entrega(
+                        estudiante_id=estudiante_id, actividad_id=actividad_id, calificacion=nota, solo_calificacion=True,
+                    ))
+            elif entrega.calificacion != nota:
+                entrega.calificacion = nota
+                entrega.version += 1
+                actualizadas.append(entrega)
+        if nuevas:
+            Entrega.objects.bulk_create(nuevas, batch_size=500, ignore_conflicts=True)
+            # Si el estudiante entregó entre la lectura y el INSERT, su fila
+            # ganó: se relee y se califica como las demás
+            notas = {(entrega.estudiante_id, entrega.actividad_id): entrega.calificacion for entrega in nuevas}
+            nuevas = []
+            for entrega in Entrega.objects.select_for_update().filter(
+                actividad_id__in={actividad_id for _, actividad_id in notas},
+                estudiante_id__in={estudiante_id for estudiante_id, _ in notas},
+            ).exclude(pk__in=anteriores):
+                clave = (entrega.estudiante_id, entrega.actividad_id)
+                if clave not in notas:
+                    continue
+                if entrega.solo_calificacion:
+                    nuevas.append(entrega)
+                elif entrega.calificacion != notas[clave]:
+                    anteriores[entrega.pk] = entrega.calificacion
+                    entrega.calificacion = notas[clave]
+                    entrega.version += 1
+                    actualizadas.append(entrega)
+        Entrega.objects.bulk_update(actualizadas, ['calificacion', 'version'], batch_size=500)
+        # bulk_update y bulk_create no disparan las señales: el resumen se ajusta aquí
+        actualizar_resumen_calificaciones(
+            [(e.estudiante_id, clase.pk, anteriores[e.pk], e.calificacion) for e in actualizadas]
+            + [(e.estudiante_id, clase.pk, None, e.calificacion) for e in nuevas]
+        )
+    return len(actualizadas) + len(nuevas)
+
+
+def calificar_entregas(actividad, calificaciones):
+    """
+    Guarda de una vez las notas y comentarios de las entregas de
+    `actividad`. `calificaciones` es un dict entrega_id -> (version,
+    calificación, comentarios_maestro), con la `version` que tenía cada
+    entrega cuando se cargó el formulario.
+
+    Es todo o nada: si una entrega cambia respecto de lo guardado y su
+    versión ya no es la leída (otra pestaña la calificó mientras tanto), no
+    se guarda ninguna. Las filas que no cambian no cuentan como conflicto.
+    Devuelve (guardadas, conflictos), con los pk de las entregas en conflicto.
+    """
+    with transaction.atomic():
+        entregas = list(
+            Entrega.objects.select_for_update().filter(actividad=actividad, pk__in=calificaciones).order_by('pk')
+        )
+        cambiadas, conflictos = [], []
+        for entrega in entregas:
+            version, calificacion, comentarios = calificaciones[entrega.pk]
+            if (entrega.calificacion, entrega.comentarios_maestro) == (calificacion, comentarios):
+                continue
+            if entrega.version != version:
+                conflictos.append(entrega.pk)
+            cambiadas.append(entrega)
+        if conflictos:
+            return 0, conflictos
+
+        notas = []
+        for entrega in cambiadas:
+            _, calificacion, comentarios = calificaciones[entrega.pk]
+            notas.append((entrega.estudiante_id, actividad.clase_id, entrega.calificacion, calificacion))
+            entrega.calificacion, entrega.comentarios_maestro = calificacion, comentarios
+            entrega.version += 1
+        Entrega.objects.bulk_update(cambiadas, ['calificacion', 'comentarios_maestro', 'version'], batch_size=500)
+        # bulk_update no dispara las señales: el resumen se ajusta aquí
+        actualizar_resumen_calificaciones(notas)
+    return len(cambiadas), []
+
+
+def actualizar_resumen_calificaciones(cambios):
+    """
+    Aplica a ResumenCalificaciones una lista de cambios de nota, tuplas
+    (estudiante_id, clase_id, nota_anterior, nota_nueva); una nota None
+    significa que no había nota o que se quitó.
+    """
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    crear, vaciados = set(), defaultdict(set)
+    for estudiante_id, clase_id, anterior, nueva in cambios:
+        if anterior == nueva:
+            continue
+        delta = deltas[(clase_id, estudiante_id)]
+        if anterior is not None:
+            delta[0] -= anterior
+            delta[1] -= 1
+            vaciados[clase_id].add(estudiante_id)
+        if nueva is not None:
+            delta[0] += nueva
+            delta[1] += 1
+            crear.add((clase_id, estudiante_id))
+    if not deltas:
+        return
+
+    # Las filas que van a recibir una nota deben existir
+    ResumenCalificaciones.objects.bulk_create(
+        [ResumenCalificaciones(clase_id=c, estudiante_id=e) for c, e in crear],
+        ignore_conflicts=True,
+    )
+
+    # Un UPDATE por clase, con el delta de cada estudiante en un CASE
+    por_clase = defaultdict(dict)
+    for (clase_id, estudiante_id), delta in deltas.items():
+        if delta != [0, 0]:
+            por_clase[clase_id][estudiante_id] = delta
+    for clase_id, por_estudiante in por_clase.items():
+        ResumenCalificaciones.objects.filter(
+            clase_id=clase_id, estudiante_id__in=por_estudiante,
+        ).update(
+            suma=F('suma') + Case(
+                *[When(estudiante_id=e, then=Value(d[0])) for e, d in por_estudiante.items()],
+                default=Value(0), output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            cantidad=F('cantidad') + Case(
+                *[When(estudiante_id=e, then=Value(d[1])) for e, d in por_estudiante.items()],
+                default=Value(0), output_field=IntegerField(),
+            ),
+        )
+
+    # Quitar notas puede dejar resúmenes sin ninguna
+    for clase_id, ids in vaciados.items():
+        ResumenCalificaciones.objects.filter(clase_id=clase_id, estudiante_id__in=ids, cantidad=0).delete()
+
+
+def reconstruir_resumen_calificaciones(clases=None, tamano_lote=200):
+    """
+    Concilia ResumenCalificaciones con las notas de las entregas, por lotes
+    de `tamano_lote` clases (cada lote en su propia transacción): crea los
+    que faltan, corrige los que difieren y borra los que sobran. Devuelve
+    (clases_procesadas, resumenes_corregidos).
+    """
+    if clases is None:
+        clases = Clase.objects.all()
+
+    procesadas = corregidos = 0
+    for ids in _lotes_de_ids(clases, tamano_lote):
+        with transaction.atomic():
+            # Primero se bloquean los resúmenes: una nota que se guarde
+            # mientras tanto espera y suma sobre los valores ya conciliados
+            actuales = {
+                (resumen.clase_id, resumen.estudiante_id): resumen
+                for resumen in ResumenCalificaciones.objects.select_for_update().filter(clase_id__in=ids)
+            }
+            esperados = {
+                (fila['actividad__clase_id'], fila['estudiante_id']): (fila['suma'], fila['cantidad'])
+                for fila in Entrega.objects.filter(actividad__clase_id__in=ids, calificacion__isnull=False)
+                .values('actividad__clase_id', 'estudiante_id')
+                .annotate(suma=Sum('calificacion'), cantidad=Count('pk')).order_by()
+            }
+
+            sobrantes = [resumen.pk for clave, resumen in actuales.items() if clave not in esperados]
+            faltantes, distintos = [], []
+            for (clase_id, estudiante_id), (suma, cantidad) in esperados.items():
+                resumen = actuales.get((clase_id, estudiante_id))
+                if resumen is None:
+                    faltantes.append(ResumenCalificaciones(
+                        clase_id=clase_id, estudiante_id=estudiante_id, suma=suma, cantidad=cantidad,
+                    ))
+                elif (resumen.suma, resumen.cantidad) != (suma, cantidad):
+                    resumen.suma, resumen.cantidad = suma, cantidad
+                    distintos.append(resumen)
+            ResumenCalificaciones.objects.filter(pk__in=sobrantes).delete()
+            ResumenCalificaciones.objects.bulk_create(faltantes, batch_size=1000)
+            ResumenCalificaciones.objects.bulk_update(distintos, ['suma', 'cantidad'], batch_size=1000)
+        procesadas += len(ids)
+        corregidos += len(sobrantes) + len(faltantes) + len(distintos)
+    return procesadas, corregidos
+
+
+def _categorias_por_curso(cursos):
+    """curso_id -> lista de (categoria_id, peso), en un orden fijo."""
+    categorias = defaultdict(list)
+    for categoria_id, curso_id, peso in CategoriaCalificacion.objects.filter(
+        curso_id__in=cursos,
+    ).order_by('curso_id', 'pk').values_list('pk', 'curso_id', 'peso'):
+        categorias[curso_id].append((categoria_id, peso))
+    return categorias
+
+
+def _notas_finales(notas, actividades, curso_de_clase, categorias_por_curso):
+    """
+    Nota final de cada (estudiante, clase), en una pasada con NumPy.
+
+    `notas` son tuplas (estudiante_id, actividad_id, calificación),
+    `actividades` tuplas (actividad_id, clase_id, categoria_id). Cada
+    (estudiante, clase) es una fila de la matriz y cada categoría del curso
+    una columna; un curso sin categorías tiene una sola columna de peso 1
+    (el promedio simple). En un curso con categorías no cuentan las
+    actividades sin categoría, y las categorías sin notas no pesan.
+    """
+    if not notas or not actividades:
+        return {}
+
+    clases = sorted(curso_de_clase)
+    indice_clase = {clase_id: i for i, clase_id in enumerate(clases)}
+    columnas = max([len(categorias) for categorias in categorias_por_curso.values()] + [1])
+    pesos = np.zeros((len(clases), columnas))
+    columna_de = {}
+    for i, clase_id in enumerate(clases):
+        categorias = categorias_por_curso.get(curso_de_clase[clase_id])
+        if categorias:
+            for j, (categoria_id, peso) in enumerate(categorias):
+                pesos[i, j] = float(peso)
+                columna_de[(clase_id, categoria_id)] = j
+        else:
+            pesos[i, 0] = 1.0
+
+    actividades = sorted(actividades)
+    id_actividad = np.array([actividad_id for actividad_id, _, _ in actividades], dtype=np.int64)
+    clase_de_actividad = np.array([indice_clase[clase_id] for _, clase_id, _ in actividades], dtype=np.int64)
+    columna_de_actividad = np.array([
+        columna_de.get((clase_id, categoria_id), -1) if categorias_por_curso.get(curso_de_clase[clase_id]) else 0
+        for _, clase_id, categoria_id in actividades
+    ], dtype=np.int64)
+
+    estudiante, actividad, nota = zip(*notas)
+    estudiante = np.array(estudiante, dtype=np.int64)
+    actividad = np.array(actividad, dtype=np.int64)
+    nota = np.array(nota, dtype=np.float64)
+    posicion = np.searchsorted(id_actividad, actividad)
+    posicion = np.minimum(posicion, len(id_actividad) - 1)
+    validas = (id_actividad[posicion] == actividad) & (columna_de_actividad[posicion] >= 0)
+    estudiante, nota, posicion = estudiante[validas], nota[validas], posicion[validas]
+    if not len(nota):
+        return {}
+    clase, columna = clase_de_actividad[posicion], columna_de_actividad[posicion]
+
+    # Una fila por cada (estudiante, clase) con notas
+    claves, fila = np.unique(estudiante * len(clases) + clase, return_inverse=True)
+    celda = fila * columnas + columna
+    sumas = np.bincount(celda, weights=nota, minlength=len(claves) * columnas).reshape(-1, columnas)
+    cantidades = np.bincount(celda, minlength=len(claves) * columnas).reshape(-1, columnas)
+
+    peso = np.where(cantidades > 0, pesos[claves % len(clases)], 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        medias = np.where(cantidades > 0, sumas / cantidades, 0.0)
+        finales = (medias * peso).sum(axis=1) / peso.sum(axis=1)
+
+    return {
+        (int(clave // len(clases)), clases[clave % len(clases)]): Decimal(f"{final:.2f}")
+        for clave, final in zip(claves.tolist(), finales.tolist())
+        if final == final  # NaN: solo tenía notas en categorías de peso cero
+    }
+
+
+def calificaciones_finales(clases, estudiantes=None):
+    """
+    Nota final ponderada de cada estudiante en cada una de las `clases`
+    (queryset o lista de pk), opcionalmente solo de los `estudiantes`
+    indicados: un dict (estudiante_id, clase_id) -> Decimal. Cuesta cuatro
+    consultas sin importar cuántas clases o notas haya.
+    """
+    curso_de_clase = dict(Clase.objects.filter(pk__in=clases).values_list('pk', 'curso_id'))
+    if not curso_de_clase:
+        return {}
+    actividades = list(
+        Actividad.objects.filter(clase_id__in=curso_de_clase).values_list('pk', 'clase_id', 'categoria_id')
+    )
+    entregas = Entrega.objects.filter(actividad__clase_id__in=curso_de_clase, calificacion__isnull=False)
+    if estudiantes is not None:
+        entregas = entregas.filter(estudiante_id__in=estudiantes)
+    notas = list(entregas.values_list('estudiante_id', 'actividad_id', 'calificacion'))
+    return _notas_finales(notas, actividades, curso_de_clase, _categorias_por_curso(set(curso_de_clase.values())))
+
+
+def notas_finales_por_curso(estudiantes, periodo=None):
+    """
+    Nota final de cada estudiante (lista de pk) en cada curso del
+    `periodo`, si se indica: un dict estudiante_id -> lista de dicts
+    `curso` y `promedio` ordenada por curso.
+
+    Los cursos sin categorías se leen de ResumenCalificaciones; solo los
+    ponderados pasan por calificaciones_finales. Si el estudiante tiene
+    varias clases del mismo curso, se promedian sus notas finales.
+    """
+    resumenes = ResumenCalificaciones.objects.filter(estudiante_id__in=estudiantes, cantidad__gt=0)
+    if periodo is not None:
+        resumenes = resumenes.filter(clase__periodo=periodo)
+    filas = list(resumenes.values(
+        'estudiante_id', 'clase_id', 'suma', 'cantidad', curso_id=F('clase__curso_id'), curso=F('clase__curso__nombre'),
+    ))
+    ponderados = set(
+        CategoriaCalificacion.objects.filter(curso_id__in={fila['curso_id'] for fila in filas})
+        .values_list('curso_id', flat=True)
+    )
+    finales = {}
+    if ponderados:
+        finales = calificaciones_finales(
+            {fila['clase_id'] for fila in filas if fila['curso_id'] in ponderados}, estudiantes=estudiantes,
+        )
+
+    por_curso = defaultdict(lambda: {'suma': Decimal('0'), 'cantidad': 0, 'finales': []})
+    for fila in filas:
+        datos = por_curso[(fila['estudiante_id'], fila['curso'])]
+        if fila['curso_id'] in ponderados:
+            final = finales.get((fila['estudiante_id'], fila['clase_id']))
+            if final is not None:
+                datos['finales'].append(final)
+        else:
+            datos['suma'] += fila['suma']
+            datos['cantidad'] += fila['cantidad']
+
+    resultado = defaultdict(list)
+    for (estudiante_id, curso), datos in sorted(por_curso.items()):
+        if datos['finales']:
+            promedio = sum(datos['finales']) / len(datos['finales'])
+        elif datos['cantidad']:
+            promedio = datos['suma'] / datos['cantidad']
+        else:
+            continue
+        resultado[estudiante_id].append({'curso': curso, 'promedio': promedio})
+    return resultado
+
+
+def promedios_por_curso(estudiante, periodo=None):
+    """
+    Nota final del estudiante en cada curso (del `periodo`, si se indica):
+    una lista de dicts `curso` y `promedio` ordenada por curso.
+    """
+    return notas_finales_por_curso([estudiante.pk], periodo).get(estudiante.pk, [])
@@ -0,0 +1,119 @@
+"""
+Clasificación de los estudiantes al cerrar un periodo: posición y
+percentil por nota final dentro de cada clase, de cada grado y del
+periodo completo.
+
+Las notas finales salen de calificaciones_finales (ponderadas por
+categoría); el promedio de un estudiante en su grado o en el periodo es
+el de sus notas finales ponderado por los créditos de cada curso. Las
+filas se guardan primero con su promedio y la base de datos las ordena
+con funciones de ventana (DenseRank y PercentRank) particionadas por
+ámbito, grado y clase. Los portales leen esa foto sin recalcular nada.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import DenseRank, PercentRank
+
+from users.models import Estudiante
+
+from .calificaciones import DOS_DECIMALES, calificaciones_finales
+from .models import Clase, ClasificacionEstudiante, PeriodoAcademico
+
+Ambito = ClasificacionEstudiante.Ambito
+
+
+def cerrar_periodo(periodo):
+    """
+    Cierra el `periodo` y guarda las clasificaciones de sus estudiantes
+    (reemplaza las anteriores si ya estaba cerrado). Devuelve cuántas
+    filas se guardaron.
+    """
+    with transaction.atomic():
+        # Dos cierres simultáneos del mismo periodo se esperan uno al otro
+        list(PeriodoAcademico.objects.select_for_update().filter(pk=periodo.pk).values_list('pk', flat=True))
+        creditos = dict(Clase.objects.filter(periodo=periodo).values_list('pk', 'curso__creditos'))
+        finales = calificaciones_finales(list(creditos))
+        grado_de = dict(
+            Estudiante.objects.filter(pk__in={estudiante_id for estudiante_id, _ in finales}, grado__periodo=periodo)
+            .values_list('pk', 'grado_id')
+        )
+
+        filas = []
+        ponderado = defaultdict(lambda: [Decimal('0'), 0])
+        for (estudiante_id, clase_id), final in finales.items():
+            filas.append(ClasificacionEstudiante(
+                periodo=periodo, estudiante_id=estudiante_id, ambito=Ambito.CLASE, clase_id=clase_id, promedio=final,
+            ))
+            # Un curso sin créditos cuenta como uno, para no desaparecer del promedio
+            peso = creditos[clase_id] or 1
+            ponderado[estudiante_id][0] += final * peso
+            ponderado[estudiante_id][1] += peso
+        for estudiante_id, (suma, pesos) in ponderado.items():
+            promedio = (suma / pesos).quantize(DOS_DECIMALES)
+            filas.append(ClasificacionEstudiante(
+                periodo=periodo, estudiante_id=estudiante_id, ambito=Ambito.PERIODO, promedio=promedio,
+            ))
+            if estudiante_id in grado_de:
+                filas.append(ClasificacionEstudiante(
+                    periodo=periodo, estudiante_id=estudiante_id, ambito=Ambito.GRADO,
+                    grado_id=grado_de[estudiante_id], promedio=promedio,
+                ))
+
+        ClasificacionEstudiante.objects.filter(periodo=periodo).delete()
+        ClasificacionEstudiante.objects.bulk_create(filas, batch_size=1000)
+        _ordenar(periodo)
+
+        periodo.cerrado = True
+        periodo.save(update_fields=['cerrado'])
+    return len(filas)
+
+
+def _ordenar(periodo):
+    """Calcula posición, percentil y participantes con funciones de ventana."""
+    particion = [F('ambito'), F('grado_id'), F('clase_id')]
+    clasificaciones = list(
+        ClasificacionEstudiante.objects.filter(periodo=periodo).annotate(
+            posicion_calculada=Window(DenseRank(), partition_by=particion, order_by=F('promedio').desc()),
+            # Fracción de compañeros con promedio menor
+            fraccion=Window(PercentRank(), partition_by=particion, order_by=F('promedio').asc()),
+            total=Window(Count('pk'), partition_by=particion),
+        ).order_by()
+    )
+    for clasificacion in clasificaciones:
+        clasificacion.posicion = clasificacion.posicion_calculada
+        clasificacion.participantes = clasificacion.total
+        # Quien está solo en su grupo no tiene a nadie por encima
+        fraccion = 1 if clasificacion.total == 1 else clasificacion.fraccion
+        clasificacion.percentil = Decimal(fraccion * 100).quantize(Decimal('0.1'))
+    ClasificacionEstudiante.objects.bulk_update(
+        clasificaciones, ['posicion', 'percentil', 'participantes'], batch_size=1000,
+    )
+
+
+def clasificacion_del_estudiante(estudiante):
+    """
+    Clasificación del estudiante en el último periodo cerrado en que tiene
+    notas: un dict con el `periodo`, las filas de `periodo_general` y
+    `grado` (o None) y la lista `clases`; None si no hay ninguna.
+    """
+    periodo_id = (
+        ClasificacionEstudiante.objects.filter(estudiante=estudiante, periodo__cerrado=True)
+        .order_by('-periodo__fecha_inicio').values_list('periodo_id', flat=True).first()
+    )
+    if periodo_id is None:
+        return None
+    resultado = {'periodo': None, 'periodo_general': None, 'grado': None, 'clases': []}
+    for clasificacion in ClasificacionEstudiante.objects.filter(
+        estudiante=estudiante, periodo_id=periodo_id,
+    ).select_related('periodo', 'grado', 'clase__curso').order_by('clase__curso__nombre'):
+        resultado['periodo'] = clasificacion.periodo
+        if clasificacion.ambito == Ambito.CLASE:
+            resultado['clases'].append(clasificacion)
+        elif clasificacion.ambito == Ambito.GRADO:
+            resultado['grado'] = clasificacion
+        else:
+            resultado['periodo_general'] = clasificacion
+    return resultado
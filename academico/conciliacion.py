@@ -0,0 +1,212 @@
+"""
+Importación de estados de cuenta bancarios (CSV) como pagos.
+
+El archivo se lee fila por fila en lotes, así que nunca se carga completo
+en memoria. Columnas reconocidas (la primera fila es el encabezado):
+
+    matricula, referencia, monto, cargo (opcional)
+
+Si la fila trae `cargo` se aplica a ese cargo; si no, se aplica al cargo
+abierto más antiguo del estudiante cuyo saldo alcance para el monto.
+Las filas que no se pueden aplicar quedan como ExcepcionConciliacion,
+igual que las que no traen referencia: sin ella no hay forma de saber si
+el pago ya se importó antes.
+
+Los cargos se bloquean (select_for_update, en orden de pk) al cargarlos y
+su saldo se lee de las filas bloqueadas, así que ni otra importación ni un
+cajero con registrar_pago pueden pagar el mismo cargo mientras tanto.
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+
+from users.models import Estudiante
+
+from .finanzas import invalidar_antiguedad, marcar_vencidos, recalcular_saldos
+from .models import Cargo, ConciliacionBancaria, ExcepcionConciliacion, Pago
+
+ESTADOS_ABIERTOS = [Cargo.EstadoCargo.PENDIENTE, Cargo.EstadoCargo.VENCIDO]
+
+
+def _campo(fila, nombre):
+    """El valor limpio de una columna (las filas cortas traen None)."""
+    return (fila.get(nombre) or '').strip()
+
+
+def _bloquear(cargos):
+    """
+    Bloquea los `cargos` hasta el fin de la transacción, en orden de pk para
+    no trabarse con otra importación, y devuelve (pk, estudiante_id, saldo,
+    fecha_vencimiento) leídos de las filas ya bloqueadas.
+    """
+    return list(
+        cargos.select_for_update().order_by('pk').values_list('pk', 'estudiante_id', 'saldo', 'fecha_vencimiento')
+    )
+
+
+class _Conciliador:
+    """Mantiene el saldo disponible de cada cargo mientras se recorre el archivo."""
+
+    def __init__(self, conciliacion):
+        self.conciliacion = conciliacion
+        self.estudiantes = {}         # matricula -> estudiante_id (o None si no existe)
+        self.cargos_por_estudiante = {}  # estudiante_id -> [cargo_id, ...] por vencimiento
+        self.cargos = {}              # cargo_id -> (estudiante_id, saldo disponible)
+        self.referencias = set()      # referencias ya usadas (en la BD o en el archivo)
+
+    def _precargar(self, filas):
+        """Trae con pocas consultas lo que el lote necesita y aún no está en memoria."""
+        matriculas = {_campo(f, 'matricula') for _, f in filas} - set(self.estudiantes) - {''}
+        if matriculas:
+            encontrados = dict(Estudiante.objects.filter(matricula__in=matriculas).values_list('matricula', 'pk'))
+            for matricula in matriculas:
+                self.estudiantes[matricula] = encontrados.get(matricula)
+
+            nuevos = [pk for pk in encontrados.values() if pk not in self.cargos_por_estudiante]
+            for pk in nuevos:
+                self.cargos_por_estudiante[pk] = []
+            abiertos = sorted(
+                _bloquear(Cargo.objects.filter(estudiante_id__in=nuevos, estado__in=ESTADOS_ABIERTOS, saldo__gt=0)),
+                key=lambda cargo: (cargo[3], cargo[0]),
+            )
+            for cargo_id, estudiante_id, saldo, _ in abiertos:
+                self.cargos_por_estudiante[estudiante_id].append(cargo_id)
+                self.cargos[cargo_id] = (estudiante_id, saldo)
+
+        ids_cargo = {_campo(f, 'cargo') for _, f in filas} - {''}
+        ids_cargo = {int(c) for c in ids_cargo if c.isdigit()} - set(self.cargos)
+        if ids_cargo:
+            for cargo_id, estudiante_id, saldo, _ in _bloquear(
+                Cargo.objects.filter(pk__in=ids_cargo, estado__in=ESTADOS_ABIERTOS),
+            ):
+                self.cargos[cargo_id] = (estudiante_id, saldo)
+
+        referencias = {_campo(f, 'referencia') for _, f in filas} - {''}
+        if referencias:
+            self.referencias.update(
+                Pago.objects.filter(referencia__in=referencias).values_list('referencia', flat=True)
+            )
+
+    def _excepcion(self, numero, fila, motivo):
+        return ExcepcionConciliacion(
+            conciliacion=self.conciliacion,
+            numero_fila=numero,
+            matricula=_campo(fila, 'matricula')[:20],
+            referencia=_campo(fila, 'referencia')[:100],
+            monto=_campo(fila, 'monto')[:30],
+            motivo=motivo,
+        )
+
+    def _elegir_cargo(self, fila, monto):
+        """Devuelve (cargo_id, motivo_de_rechazo)."""
+        cargo_str = _campo(fila, 'cargo')
+        matricula = _campo(fila, 'matricula')
+        estudiante_id = self.estudiantes.get(matricula)
+
+        if cargo_str:
+            cargo_id = int(cargo_str) if cargo_str.isdigit() else None
+            if cargo_id not in self.cargos:
+                return None, "El cargo indicado no existe o no está abierto."
+            if matricula and self.cargos[cargo_id][0] != estudiante_id:
+                return None, "El cargo no pertenece a la matrícula indicada."
+            if self.cargos[cargo_id][1] < monto:
+                return None, "El monto excede el saldo del cargo."
+            return cargo_id, None
+
+        if not matricula:
+            return None, "La fila no trae matrícula ni cargo."
+        if estudiante_id is None:
+            return None, "No existe un estudiante con esa matrícula."
+        for cargo_id in self.cargos_por_estudiante.get(estudiante_id, []):
+            if self.cargos[cargo_id][1] >= monto:
+                return cargo_id, None
+        return None, "Ningún cargo abierto del estudiante tiene saldo suficiente."
+
+    def conciliar(self, filas):
+        """Convierte un lote de (numero_fila, fila) en pagos y excepciones."""
+        self._precargar(filas)
+        pagos, excepciones = [], []
+        for numero, fila in filas:
+            referencia = _campo(fila, 'referencia')
+            try:
+                monto = Decimal(_campo(fila, 'monto').replace(',', ''))
+                if not monto.is_finite():
+                    raise InvalidOperation
+            except InvalidOperation:
+                excepciones.append(self._excepcion(numero, fila, "Monto inválido."))
+                continue
+            if monto <= 0:
+                excepciones.append(self._excepcion(numero, fila, "El monto debe ser mayor a cero."))
+                continue
+            if not referencia:
+                excepciones.append(self._excepcion(numero, fila, "La fila no trae referencia: no se puede descartar un pago duplicado."))
+                continue
+            if referencia in self.referencias:
+                excepciones.append(self._excepcion(numero, fila, "La referencia ya fue registrada."))
+                continue
+
+            cargo_id, motivo = self._elegir_cargo(fila, monto)
+            if motivo:
+                excepciones.append(self._excepcion(numero, fila, motivo))
+                continue
+
+            estudiante_id, saldo = self.cargos[cargo_id]
+            self.cargos[cargo_id] = (estudiante_id, saldo - monto)
+            self.referencias.add(referencia)
+            pagos.append(Pago(
+                cargo_id=cargo_id,
+                estudiante_id=estudiante_id,
+                monto=monto,
+                metodo_pago=Pago.MetodoPago.TRANSFERENCIA,
+                referencia=referencia,
+                clave_idempotencia=f"banco:{referencia}",
+            ))
+        return pagos, excepciones
+
+
+def importar_estado_cuenta(archivo, nombre='', usuario=None, tamano_lote=500):
+    """
+    Importa un estado de cuenta desde `archivo` (un archivo de texto
+    abierto) dentro de una sola transacción.
+
+    Los pagos se insertan con bulk_create por lotes; al final se recalculan
+    el saldo y el estado de cada cargo afectado una sola vez, en lugar de
+    una vez por pago. Cada pago lleva la clave de idempotencia
+    "banco:<referencia>", así que dos importaciones simultáneas del mismo
+    archivo no duplican pagos (la segunda falla con IntegrityError).
+    Devuelve la ConciliacionBancaria creada.
+    """
+    lector = csv.DictReader(archivo)
+    if lector.fieldnames:
+        lector.fieldnames = [campo.strip().lower() for campo in lector.fieldnames]
+    filas = enumerate(lector, start=2)  # la fila 1 es el encabezado
+
+    with transaction.atomic():
+        conciliacion = ConciliacionBancaria.objects.create(archivo=nombre, usuario=usuario)
+        conciliador = _Conciliador(conciliacion)
+        afectados = set()
+
+        while True:
+            lote = list(islice(filas, tamano_lote))
+            if not lote:
+                break
+            pagos, excepciones = conciliador.conciliar(lote)
+            Pago.objects.bulk_create(pagos)
+            ExcepcionConciliacion.objects.bulk_create(excepciones)
+
+            conciliacion.filas_leidas += len(lote)
+            conciliacion.pagos_creados += len(pagos)
+            conciliacion.total_conciliado += sum((pago.monto for pago in pagos), Decimal('0'))
+            afectados.update(pago.cargo_id for pago in pagos)
+
+        # bulk_create no dispara las señales de Pago: se recalcula aquí, una vez por cargo
+        if afectados:
+            cargos = Cargo.objects.filter(pk__in=afectados)
+            recalcular_saldos(cargos)
+            marcar_vencidos(cargos)
+            invalidar_antiguedad(set(cargos.values_list('periodo_id', 'estudiante__grado_id')))
+        conciliacion.save()
+
+    return conciliacion
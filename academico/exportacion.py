@@ -0,0 +1,224 @@
+"""
+Exportaciones en streaming (CSV y XLSX) para auditoría.
+
+Las filas salen de values_list() leídos por bloques de llave primaria
+(pk > último visto, ordenados por pk, con LIMIT), así que nunca se
+construyen instancias de modelos ni se carga la tabla completa en
+memoria, aunque el driver no tenga cursores del lado del servidor (como
+mysqlclient, que con .iterator() igual trae todo el resultado). Cada
+bloque de filas se escribe y se envía al cliente apenas está listo.
+"""
+import csv
+import re
+import zipfile
+from decimal import Decimal
+from itertools import chain
+from xml.sax.saxutils import escape
+
+from .models import AsistenciaClase, Cargo, Entrega, Pago
+
+TAMANO_BLOQUE = 2000
+
+
+class _Buffer:
+    """Destino de escritura que acumula bytes hasta que el generador los envía."""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self.partes)
+        self.partes = []
+        return datos
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    return str(valor)
+
+
+class _TextoABytes:
+    """Adaptador para que csv.writer escriba texto sobre un _Buffer de bytes."""
+
+    def __init__(self, buffer, codificacion):
+        self.buffer = buffer
+        self.codificacion = codificacion
+
+    def write(self, texto):
+        self.buffer.write(texto.encode(self.codificacion))
+        # El BOM solo va al inicio del archivo
+        self.codificacion = 'utf-8'
+
+
+def generar_csv(encabezados, filas):
+    """Genera el CSV como bytes, un bloque de filas a la vez."""
+    buffer = _Buffer()
+    # utf-8-sig para que Excel reconozca los acentos
+    escritor = csv.writer(_TextoABytes(buffer, 'utf-8-sig'))
+    escritor.writerow(encabezados)
+    for i, fila in enumerate(filas, start=1):
+        escritor.writerow([_texto(valor) for valor in fila])
+        if i % TAMANO_BLOQUE == 0:
+            yield buffer.vaciar()
+    yield buffer.vaciar()
+
+
+_NS_RELACIONES = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_NS_DOCUMENTO = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_NS_HOJA = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+_ARCHIVOS_XLSX = {
+    '[Content_Types].xml': _XML + (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': _XML + (
+        f'<Relationships xmlns="{_NS_RELACIONES}">'
+        f'<Relationship Id="rId1" Type="{_NS_DOCUMENTO}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': _XML + (
+        f'<workbook xmlns="{_NS_HOJA}" xmlns:r="{_NS_DOCUMENTO}">'
+        '<sheets><sheet name="Datos" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': _XML + (
+        f'<Relationships xmlns="{_NS_RELACIONES}">'
+        f'<Relationship Id="rId1" Type="{_NS_DOCUMENTO}/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+# Caracteres de control que no se permiten dentro de XML
+_CONTROL_INVALIDO = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _celda(valor):
+    if valor is None:
+        return '<c/>'
+    if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool):
+        return f'<c><v>{valor}</v></c>'
+    texto = escape(_CONTROL_INVALIDO.sub('', _texto(valor)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def generar_xlsx(encabezados, filas):
+    """
+    Genera un libro XLSX de una hoja como bytes, fila por fila.
+
+    El ZIP se escribe sobre un destino sin seek(), así que zipfile usa
+    descriptores de datos y cada bloque comprimido se puede enviar en
+    cuanto se produce.
+    """
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as libro:
+        for nombre, contenido in _ARCHIVOS_XLSX.items():
+            libro.writestr(nombre, contenido)
+        yield buffer.vaciar()
+
+        with libro.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as hoja:
+            hoja.write(f'{_XML}<worksheet xmlns="{_NS_HOJA}"><sheetData>'.encode())
+            for i, fila in enumerate(chain([encabezados], filas), start=1):
+                hoja.write(f'<row r="{i}">{"".join(_celda(valor) for valor in fila)}</row>'.encode())
+                if i % TAMANO_BLOQUE == 0:
+                    yield buffer.vaciar()
+            hoja.write(b'</sheetData></worksheet>')
+        yield buffer.vaciar()
+    yield buffer.vaciar()
+
+
+def _por_bloques(queryset, *campos):
+    """
+    Las filas (pk, *campos) de `queryset` en orden de pk, consultando
+    TAMANO_BLOQUE filas a la vez a partir del último pk leído.
+    """
+    queryset = queryset.order_by('pk')
+    ultimo = None
+    while True:
+        bloque = queryset if ultimo is None else queryset.filter(pk__gt=ultimo)
+        filas = list(bloque.values_list('pk', *campos)[:TAMANO_BLOQUE])
+        yield from filas
+        if len(filas) < TAMANO_BLOQUE:
+            return
+        ultimo = filas[-1][0]
+
+
+def _nombre(first_name, last_name):
+    return f"{first_name} {last_name}".strip()
+
+
+def exportar_cargos(periodo_id=None):
+    encabezados = ['ID', 'Matrícula', 'Estudiante', 'Periodo', 'Concepto', 'Monto', 'Pagado', 'Saldo', 'Estado', 'Emisión', 'Vencimiento']
+    cargos = Cargo.objects.all()
+    if periodo_id:
+        cargos = cargos.filter(periodo_id=periodo_id)
+    filas = _por_bloques(
+        cargos, 'estudiante__matricula', 'estudiante__user__first_name', 'estudiante__user__last_name',
+        'periodo__nombre', 'concepto', 'monto', 'monto_pagado', 'saldo', 'estado', 'fecha_emision', 'fecha_vencimiento',
+    )
+    return encabezados, ((f[0], f[1], _nombre(f[2], f[3]), *f[4:]) for f in filas)
+
+
+def exportar_pagos(periodo_id=None):
+    encabezados = ['ID', 'Fecha', 'Matrícula', 'Estudiante', 'Cargo', 'Concepto', 'Monto', 'Método', 'Referencia']
+    pagos = Pago.objects.all()
+    if periodo_id:
+        pagos = pagos.filter(cargo__periodo_id=periodo_id)
+    filas = _por_bloques(
+        pagos, 'fecha_pago', 'estudiante__matricula', 'estudiante__user__first_name', 'estudiante__user__last_name',
+        'cargo_id', 'cargo__concepto', 'monto', 'metodo_pago', 'referencia',
+    )
+    return encabezados, ((f[0], f[1], f[2], _nombre(f[3], f[4]), *f[5:]) for f in filas)
+
+
+def exportar_calificaciones(periodo_id=None):
+    encabezados = ['ID', 'Periodo', 'Curso', 'Actividad', 'Matrícula', 'Estudiante', 'Fecha de Entrega', 'Calificación', 'Comentarios del Maestro']
+    entregas = Entrega.objects.all()
+    if periodo_id:
+        entregas = entregas.filter(actividad__clase__periodo_id=periodo_id)
+    filas = _por_bloques(
+        entregas, 'actividad__clase__periodo__nombre', 'actividad__clase__curso__nombre', 'actividad__titulo',
+        'estudiante__matricula', 'estudiante__user__first_name', 'estudiante__user__last_name',
+        'fecha_entrega', 'calificacion', 'comentarios_maestro',
+    )
+    return encabezados, ((*f[:5], _nombre(f[5], f[6]), *f[7:]) for f in filas)
+
+
+def exportar_asistencias(periodo_id=None):
+    encabezados = ['ID', 'Fecha', 'Periodo', 'Curso', 'Día', 'Hora', 'Matrícula', 'Estudiante', 'Estado', 'Observación']
+    asistencias = AsistenciaClase.objects.all()
+    if periodo_id:
+        asistencias = asistencias.filter(clase__periodo_id=periodo_id)
+    filas = _por_bloques(
+        asistencias, 'fecha', 'clase__periodo__nombre', 'clase__curso__nombre', 'clase__dia_semana', 'clase__hora_inicio',
+        'estudiante__matricula', 'estudiante__user__first_name', 'estudiante__user__last_name', 'estado', 'observacion',
+    )
+    return encabezados, ((*f[:7], _nombre(f[7], f[8]), *f[9:]) for f in filas)
+
+
+EXPORTACIONES = {
+    'cargos': exportar_cargos,
+    'pagos': exportar_pagos,
+    'calificaciones': exportar_calificaciones,
+    'asistencias': exportar_asistencias,
+}
+
+FORMATOS = {
+    'csv': (generar_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (generar_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
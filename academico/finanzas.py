@@ -0,0 +1,482 @@
+"""
+Operaciones financieras masivas sobre Cargo y Pago.
+
+Todo lo de este módulo trabaja por conjuntos (UPDATE/INSERT en lote) en
+lugar de recorrer los cargos uno por uno.
+"""
+from collections import Counter
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, CharField, Count, DecimalField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from users.models import Estudiante
+
+from .models import AntiguedadSaldo, Cargo, Grado, Pago
+
+CONCEPTO_INSCRIPCION = "Inscripción"
+CONCEPTO_UTILES = "Útiles y Libros"
+CONCEPTO_COLEGIATURA = "Colegiatura"
+MESES_COLEGIATURA = 12
+DIAS_PARA_PAGAR = 30
+DIA_VENCIMIENTO_COLEGIATURA = 5
+
+
+def _total_pagado():
+    """Subconsulta con la suma real de pagos de cada cargo (0 si no tiene)."""
+    pagos = Pago.objects.filter(cargo=OuterRef('pk')).order_by().values('cargo').annotate(total=Sum('monto')).values('total')
+    return Coalesce(
+        Subquery(pagos, output_field=DecimalField(max_digits=10, decimal_places=2)),
+        Value(0),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+def _lotes_de_ids(queryset, tamano_lote):
+    """Recorre los pk de un queryset en lotes, sin cargar los objetos."""
+    lote = []
+    for pk in queryset.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=tamano_lote):
+        lote.append(pk)
+        if len(lote) >= tamano_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def recalcular_saldos(cargos=None, tamano_lote=1000, corregir=True):
+    """
+    Reconstruye `monto_pagado` y `saldo` a partir de los pagos registrados.
+
+    Trabaja en lotes de `tamano_lote` cargos: una consulta detecta los
+    cargos con diferencias y un solo UPDATE los corrige. Devuelve
+    (cargos_revisados, diferencias), donde cada diferencia es una tupla
+    (cargo_id, monto_pagado_guardado, monto_pagado_real).
+    """
+    if cargos is None:
+        cargos = Cargo.objects.all()
+
+    revisados = 0
+    diferencias = []
+    for ids in _lotes_de_ids(cargos, tamano_lote):
+        revisados += len(ids)
+        lote = Cargo.objects.filter(pk__in=ids).annotate(pagado_real=_total_pagado())
+        con_diferencia = list(
+            lote.filter(
+                ~Q(monto_pagado=F('pagado_real')) | ~Q(saldo=F('monto') - F('pagado_real'))
+            ).values_list('pk', 'monto_pagado', 'pagado_real')
+        )
+        if not con_diferencia:
+            continue
+        diferencias.extend(con_diferencia)
+
+        if corregir:
+            with transaction.atomic():
+                corregidos = Cargo.objects.filter(pk__in=[fila[0] for fila in con_diferencia])
+                corregidos.update(
+                    monto_pagado=_total_pagado(),
+                    saldo=F('monto') - _total_pagado(),
+                )
+                invalidar_antiguedad(set(corregidos.values_list('periodo_id', 'estudiante__grado_id')))
+
+    return revisados, diferencias
+
+
+def marcar_vencidos(cargos=None, hoy=None):
+    """
+    Pone al día el estado de los cargos con unos pocos UPDATE ... WHERE:
+
+    - pagados: saldo en cero o negativo que seguían PENDIENTE o VENCIDO.
+    - vencidos: PENDIENTE con saldo y fecha de vencimiento pasada.
+    - reabiertos: PAGADO que vuelve a tener saldo, o VENCIDO cuya fecha
+      de vencimiento se movió hacia adelante.
+
+    Los cargos cancelados nunca se tocan. `cargos` limita el barrido a un
+    queryset (por defecto, todos). Devuelve cuántos cargos cambiaron en
+    cada caso.
+    """
+    if cargos is None:
+        cargos = Cargo.objects.all()
+    if hoy is None:
+        hoy = timezone.now().date()
+    Estado = Cargo.EstadoCargo
+
+    with transaction.atomic():
+        pagados = cargos.filter(
+            estado__in=[Estado.PENDIENTE, Estado.VENCIDO], saldo__lte=0,
+        ).update(estado=Estado.PAGADO)
+        vencidos = cargos.filter(
+            estado=Estado.PENDIENTE, fecha_vencimiento__lt=hoy, saldo__gt=0,
+        ).update(estado=Estado.VENCIDO)
+        reabiertos = cargos.filter(
+            Q(estado=Estado.PAGADO, saldo__gt=0) |
+            Q(estado=Estado.VENCIDO, fecha_vencimiento__gte=hoy, saldo__gt=0)
+        ).update(estado=Case(
+            When(fecha_vencimiento__lt=hoy, then=Value(Estado.VENCIDO)),
+            default=Value(Estado.PENDIENTE),
+        ))
+
+    return {'pagados': pagados, 'vencidos': vencidos, 'reabiertos': reabiertos}
+
+
+
+def registrar_pago(cargo_id, monto, metodo_pago, referencia=None, clave_idempotencia=None):
+    """
+    Registra un pago contra un cargo de forma segura ante concurrencia.
+
+    El cargo se bloquea con select_for_update mientras se valida el monto,
+    así que dos cajeros pagando el mismo cargo a la vez nunca lo sobrepagan.
+    Si `clave_idempotencia` ya se usó, no se crea nada y se devuelve el
+    pago existente. Devuelve (pago, creado); lanza ValidationError si el
+    monto no es válido para el cargo.
+    """
+    if clave_idempotencia:
+        existente = Pago.objects.filter(clave_idempotencia=clave_idempotencia).first()
+        if existente:
+            return existente, False
+
+    if monto <= 0:
+        raise ValidationError("El monto debe ser mayor a cero.")
+
+    try:
+        with transaction.atomic():
+            cargo = Cargo.objects.select_for_update().get(pk=cargo_id)
+            if clave_idempotencia:
+                # Un reenvío que esperó el bloqueo encuentra aquí el pago del
+                # primero, antes de validar el monto contra el saldo ya pagado
+                existente = Pago.objects.filter(clave_idempotencia=clave_idempotencia).first()
+                if existente:
+                    return existente, False
+            if cargo.estado == Cargo.EstadoCargo.CANCELADO:
+                raise ValidationError("No se pueden registrar pagos a un cargo cancelado.")
+            if monto > cargo.saldo:
+                raise ValidationError(f"El monto excede el saldo pendiente (${cargo.saldo}).")
+            pago = Pago.objects.create(
+                cargo=cargo,
+                estudiante_id=cargo.estudiante_id,
+                monto=monto,
+                metodo_pago=metodo_pago,
+                referencia=referencia or None,
+                clave_idempotencia=clave_idempotencia or None,
+            )
+    except IntegrityError:
+        # Otra petición con la misma clave ganó la carrera
+        existente = Pago.objects.filter(clave_idempotencia=clave_idempotencia).first() if clave_idempotencia else None
+        if existente is None:
+            raise
+        return existente, False
+    return pago, True
+
+def _mes_siguiente(fecha, meses):
+    """El día de vencimiento de colegiatura, `meses` meses después de `fecha`."""
+    indice = fecha.month - 1 + meses
+    return fecha.replace(year=fecha.year + indice // 12, month=indice % 12 + 1, day=DIA_VENCIMIENTO_COLEGIATURA)
+
+
+def _vencimientos_de_colegiatura(periodo, fecha_base):
+    """
+    Los vencimientos de colegiatura del periodo: un mes por cada mes entre
+    su inicio y su fin (hasta MESES_COLEGIATURA), sin los anteriores al mes
+    de `fecha_base`. Al depender solo del periodo, volver a generar en otro
+    mes no agrega meses nuevos.
+    """
+    vencimientos = []
+    for i in range(MESES_COLEGIATURA):
+        vencimiento = _mes_siguiente(periodo.fecha_inicio, i)
+        if vencimiento.replace(day=1) > periodo.fecha_fin:
+            break
+        if (vencimiento.year, vencimiento.month) >= (fecha_base.year, fecha_base.month):
+            vencimientos.append(vencimiento)
+    return vencimientos
+
+
+def cargos_de_plantilla(grado, fecha_base):
+    """
+    Los cargos que define la plantilla financiera de un grado, como tuplas
+    (concepto, monto, fecha_vencimiento). Los montos en cero se omiten; las
+    colegiaturas son las de los meses del periodo del grado que aún no
+    terminan en `fecha_base`.
+    """
+    cargos = []
+    if grado.monto_inscripcion > 0:
+        cargos.append((CONCEPTO_INSCRIPCION, grado.monto_inscripcion, fecha_base + timedelta(days=DIAS_PARA_PAGAR)))
+    if grado.monto_utiles > 0:
+        cargos.append((CONCEPTO_UTILES, grado.monto_utiles, fecha_base + timedelta(days=DIAS_PARA_PAGAR)))
+    if grado.monto_colegiatura_mensual > 0:
+        for vencimiento in _vencimientos_de_colegiatura(grado.periodo, fecha_base):
+            cargos.append((f"{CONCEPTO_COLEGIATURA} {vencimiento:%Y-%m}", grado.monto_colegiatura_mensual, vencimiento))
+    return cargos
+
+
+def generar_cargos(grado=None, periodo=None, estudiantes=None, fecha_base=None, tamano_lote=1000):
+    """
+    Crea los cargos de Inscripción, Útiles y Colegiaturas que les faltan a
+    los estudiantes de un grado (o de todos los grados de un periodo).
+
+    Los cargos que ya existen se detectan con una sola consulta por
+    (estudiante, periodo, concepto) y los faltantes se insertan con bulk_create.
+    `estudiantes` limita la generación a esos estudiantes del grado.
+    Devuelve un resumen con el total de estudiantes, los cargos creados y
+    el conteo por concepto.
+    """
+    if grado is None and periodo is None:
+        raise ValueError("Debe indicar un grado o un periodo.")
+    if fecha_base is None:
+        fecha_base = timezone.now().date()
+
+    grados = [grado] if grado is not None else list(Grado.objects.filter(periodo=periodo).select_related('periodo'))
+    plantillas = {g.pk: cargos_de_plantilla(g, fecha_base) for g in grados}
+
+    if estudiantes is not None:
+        alumnos = [(e.pk, e.grado_id if grado is None else grado.pk) for e in estudiantes]
+    else:
+        alumnos = list(Estudiante.objects.filter(grado__in=grados).values_list('pk', 'grado_id'))
+    alumnos = [(estudiante_id, grado_id) for estudiante_id, grado_id in alumnos if plantillas.get(grado_id)]
+
+    periodos = {g.pk: g.periodo_id for g in grados}
+    conceptos = {concepto for plantilla in plantillas.values() for concepto, _, _ in plantilla}
+    # Un estudiante que repite concepto en otro periodo (la Inscripción de
+    # cada año) necesita su propio cargo
+    existentes = set(
+        Cargo.objects.filter(
+            estudiante_id__in=[estudiante_id for estudiante_id, _ in alumnos],
+            periodo_id__in=set(periodos.values()),
+            concepto__in=conceptos,
+        ).values_list('estudiante_id', 'periodo_id', 'concepto')
+    )
+
+    nuevos = []
+    por_concepto = Counter()
+    for estudiante_id, grado_id in alumnos:
+        for concepto, monto, vencimiento in plantillas[grado_id]:
+            if (estudiante_id, periodos[grado_id], concepto) in existentes:
+                continue
+            nuevos.append(Cargo(
+                estudiante_id=estudiante_id,
+                periodo_id=periodos[grado_id],
+                concepto=concepto,
+                monto=monto,
+                saldo=monto,  # bulk_create no pasa por Cargo.save()
+                fecha_vencimiento=vencimiento,
+            ))
+            por_concepto[CONCEPTO_COLEGIATURA if concepto.startswith(CONCEPTO_COLEGIATURA) else concepto] += 1
+
+    with transaction.atomic():
+        Cargo.objects.bulk_create(nuevos, batch_size=tamano_lote)
+        invalidar_antiguedad({(periodos[grado_id], grado_id) for _, grado_id in alumnos})
+
+    return {
+        'estudiantes': len(alumnos),
+        'cargos_creados': len(nuevos),
+        'por_concepto': dict(por_concepto),
+    }
+
+
+def _suma_saldo(condicion):
+    return Coalesce(
+        Sum('saldo', filter=condicion),
+        Value(0),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def calcular_antiguedad(hoy=None, pares=None):
+    """
+    Calcula la antigüedad de los saldos por (periodo, grado) en una sola
+    consulta con agregación condicional sobre el saldo de cada cargo.
+
+    `pares` limita el cálculo a esos (periodo_id, grado_id). Devuelve una
+    lista de diccionarios con las claves de AntiguedadSaldo.
+    """
+    if hoy is None:
+        hoy = timezone.now().date()
+
+    cargos = Cargo.objects.filter(saldo__gt=0).exclude(estado=Cargo.EstadoCargo.CANCELADO)
+    if pares is not None:
+        filtro = Q(pk__in=[])
+        for periodo_id, grado_id in pares:
+            # Con None, el filtro exacto de Django se convierte en IS NULL
+            filtro |= Q(periodo_id=periodo_id, estudiante__grado_id=grado_id)
+        cargos = cargos.filter(filtro)
+
+    corte_30, corte_60, corte_90 = (hoy - timedelta(days=dias) for dias in (30, 60, 90))
+    return list(
+        cargos.order_by().values('periodo_id', grado_id=F('estudiante__grado_id')).annotate(
+            corriente=_suma_saldo(Q(fecha_vencimiento__gte=hoy)),
+            dias_0_30=_suma_saldo(Q(fecha_vencimiento__lt=hoy, fecha_vencimiento__gte=corte_30)),
+            dias_31_60=_suma_saldo(Q(fecha_vencimiento__lt=corte_30, fecha_vencimiento__gte=corte_60)),
+            dias_61_90=_suma_saldo(Q(fecha_vencimiento__lt=corte_60, fecha_vencimiento__gte=corte_90)),
+            dias_mas_90=_suma_saldo(Q(fecha_vencimiento__lt=corte_90)),
+            total=Sum('saldo'),
+            cantidad_cargos=Count('pk'),
+        )
+    )
+
+
+def actualizar_antiguedad(hoy=None, completo=False):
+    """
+    Pone al día la tabla AntiguedadSaldo.
+
+    Si la tabla es de otro día (los cargos cambian de tramo con el paso del
+    tiempo) o `completo` es True, se reconstruye entera; si no, solo se
+    recalculan las filas que las señales marcaron como no vigentes.
+    Devuelve cuántas filas se recalcularon.
+    """
+    if hoy is None:
+        hoy = timezone.now().date()
+
+    completo = completo or not AntiguedadSaldo.objects.exists() \
+        or AntiguedadSaldo.objects.exclude(fecha_calculo=hoy).exists()
+    if completo:
+        obsoletas = AntiguedadSaldo.objects.all()
+        pares = None
+    else:
+        obsoletas = AntiguedadSaldo.objects.filter(vigente=False)
+        pares = list(obsoletas.values_list('periodo_id', 'grado_id'))
+        if not pares:
+            return 0
+
+    filas = [
+        AntiguedadSaldo(fecha_calculo=hoy, vigente=True, **fila)
+        for fila in calcular_antiguedad(hoy, pares)
+    ]
+    with transaction.atomic():
+        obsoletas.delete()
+        AntiguedadSaldo.objects.bulk_create(filas)
+    return len(filas)
+
+
+def invalidar_antiguedad(pares):
+    """
+    Marca como no vigentes las filas de antigüedad de esos
+    (periodo_id, grado_id), creándolas si todavía no existen.
+    """
+    hoy = timezone.now().date()
+    for periodo_id, grado_id in pares:
+        actualizadas = AntiguedadSaldo.objects.filter(periodo_id=periodo_id, grado_id=grado_id).update(vigente=False)
+        if not actualizadas:
+            AntiguedadSaldo.objects.get_or_create(
+                periodo_id=periodo_id, grado_id=grado_id,
+                defaults={'vigente': False, 'fecha_calculo': hoy},
+            )
+
+
+MOVIMIENTO_CARGO = 0
+MOVIMIENTO_PAGO = 1
+_COLUMNAS_MOVIMIENTO = ('fecha', 'tipo', 'movimiento_id', 'descripcion', 'detalle', 'importe')
+
+
+def _movimientos(estudiante):
+    """
+    Cargos (importe positivo) y pagos (importe negativo) del estudiante
+    como un solo UNION ALL con las columnas de _COLUMNAS_MOVIMIENTO.
+    """
+    Estado = Cargo.EstadoCargo
+    texto = CharField()
+    importe = DecimalField(max_digits=12, decimal_places=2)
+
+    cargos = Cargo.objects.filter(estudiante=estudiante).exclude(estado=Estado.CANCELADO).order_by().annotate(
+        fecha=F('fecha_emision'),
+        tipo=Value(MOVIMIENTO_CARGO, output_field=IntegerField()),
+        movimiento_id=F('pk'),
+        descripcion=F('concepto'),
+        detalle=Value('', output_field=texto),
+        importe=F('monto'),
+    )
+    pagos = Pago.objects.filter(estudiante=estudiante).exclude(cargo__estado=Estado.CANCELADO).order_by().annotate(
+        fecha=TruncDate('fecha_pago'),
+        tipo=Value(MOVIMIENTO_PAGO, output_field=IntegerField()),
+        movimiento_id=F('pk'),
+        descripcion=F('cargo__concepto'),
+        detalle=Coalesce('referencia', Value(''), output_field=texto),
+        importe=Value(0, output_field=importe) - F('monto'),
+    )
+    return cargos.values_list(*_COLUMNAS_MOVIMIENTO).union(
+        pagos.values_list(*_COLUMNAS_MOVIMIENTO), all=True,
+    )
+
+
+def _a_fecha(valor):
+    # SQLite devuelve las fechas de un SQL crudo como texto
+    return date.fromisoformat(valor) if isinstance(valor, str) else valor
+
+
+def _a_decimal(valor):
+    return Decimal(str(valor or 0)).quantize(Decimal('0.01'))
+
+
+def estado_de_cuenta(estudiante, desde=None, hasta=None):
+    """
+    El estado de cuenta de un estudiante: cargos y pagos intercalados por
+    fecha con el saldo acumulado, en una sola consulta.
+
+    El saldo se calcula con SUM() OVER (...) sobre toda la historia y el
+    rango `desde`/`hasta` se aplica después, así que el saldo de cada
+    movimiento incluye todo lo anterior al rango. Los cargos cancelados (y
+    sus pagos) no aparecen.
+    """
+    union_sql, params = _movimientos(estudiante).query.sql_with_params()
+    columnas = ', '.join(_COLUMNAS_MOVIMIENTO)
+    # El ORM no permite una ventana sobre un UNION, así que se envuelve a mano
+    sql = (
+        f"SELECT {columnas}, saldo FROM ("
+        f"SELECT {columnas}, SUM(importe) OVER ("
+        f"ORDER BY fecha, tipo, movimiento_id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW"
+        f") AS saldo FROM ({union_sql}) movimientos"
+        f") estado_cuenta"
+    )
+    params = list(params)
+    condiciones = []
+    if desde:
+        condiciones.append("fecha >= %s")
+        params.append(desde)
+    if hasta:
+        condiciones.append("fecha <= %s")
+        params.append(hasta)
+    if condiciones:
+        sql += " WHERE " + " AND ".join(condiciones)
+    sql += " ORDER BY fecha, tipo, movimiento_id"
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        movimientos = [
+            {
+                'fecha': _a_fecha(fecha),
+                'es_pago': tipo == MOVIMIENTO_PAGO,
+                'id': movimiento_id,
+                'descripcion': descripcion,
+                'referencia': detalle,
+                'cargo': _a_decimal(importe) if importe > 0 else Decimal('0.00'),
+                'abono': -_a_decimal(importe) if importe < 0 else Decimal('0.00'),
+                'saldo': _a_decimal(saldo),
+            }
+            for fecha, tipo, movimiento_id, descripcion, detalle, importe, saldo in cursor.fetchall()
+        ]
+
+    if movimientos:
+        primero = movimientos[0]
+        saldo_inicial = primero['saldo'] - primero['cargo'] + primero['abono']
+        saldo_final = movimientos[-1]['saldo']
+    else:
+        # Sin movimientos en el rango: el saldo es el acumulado hasta `desde`
+        saldo_inicial = saldo_final = Decimal('0.00')
+        if desde:
+            anteriores = Cargo.objects.filter(
+                estudiante=estudiante, fecha_emision__lt=desde,
+            ).exclude(estado=Cargo.EstadoCargo.CANCELADO).aggregate(total=Sum('monto'))['total']
+            pagados = Pago.objects.filter(
+                estudiante=estudiante, fecha_pago__date__lt=desde,
+            ).exclude(cargo__estado=Cargo.EstadoCargo.CANCELADO).aggregate(total=Sum('monto'))['total']
+            saldo_inicial = saldo_final = _a_decimal((anteriores or 0) - (pagados or 0))
+
+    return {
+        'movimientos': movimientos,
+        'saldo_inicial': saldo_inicial,
+        'saldo_final': saldo_final,
+        'total_cargos': sum((m['cargo'] for m in movimientos), Decimal('0.00')),
+        'total_abonos': sum((m['abono'] for m in movimientos), Decimal('0.00')),
+    }
@@ -1,6 +1,9 @@
+import uuid
+
 from django import forms
 from .models import Curso, Clase, PeriodoAcademico, BitacoraPedagogica, Cargo, Pago, Planificacion
 from users.models import Estudiante
+from .horarios import RECURSO_ESTUDIANTE, RECURSO_GRADO, RECURSO_MAESTRO, conflictos_de_clase
 
 class CursoForm(forms.ModelForm):
     class Meta:
@@ -26,6 +29,12 @@ class AsignarCursosForm(forms.Form):
     )
 
 class ClaseForm(forms.ModelForm):
+    MOTIVOS_CONFLICTO = {
+        RECURSO_MAESTRO: 'mismo maestro',
+        RECURSO_GRADO: 'mismo grado',
+        RECURSO_ESTUDIANTE: 'estudiantes en común',
+    }
+
     class Meta:
         model = Clase
         # Incluimos todos los campos necesarios para definir una clase
@@ -49,6 +58,38 @@ class ClaseForm(forms.ModelForm):
         for field_name, field in self.fields.items():
             field.widget.attrs['class'] = 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-indigo-500 focus:border-indigo-500'
 
+    def clean(self):
+        """
+        Valida que la clase no se traslape con otra del mismo maestro, de
+        alguno de sus grados o con estudiantes en común.
+        """
+        cleaned_data = super().clean()
+        campos = ('periodo', 'dia_semana', 'hora_inicio', 'hora_fin')
+        if any(cleaned_data.get(campo) is None for campo in campos):
+            return cleaned_data
+        if cleaned_data['hora_fin'] <= cleaned_data['hora_inicio']:
+            raise forms.ValidationError("La hora de fin debe ser posterior a la hora de inicio.")
+
+        propuesta = Clase(
+            pk=self.instance.pk,
+            periodo=cleaned_data['periodo'],
+            maestro=cleaned_data.get('maestro'),
+            dia_semana=cleaned_data['dia_semana'],
+            hora_inicio=cleaned_data['hora_inicio'],
+            hora_fin=cleaned_data['hora_fin'],
+        )
+        conflictos = conflictos_de_clase(propuesta)
+        if conflictos:
+            motivos = {}
+            for conflicto in conflictos:
+                motivos.setdefault(conflicto.clase_b, set()).add(self.MOTIVOS_CONFLICTO[conflicto.tipo])
+            otras = Clase.objects.select_related('curso').in_bulk(motivos)
+            raise forms.ValidationError([
+                f"Choca con {otras[pk]} ({', '.join(sorted(motivo))})."
+                for pk, motivo in motivos.items()
+            ])
+        return cleaned_data
+
 class PeriodoAcademicoForm(forms.ModelForm):
     class Meta:
         model = PeriodoAcademico
@@ -142,6 +183,9 @@ class PagoForm(forms.ModelForm):
     """
     Formulario para registrar un pago nuevo.
     """
+    # Se genera al mostrar el formulario; si se reenvía, el pago no se duplica
+    clave_idempotencia = forms.CharField(widget=forms.HiddenInput, required=False)
+
     class Meta:
         model = Pago
         # Los campos que el contador llenará:
@@ -158,8 +202,24 @@ class PagoForm(forms.ModelForm):
 
         if cargo:
             # Ponemos el saldo pendiente como el monto por defecto
+            # (solo es una sugerencia: registrar_pago lo vuelve a validar con el cargo bloqueado)
             self.fields['monto'].initial = cargo.saldo_pendiente
+        if not self.is_bound:
+            self.fields['clave_idempotencia'].initial = uuid.uuid4().hex
 
         # Aplicamos las clases de Tailwind
         for field_name, field in self.fields.items():
-            field.widget.attrs['class'] = 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-indigo-500 focus:border-indigo-500'
\ No newline at end of file
+            field.widget.attrs['class'] = 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-indigo-500 focus:border-indigo-500'
+
+class EstadoCuentaBancoForm(forms.Form):
+    """
+    Formulario para subir el estado de cuenta del banco (CSV).
+    """
+    archivo = forms.FileField(
+        label="Estado de cuenta (CSV)",
+        help_text="Columnas: matricula, referencia (obligatoria), monto y, opcionalmente, cargo."
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['archivo'].widget.attrs['class'] = 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-indigo-500 focus:border-indigo-500'
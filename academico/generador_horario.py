@@ -0,0 +1,297 @@
+"""
+Generador automático de horarios para las plantillas de Grado.
+
+Cada hora semanal que le falta a un grado (según los créditos de los
+cursos de su plan de estudios) es una variable; su dominio son las
+ternas (día, hora, maestro) posibles: maestros que imparten el curso
+(Maestro.cursos) y que están disponibles a esa hora. La búsqueda es un
+backtracking con:
+
+- MRV: siempre se asigna primero la variable con menos valores posibles.
+- Forward checking: al asignar se podan los dominios de las variables
+  afectadas (mismo grado, mismo maestro, mismo curso del grado) y, si
+  alguno queda vacío, se retrocede de inmediato.
+
+Las clases que ya existen en el periodo se respetan como fijas. El orden
+de los valores se baraja con una semilla, así que la misma semilla da el
+mismo horario.
+"""
+import random
+import time
+from collections import Counter, defaultdict, namedtuple
+from datetime import time as hora_del_dia
+
+from django.db import transaction
+
+from users.models import Maestro
+
+from .horarios import HORAS_VISIBLES, invalidar_horario
+from .inscripciones import sincronizar_inscripciones
+from .models import Clase, DisponibilidadMaestro, Grado
+
+DIAS_LECTIVOS = [
+    Clase.DiaSemana.LUNES, Clase.DiaSemana.MARTES, Clase.DiaSemana.MIERCOLES,
+    Clase.DiaSemana.JUEVES, Clase.DiaSemana.VIERNES,
+]
+
+Sesion = namedtuple('Sesion', 'grado_id curso_id dia_semana hora maestro_id')
+ResultadoHorario = namedtuple('ResultadoHorario', 'sesiones pendientes completo agotado')
+
+
+class _Busqueda:
+    """Estado del backtracking: dominios, asignaciones y podas para deshacer."""
+
+    def __init__(self, variables, dominios, semilla, limite):
+        self.variables = variables  # indice -> (grado_id, curso_id)
+        self.dominios = dominios    # indice -> set de (dia, hora, maestro_id)
+        self.rng = random.Random(semilla)
+        self.limite = limite
+        self.asignacion = {}
+        self.mejor = {}
+        self.agotado = False
+
+        self.por_grado = defaultdict(list)
+        self.por_grupo = defaultdict(list)
+        self.por_maestro = defaultdict(list)
+        for i, (grado_id, curso_id) in enumerate(variables):
+            self.por_grado[grado_id].append(i)
+            self.por_grupo[(grado_id, curso_id)].append(i)
+            for maestro_id in {m for _, _, m in dominios[i]}:
+                self.por_maestro[maestro_id].append(i)
+
+        # Sesiones del mismo curso que un grado puede tener en un día
+        self.maximo_por_dia = {
+            grupo: -(-len(indices) // len(DIAS_LECTIVOS)) for grupo, indices in self.por_grupo.items()
+        }
+        self.sesiones_por_dia = Counter()
+        self.maestro_de_grupo = {}
+
+    def _quitar(self, j, valor, podados):
+        if j not in self.asignacion and valor in self.dominios[j]:
+            self.dominios[j].discard(valor)
+            podados.append((j, valor))
+
+    def asignar(self, i, valor):
+        """Asigna y poda; devuelve las podas, o None si algún dominio quedó vacío."""
+        dia, hora, maestro_id = valor
+        grupo = self.variables[i]
+        grado_id, _ = grupo
+        self.asignacion[i] = valor
+        self.sesiones_por_dia[(grupo, dia)] += 1
+        nuevo_maestro = grupo not in self.maestro_de_grupo
+        if nuevo_maestro:
+            self.maestro_de_grupo[grupo] = maestro_id
+
+        podados = []
+        # El grado ya no tiene libre ese día y hora
+        for j in self.por_grado[grado_id]:
+            for valor_j in [v for v in self.dominios[j] if v[0] == dia and v[1] == hora]:
+                self._quitar(j, valor_j, podados)
+        # El maestro tampoco
+        for j in self.por_maestro[maestro_id]:
+            self._quitar(j, (dia, hora, maestro_id), podados)
+        # Un curso de un grado lo da un solo maestro, repartido en la semana
+        lleno = self.sesiones_por_dia[(grupo, dia)] >= self.maximo_por_dia[grupo]
+        if nuevo_maestro or lleno:
+            for j in self.por_grupo[grupo]:
+                for valor_j in [v for v in self.dominios[j] if v[2] != maestro_id or (lleno and v[0] == dia)]:
+                    self._quitar(j, valor_j, podados)
+
+        if any(not self.dominios[j] for j, _ in podados):
+            self.deshacer(i, podados, nuevo_maestro)
+            return None
+        return podados, nuevo_maestro
+
+    def deshacer(self, i, podados, nuevo_maestro):
+        dia = self.asignacion.pop(i)[0]
+        grupo = self.variables[i]
+        self.sesiones_por_dia[(grupo, dia)] -= 1
+        if nuevo_maestro:
+            del self.maestro_de_grupo[grupo]
+        for j, valor in podados:
+            self.dominios[j].add(valor)
+
+    def elegir_variable(self):
+        """MRV: la variable sin asignar con el dominio más pequeño."""
+        libres = [i for i in range(len(self.variables)) if i not in self.asignacion]
+        if not libres:
+            return None
+        return min(libres, key=lambda i: (len(self.dominios[i]), i))
+
+    def ordenar_valores(self, i):
+        """Valores al azar (con semilla), prefiriendo los días con menos sesiones del curso."""
+        grupo = self.variables[i]
+        valores = sorted(self.dominios[i])
+        self.rng.shuffle(valores)
+        valores.sort(key=lambda v: self.sesiones_por_dia[(grupo, v[0])])
+        return valores
+
+    def resolver(self):
+        """Backtracking iterativo (sin límite de recursión). True si asignó todo."""
+        siguiente = self.elegir_variable()
+        if siguiente is None:
+            return True
+        pila = [[siguiente, iter(self.ordenar_valores(siguiente)), None]]
+        while pila:
+            if time.monotonic() > self.limite:
+                self.agotado = True
+                return False
+            marco = pila[-1]
+            i, valores, deshacer = marco
+            if deshacer is not None:
+                self.deshacer(i, *deshacer)
+                marco[2] = None
+
+            for valor in valores:
+                resultado = self.asignar(i, valor)
+                if resultado is not None:
+                    marco[2] = resultado
+                    break
+            else:
+                pila.pop()
+                continue
+
+            if len(self.asignacion) > len(self.mejor):
+                self.mejor = dict(self.asignacion)
+            siguiente = self.elegir_variable()
+            if siguiente is None:
+                return True
+            pila.append([siguiente, iter(self.ordenar_valores(siguiente)), None])
+        return False
+
+
+def _disponibilidad(maestros):
+    """maestro_id -> set de (dia, hora) disponibles; los maestros sin franjas no aparecen."""
+    franjas = defaultdict(set)
+    for maestro_id, dia, inicio, fin in DisponibilidadMaestro.objects.filter(maestro__in=maestros).values_list(
+        'maestro_id', 'dia_semana', 'hora_inicio', 'hora_fin',
+    ):
+        for hora in HORAS_VISIBLES:
+            # La franja debe cubrir la hora completa
+            if inicio <= hora_del_dia(hora) and fin >= hora_del_dia(hora + 1):
+                franjas[maestro_id].add((dia, hora))
+    return franjas
+
+
+def planificar_horario(periodo, grados=None, semilla=0, segundos=30):
+    """
+    Busca un horario para las horas que les faltan a los grados del periodo.
+
+    No escribe nada en la base de datos. Devuelve un ResultadoHorario con
+    las sesiones encontradas (la solución completa o, si no la hay o se
+    acaba el tiempo, la asignación parcial más grande), las horas que
+    quedaron sin asignar y si se agotó el tiempo.
+    """
+    if grados is None:
+        grados = Grado.objects.filter(periodo=periodo)
+    grados = list(grados.prefetch_related('cursos'))
+    ids_grado = [g.pk for g in grados]
+    slots = [(dia, hora) for dia in DIAS_LECTIVOS for hora in HORAS_VISIBLES]
+
+    # Lo que ya existe en el periodo queda fijo
+    existentes = list(Clase.objects.filter(periodo=periodo).values_list('pk', 'curso_id', 'maestro_id', 'dia_semana', 'hora_inicio', 'hora_fin'))
+    grados_de_clase = defaultdict(list)
+    for clase_id, grado_id in Grado.clases.through.objects.filter(
+        clase__periodo=periodo, grado_id__in=ids_grado,
+    ).values_list('clase_id', 'grado_id'):
+        grados_de_clase[clase_id].append(grado_id)
+
+    ocupado_maestro, ocupado_grado = set(), set()
+    horas_dadas = Counter()
+    for clase_id, curso_id, maestro_id, dia, inicio, fin in existentes:
+        horas = [h for h in HORAS_VISIBLES if inicio < hora_del_dia(h + 1) and fin > hora_del_dia(h)]
+        for hora in horas:
+            if maestro_id:
+                ocupado_maestro.add((maestro_id, dia, hora))
+            for grado_id in grados_de_clase[clase_id]:
+                ocupado_grado.add((grado_id, dia, hora))
+        for grado_id in grados_de_clase[clase_id]:
+            horas_dadas[(grado_id, curso_id)] += len(horas)
+
+    cursos = {curso.pk: curso for grado in grados for curso in grado.cursos.all()}
+    maestros_por_curso = defaultdict(list)
+    for maestro_id, curso_id in Maestro.cursos.through.objects.filter(curso_id__in=cursos).values_list('maestro_id', 'curso_id'):
+        maestros_por_curso[curso_id].append(maestro_id)
+    disponibilidad = _disponibilidad({m for lista in maestros_por_curso.values() for m in lista})
+
+    variables, dominios, pendientes = [], [], Counter()
+    for grado in grados:
+        for curso in grado.cursos.all():
+            faltan = curso.creditos - horas_dadas[(grado.pk, curso.pk)]
+            if faltan <= 0:
+                continue
+            dominio = {
+                (dia, hora, maestro_id)
+                for maestro_id in maestros_por_curso[curso.pk]
+                for dia, hora in slots
+                if (grado.pk, dia, hora) not in ocupado_grado
+                and (maestro_id, dia, hora) not in ocupado_maestro
+                and (maestro_id not in disponibilidad or (dia, hora) in disponibilidad[maestro_id])
+            }
+            if not dominio:
+                # Sin maestro posible: ni se intenta
+                pendientes[(grado.pk, curso.pk)] += faltan
+                continue
+            for _ in range(faltan):
+                variables.append((grado.pk, curso.pk))
+                dominios.append(set(dominio))
+
+    busqueda = _Busqueda(variables, dominios, semilla, time.monotonic() + segundos)
+    completo = busqueda.resolver()
+    asignacion = busqueda.asignacion if completo else busqueda.mejor
+
+    sesiones = [
+        Sesion(variables[i][0], variables[i][1], dia, hora, maestro_id)
+        for i, (dia, hora, maestro_id) in sorted(asignacion.items())
+    ]
+    for i, grupo in enumerate(variables):
+        if i not in asignacion:
+            pendientes[grupo] += 1
+    return ResultadoHorario(sesiones, dict(pendientes), completo and not pendientes, busqueda.agotado)
+
+
+@transaction.atomic
+def guardar_horario(periodo, sesiones):
+    """
+    Inserta las sesiones como Clase (una hora cada una) con bulk_create y
+    las agrega a la plantilla de su grado. Devuelve cuántas clases creó.
+    """
+    clases = [
+        Clase(
+            periodo=periodo,
+            curso_id=sesion.curso_id,
+            maestro_id=sesion.maestro_id,
+            dia_semana=sesion.dia_semana,
+            hora_inicio=hora_del_dia(sesion.hora),
+            hora_fin=hora_del_dia(sesion.hora + 1),
+        )
+        for sesion in sesiones
+    ]
+    Clase.objects.bulk_create(clases)
+
+    creadas = {
+        (clase.curso_id, clase.maestro_id, clase.dia_semana, clase.hora_inicio): clase.pk for clase in clases
+    }
+    if None in creadas.values():
+        # MySQL no devuelve los pk de bulk_create: se buscan por la clave
+        # única y se descartan las clases que ya existían en el periodo
+        creadas = {
+            tuple(clave): pk
+            for pk, *clave in Clase.objects.filter(
+                periodo=periodo, hora_inicio__in={c.hora_inicio for c in clases},
+                curso_id__in={s.curso_id for s in sesiones},
+            ).values_list('pk', 'curso_id', 'maestro_id', 'dia_semana', 'hora_inicio')
+            if tuple(clave) in creadas
+        }
+    Grado.clases.through.objects.bulk_create([
+        Grado.clases.through(
+            grado_id=sesion.grado_id,
+            clase_id=creadas[(sesion.curso_id, sesion.maestro_id, sesion.dia_semana, hora_del_dia(sesion.hora))],
+        )
+        for sesion in sesiones
+    ])
+    # bulk_create no dispara las señales: se invalida el horario en caché y
+    # se inscribe a los estudiantes de cada grado en sus clases nuevas
+    transaction.on_commit(invalidar_horario)
+    sincronizar_inscripciones(clases=creadas.values())
+    return len(clases)
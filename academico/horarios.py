@@ -0,0 +1,217 @@
+"""
+Horarios: la cuadrícula en caché de cada periodo y la detección de choques.
+
+La cuadrícula (hora x día) de cada periodo se serializa a diccionarios
+simples y se guarda en la caché con una clave versionada. Las señales de
+Clase, Curso y PeriodoAcademico incrementan la versión, así que mientras
+el horario no cambie la vista lo sirve sin tocar la base de datos.
+
+Los choques se buscan con un barrido de intervalos ordenados por cada
+(periodo, día): un maestro, un grado o un estudiante no pueden tener dos
+clases que se traslapen. Los intervalos son [inicio, fin), así que una
+clase que termina a las 9:00 no choca con otra que empieza a las 9:00.
+"""
+import heapq
+import time
+from collections import defaultdict, namedtuple
+
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Clase, Grado, PeriodoAcademico
+
+HORAS_VISIBLES = list(range(7, 18))  # de 7am a 5pm
+DURACION_CACHE = 60 * 60 * 24
+
+
+def version_cache(nombre):
+    """
+    (versión, fecha de modificación) actuales de un grupo de datos en caché
+    ('horario', 'calendario', ...). Las claves que llevan la versión quedan
+    obsoletas en cuanto se llama a invalidar_cache(nombre).
+    """
+    clave_version, clave_modificado = f'{nombre}:version', f'{nombre}:modificado'
+    valores = cache.get_many([clave_version, clave_modificado])
+    version = valores.get(clave_version)
+    modificado = valores.get(clave_modificado)
+    if version is None or modificado is None:
+        # Caché vacía (o reiniciada): se empieza una versión nueva
+        version, modificado = invalidar_cache(nombre)
+    return version, modificado
+
+
+def invalidar_cache(nombre):
+    """Pasa el grupo `nombre` a una versión nueva."""
+    clave_version = f'{nombre}:version'
+    modificado = timezone.now().replace(microsecond=0)
+    try:
+        version = cache.incr(clave_version)
+    except ValueError:
+        # Sin versión (caché vacía o reiniciada): se siembra con la hora
+        # para no repetir una versión que un cliente aún tenga en su ETag
+        version = time.time_ns()
+        cache.set(clave_version, version, None)
+    cache.set(f'{nombre}:modificado', modificado, None)
+    return version, modificado
+
+
+def version_horario():
+    """(versión, fecha de modificación) actuales del horario en caché."""
+    return version_cache('horario')
+
+
+def invalidar_horario():
+    """Invalida todos los horarios en caché pasando a una versión nueva."""
+    return invalidar_cache('horario')
+
+
+def _calcular_periodos():
+    return [
+        {'pk': pk, 'nombre': nombre}
+        for pk, nombre in PeriodoAcademico.objects.order_by('pk').values_list('pk', 'nombre')
+    ]
+
+
+def _calcular_grid(periodo_id):
+    grid = {hora: {dia: [] for dia, _ in Clase.DiaSemana.choices} for hora in HORAS_VISIBLES}
+    clases = Clase.objects.filter(periodo_id=periodo_id).order_by('hora_inicio').values_list(
+        'pk', 'dia_semana', 'hora_inicio', 'hora_fin', 'curso__nombre',
+        'maestro__user__first_name', 'maestro__user__last_name',
+    )
+    for pk, dia, hora_inicio, hora_fin, curso, nombre, apellido in clases:
+        # Solo las clases que empiezan dentro del rango visible
+        if hora_inicio.hour in grid:
+            grid[hora_inicio.hour][dia].append({
+                'pk': pk,
+                'hora_inicio': hora_inicio,
+                'hora_fin': hora_fin,
+                'curso': curso,
+                'maestro': f"{nombre or ''} {apellido or ''}".strip(),
+            })
+    return grid
+
+
+def obtener_periodos(version=None):
+    """Lista de periodos ({'pk', 'nombre'}) desde la caché."""
+    if version is None:
+        version, _ = version_horario()
+    return cache.get_or_set(f'horario:periodos:v{version}', _calcular_periodos, DURACION_CACHE)
+
+
+def obtener_grid(periodo_id, version=None):
+    """La cuadrícula {hora: {dia: [clase, ...]}} del periodo, desde la caché."""
+    if version is None:
+        version, _ = version_horario()
+    return cache.get_or_set(
+        f'horario:grid:{periodo_id}:v{version}',
+        lambda: _calcular_grid(periodo_id),
+        DURACION_CACHE,
+    )
+
+
+RECURSO_MAESTRO = 'maestro'
+RECURSO_GRADO = 'grado'
+RECURSO_ESTUDIANTE = 'estudiante'
+
+Conflicto = namedtuple('Conflicto', 'tipo recurso_id dia_semana clase_a clase_b')
+
+
+def detectar_conflictos(clases, recursos):
+    """
+    Encuentra todos los pares de clases que se traslapan para un mismo recurso.
+
+    `clases` son tuplas (pk, dia_semana, hora_inicio, hora_fin) y `recursos`
+    un diccionario pk -> [(tipo, recurso_id), ...] con el maestro, los
+    grados y los estudiantes de cada clase. Por cada día se ordenan las
+    clases por hora de inicio y se barren una vez, con un montículo por
+    recurso de las clases aún abiertas: O(n log n + conflictos).
+    """
+    por_dia = defaultdict(list)
+    for pk, dia, inicio, fin in clases:
+        por_dia[dia].append((inicio, fin, pk))
+
+    conflictos = []
+    for dia, intervalos in por_dia.items():
+        intervalos.sort()
+        abiertas = defaultdict(list)  # recurso -> montículo de (fin, pk)
+        for inicio, fin, pk in intervalos:
+            for recurso in recursos.get(pk, ()):
+                monticulo = abiertas[recurso]
+                while monticulo and monticulo[0][0] <= inicio:
+                    heapq.heappop(monticulo)
+                for _, otra in monticulo:
+                    conflictos.append(Conflicto(recurso[0], recurso[1], dia, otra, pk))
+                heapq.heappush(monticulo, (fin, pk))
+    return conflictos
+
+
+def _recursos(clases):
+    """
+    El maestro, los grados y los estudiantes de cada clase del queryset,
+    con una consulta por tipo de recurso.
+    """
+    recursos = defaultdict(list)
+    for pk, maestro_id in clases.filter(maestro__isnull=False).values_list('pk', 'maestro_id'):
+        recursos[pk].append((RECURSO_MAESTRO, maestro_id))
+    for pk, grado_id in Grado.clases.through.objects.filter(clase__in=clases).values_list('clase_id', 'grado_id'):
+        recursos[pk].append((RECURSO_GRADO, grado_id))
+    for pk, estudiante_id in Clase.estudiantes.through.objects.filter(clase__in=clases).values_list('clase_id', 'estudiante_id'):
+        recursos[pk].append((RECURSO_ESTUDIANTE, estudiante_id))
+    return recursos
+
+
+def conflictos_del_periodo(periodo_id):
+    """Todos los choques de horario de un periodo."""
+    clases = Clase.objects.filter(periodo_id=periodo_id).order_by()
+    return detectar_conflictos(
+        clases.values_list('pk', 'dia_semana', 'hora_inicio', 'hora_fin'),
+        _recursos(clases),
+    )
+
+
+def conflictos_de_clase(clase, grados=None, estudiantes=None):
+    """
+    Los choques que tendría `clase` (guardada o no) con las demás clases de
+    su periodo y día. `grados` y `estudiantes` son ids; si no se indican y la
+    clase ya existe, se usan los que tiene asignados. En cada Conflicto,
+    `clase_a` es la clase evaluada y `clase_b` la otra.
+    """
+    if clase.pk:
+        if grados is None:
+            grados = list(clase.grados_asignados.values_list('pk', flat=True))
+        if estudiantes is None:
+            estudiantes = list(clase.estudiantes.values_list('pk', flat=True))
+    grados, estudiantes = list(grados or []), list(estudiantes or [])
+
+    propios = [(RECURSO_GRADO, pk) for pk in grados] + [(RECURSO_ESTUDIANTE, pk) for pk in estudiantes]
+    if clase.maestro_id:
+        propios.append((RECURSO_MAESTRO, clase.maestro_id))
+    if not propios:
+        return []
+
+    comparte = Q(maestro_id=clase.maestro_id) if clase.maestro_id else Q(pk__in=[])
+    if grados:
+        comparte |= Q(grados_asignados__in=grados)
+    if estudiantes:
+        comparte |= Q(estudiantes__in=estudiantes)
+    otras = Clase.objects.filter(
+        comparte,
+        periodo_id=clase.periodo_id,
+        dia_semana=clase.dia_semana,
+        hora_inicio__lt=clase.hora_fin,
+        hora_fin__gt=clase.hora_inicio,
+    ).exclude(pk=clase.pk).order_by().distinct()
+    otras = Clase.objects.filter(pk__in=list(otras.values_list('pk', flat=True)))
+
+    # La clase evaluada usa un pk ficticio por si aún no está guardada
+    propia = clase.pk or 0
+    recursos = _recursos(otras)
+    recursos[propia] = propios
+    filas = list(otras.values_list('pk', 'dia_semana', 'hora_inicio', 'hora_fin'))
+    filas.append((propia, clase.dia_semana, clase.hora_inicio, clase.hora_fin))
+    return [
+        c._replace(clase_a=clase.pk, clase_b=c.clase_b if c.clase_a == propia else c.clase_a)
+        for c in detectar_conflictos(filas, recursos)
+        if propia in (c.clase_a, c.clase_b)
+    ]
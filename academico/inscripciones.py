@@ -0,0 +1,111 @@
+"""
+Sincronización de inscripciones (Clase.estudiantes) con las plantillas de Grado.
+
+Cada estudiante debe estar inscrito en todas las clases de la plantilla de
+su grado. En lugar de llamar .set() clase por clase, aquí se calcula el
+conjunto completo de pares (clase_id, estudiante_id) deseado, se compara
+con la tabla intermedia en una sola consulta y la diferencia se aplica con
+un bulk_create y un único DELETE ... IN.
+
+La tabla intermedia no distingue una inscripción hecha por la plantilla
+de una manual, así que solo se dan de baja los pares que una plantilla
+acaba de perder (una clase quitada de un grado, un estudiante que cambió
+de grado) y que ninguna otra plantilla sigue pidiendo. Las demás
+inscripciones de la clase se respetan.
+"""
+from django.db import transaction
+
+from users.models import Estudiante
+
+from .horarios import invalidar_cache
+from .models import Clase, Grado
+
+Inscripcion = Clase.estudiantes.through
+GradoClase = Grado.clases.through
+
+
+def _aplicar(nuevas, sobrantes):
+    """
+    Inserta los pares `nuevas` y borra las filas de la tabla intermedia
+    con id en `sobrantes`. Devuelve (creadas, borradas).
+    """
+    with transaction.atomic():
+        Inscripcion.objects.bulk_create(
+            [Inscripcion(clase_id=clase_id, estudiante_id=estudiante_id) for clase_id, estudiante_id in nuevas],
+            batch_size=1000,
+        )
+        if sobrantes:
+            Inscripcion.objects.filter(pk__in=sobrantes).delete()
+        if nuevas or sobrantes:
+            # Las escrituras en lote no disparan m2m_changed
+            transaction.on_commit(lambda: invalidar_cache('calendario'))
+    return len(nuevas), len(sobrantes)
+
+
+def pares_de_plantilla(grados, clases):
+    """
+    Pares (clase_id, estudiante_id) que las `clases` dan a los estudiantes
+    de los `grados` (ids). Sirve para saber qué pierde una plantilla antes
+    o después de quitarle clases.
+    """
+    estudiantes = list(Estudiante.objects.filter(grado_id__in=grados).values_list('pk', flat=True))
+    return {(clase_id, estudiante_id) for clase_id in clases for estudiante_id in estudiantes}
+
+
+def sincronizar_inscripciones(periodo=None, clases=None, estudiantes=None, perdidas=()):
+    """
+    Inscribe a cada estudiante en las clases de la plantilla de su grado y
+    da de baja los pares de `perdidas` (clase_id, estudiante_id) que
+    ninguna plantilla sigue pidiendo.
+
+    Sin argumentos revisa todas las plantillas. `periodo`, `clases` (ids) y
+    `estudiantes` (ids) limitan qué inscripciones faltantes se crean.
+    Devuelve (inscripciones_creadas, borradas).
+    """
+    # Los filtros van en un solo filter() para que Django use un único
+    # JOIN con la relación multivaluada grado__estudiantes
+    filtro_deseadas = {'grado__estudiantes__isnull': False}
+    if clases is not None:
+        filtro_deseadas['clase_id__in'] = list(clases)
+    if periodo is not None:
+        filtro_deseadas['clase__periodo'] = periodo
+    if estudiantes is not None:
+        filtro_deseadas['grado__estudiantes__in'] = list(estudiantes)
+    objetivo = set(GradoClase.objects.filter(**filtro_deseadas).values_list('clase_id', 'grado__estudiantes'))
+
+    perdidas = set(perdidas)
+    if perdidas:
+        # Un par perdido sigue vigente si otra plantilla (el grado nuevo
+        # del estudiante, p. ej.) también incluye esa clase
+        perdidas -= set(GradoClase.objects.filter(
+            clase_id__in={clase_id for clase_id, _ in perdidas},
+            grado__estudiantes__in={estudiante_id for _, estudiante_id in perdidas},
+        ).values_list('clase_id', 'grado__estudiantes'))
+
+    candidatos = objetivo | perdidas
+    if not candidatos:
+        return 0, 0
+    existentes = {
+        (clase_id, estudiante_id): fila_id
+        for fila_id, clase_id, estudiante_id in Inscripcion.objects.filter(
+            clase_id__in={clase_id for clase_id, _ in candidatos},
+            estudiante_id__in={estudiante_id for _, estudiante_id in candidatos},
+        ).values_list('pk', 'clase_id', 'estudiante_id')
+    }
+    return _aplicar(
+        objetivo - existentes.keys(),
+        [fila_id for par, fila_id in existentes.items() if par in perdidas],
+    )
+
+
+def inscribir_en_clase(clase, estudiantes):
+    """
+    Deja inscritos en `clase` exactamente a `estudiantes` (ids o instancias),
+    con un solo INSERT y un solo DELETE. Devuelve (creadas, borradas).
+    """
+    ids = {getattr(estudiante, 'pk', estudiante) for estudiante in estudiantes}
+    existentes = dict(Inscripcion.objects.filter(clase=clase).values_list('estudiante_id', 'pk'))
+    return _aplicar(
+        {(clase.pk, estudiante_id) for estudiante_id in ids - existentes.keys()},
+        [fila_id for estudiante_id, fila_id in existentes.items() if estudiante_id not in ids],
+    )
@@ -0,0 +1,30 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from academico.asistencia import detectar_ausentismo
+
+
+class Command(BaseCommand):
+    help = 'Detecta estudiantes con ausentismo crónico en los últimos días lectivos y genera alertas. Pensado para correr cada noche (cron).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=20, help='Días lectivos a evaluar (por defecto 20).')
+        parser.add_argument('--umbral', type=Decimal, default=Decimal('10'), help='Porcentaje de ausencia a partir del cual se alerta (por defecto 10).')
+        parser.add_argument('--minimo', type=int, default=5, help='Registros de asistencia mínimos para evaluar a un estudiante (por defecto 5).')
+        parser.add_argument('--sin-notificacion', action='store_true', help='Solo guarda las alertas, sin enviar la notificación a los maestros.')
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        alertas, nuevas = detectar_ausentismo(
+            dias=options['dias'],
+            umbral=options['umbral'],
+            minimo_registros=options['minimo'],
+            notificar=not options['sin_notificacion'],
+        )
+        segundos = time.monotonic() - inicio
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Estudiantes en alerta: {len(alertas)} ({len(nuevas)} nuevos) ({segundos:.2f} s)."
+        ))
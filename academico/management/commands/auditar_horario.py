@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from academico.horarios import RECURSO_ESTUDIANTE, RECURSO_GRADO, RECURSO_MAESTRO, conflictos_del_periodo
+from academico.models import Clase, Grado, PeriodoAcademico
+from users.models import Estudiante, Maestro
+
+
+class Command(BaseCommand):
+    help = 'Lista los choques de horario (maestro, grado o estudiante con dos clases a la vez) de un periodo o de todos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--periodo', type=int, help='ID del periodo académico (por defecto, todos).')
+
+    def _nombres(self, conflictos):
+        """Nombres de las clases y recursos involucrados, con una consulta por modelo."""
+        ids = {RECURSO_MAESTRO: set(), RECURSO_GRADO: set(), RECURSO_ESTUDIANTE: set()}
+        clases = set()
+        for conflicto in conflictos:
+            ids[conflicto.tipo].add(conflicto.recurso_id)
+            clases.update((conflicto.clase_a, conflicto.clase_b))
+        return {
+            'clase': {pk: str(c) for pk, c in Clase.objects.select_related('curso').in_bulk(clases).items()},
+            RECURSO_MAESTRO: {pk: m.user.get_full_name() for pk, m in Maestro.objects.select_related('user').in_bulk(ids[RECURSO_MAESTRO]).items()},
+            RECURSO_GRADO: {pk: g.nombre for pk, g in Grado.objects.in_bulk(ids[RECURSO_GRADO]).items()},
+            RECURSO_ESTUDIANTE: {pk: e.user.get_full_name() for pk, e in Estudiante.objects.select_related('user').in_bulk(ids[RECURSO_ESTUDIANTE]).items()},
+        }
+
+    def handle(self, *args, **options):
+        periodos = PeriodoAcademico.objects.order_by('pk')
+        if options['periodo']:
+            periodos = periodos.filter(pk=options['periodo'])
+            if not periodos.exists():
+                raise CommandError("El periodo indicado no existe.")
+
+        total = 0
+        for periodo in periodos:
+            inicio = time.monotonic()
+            conflictos = conflictos_del_periodo(periodo.pk)
+            segundos = time.monotonic() - inicio
+            total += len(conflictos)
+
+            self.stdout.write(f"{periodo.nombre}: {len(conflictos)} choques ({segundos:.2f} s)")
+            nombres = self._nombres(conflictos)
+            for conflicto in sorted(conflictos):
+                self.stdout.write(
+                    f"  [{conflicto.tipo}] {nombres[conflicto.tipo].get(conflicto.recurso_id, conflicto.recurso_id)}: "
+                    f"{nombres['clase'][conflicto.clase_a]} <-> {nombres['clase'][conflicto.clase_b]}"
+                )
+
+        estilo = self.style.WARNING if total else self.style.SUCCESS
+        self.stdout.write(estilo(f"Total de choques: {total}."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from academico.clasificacion import cerrar_periodo
+from academico.models import PeriodoAcademico
+
+
+class Command(BaseCommand):
+    help = 'Cierra un periodo académico y guarda las clasificaciones (posición y percentil) de sus estudiantes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--periodo', type=int, required=True, help='ID del periodo académico a cerrar.')
+
+    def handle(self, *args, **options):
+        try:
+            periodo = PeriodoAcademico.objects.get(pk=options['periodo'])
+        except PeriodoAcademico.DoesNotExist:
+            raise CommandError("El periodo indicado no existe.")
+
+        if periodo.cerrado:
+            self.stdout.write(f"El periodo {periodo} ya estaba cerrado; se recalculan sus clasificaciones.")
+        filas = cerrar_periodo(periodo)
+        self.stdout.write(self.style.SUCCESS(f"Periodo {periodo} cerrado: {filas} clasificaciones guardadas."))
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from academico.boletas import estudiantes_del_periodo, generar_boletas, zip_de_boletas
+from academico.models import Grado, PeriodoAcademico
+
+
+class Command(BaseCommand):
+    help = 'Genera en un ZIP las boletas de calificaciones (PDF) de los estudiantes de un grado o periodo.'
+
+    def add_arguments(self, parser):
+        grupo = parser.add_mutually_exclusive_group(required=True)
+        grupo.add_argument('--grado', type=int, help='ID del grado.')
+        grupo.add_argument('--periodo', type=int, help='ID del periodo académico (todos sus estudiantes).')
+        parser.add_argument('--salida', help='Archivo ZIP de salida (por defecto boletas_<grado o periodo>.zip).')
+        parser.add_argument('--procesos', type=int, help='Procesos para generar los PDF (por defecto, uno por CPU).')
+
+    def handle(self, *args, **options):
+        try:
+            if options['grado']:
+                grado = Grado.objects.select_related('periodo').get(pk=options['grado'])
+                periodo, estudiantes = grado.periodo, grado.estudiantes.all()
+                salida = options['salida'] or f"boletas_grado_{grado.pk}.zip"
+            else:
+                periodo = PeriodoAcademico.objects.get(pk=options['periodo'])
+                estudiantes = estudiantes_del_periodo(periodo)
+                salida = options['salida'] or f"boletas_periodo_{periodo.pk}.zip"
+        except (Grado.DoesNotExist, PeriodoAcademico.DoesNotExist):
+            raise CommandError("El grado o periodo indicado no existe.")
+
+        inicio = time.monotonic()
+        total = 0
+
+        def contar(boletas):
+            nonlocal total
+            for boleta in boletas:
+                total += 1
+                yield boleta
+
+        with open(salida, 'wb') as archivo:
+            for bloque in zip_de_boletas(contar(generar_boletas(periodo, estudiantes, procesos=options['procesos']))):
+                archivo.write(bloque)
+        self.stdout.write(self.style.SUCCESS(
+            f"{total} boletas generadas en {salida} ({time.monotonic() - inicio:.1f} s)."
+        ))
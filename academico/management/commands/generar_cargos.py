@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from academico.finanzas import generar_cargos
+from academico.models import Grado, PeriodoAcademico
+
+
+class Command(BaseCommand):
+    help = 'Crea los cargos de Inscripción, Útiles y Colegiaturas que les faltan a los estudiantes de un grado o periodo.'
+
+    def add_arguments(self, parser):
+        grupo = parser.add_mutually_exclusive_group(required=True)
+        grupo.add_argument('--grado', type=int, help='ID del grado.')
+        grupo.add_argument('--periodo', type=int, help='ID del periodo académico (todos sus grados).')
+
+    def handle(self, *args, **options):
+        try:
+            if options['grado']:
+                resumen = generar_cargos(Grado.objects.select_related('periodo').get(pk=options['grado']))
+            else:
+                resumen = generar_cargos(periodo=PeriodoAcademico.objects.get(pk=options['periodo']))
+        except (Grado.DoesNotExist, PeriodoAcademico.DoesNotExist):
+            raise CommandError("El grado o periodo indicado no existe.")
+
+        for concepto, total in resumen['por_concepto'].items():
+            self.stdout.write(f"  {concepto}: {total}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Se crearon {resumen['cargos_creados']} cargos para {resumen['estudiantes']} estudiantes."
+        ))
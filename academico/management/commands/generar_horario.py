@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from academico.generador_horario import guardar_horario, planificar_horario
+from academico.models import Grado, PeriodoAcademico
+
+
+class Command(BaseCommand):
+    help = 'Genera sin choques las clases que les faltan a los grados de un periodo (según su plan de estudios) y las agrega a su plantilla.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('periodo', type=int, help='ID del periodo académico.')
+        parser.add_argument('--grado', type=int, action='append', help='ID de un grado (se puede repetir). Por defecto, todos los del periodo.')
+        parser.add_argument('--semilla', type=int, default=0, help='Semilla para que el resultado sea reproducible.')
+        parser.add_argument('--segundos', type=float, default=30, help='Tiempo máximo de búsqueda.')
+        parser.add_argument('--parcial', action='store_true', help='Guardar lo encontrado aunque no se complete el horario.')
+        parser.add_argument('--simular', action='store_true', help='Solo mostrar el resultado, sin guardar.')
+
+    def handle(self, *args, **options):
+        try:
+            periodo = PeriodoAcademico.objects.get(pk=options['periodo'])
+        except PeriodoAcademico.DoesNotExist:
+            raise CommandError("El periodo indicado no existe.")
+        grados = Grado.objects.filter(periodo=periodo)
+        if options['grado']:
+            grados = grados.filter(pk__in=options['grado'])
+
+        resultado = planificar_horario(periodo, grados, semilla=options['semilla'], segundos=options['segundos'])
+
+        if resultado.pendientes:
+            nombres = {g.pk: g.nombre for g in grados}
+            cursos = {c.pk: c.nombre for g in grados.prefetch_related('cursos') for c in g.cursos.all()}
+            for (grado_id, curso_id), horas in sorted(resultado.pendientes.items()):
+                self.stdout.write(self.style.WARNING(f"  Sin asignar: {nombres[grado_id]} / {cursos[curso_id]}: {horas} h"))
+        if resultado.agotado:
+            self.stdout.write(self.style.WARNING("Se agotó el tiempo de búsqueda."))
+
+        if options['simular'] or not (resultado.completo or options['parcial']):
+            self.stdout.write(f"Se encontraron {len(resultado.sesiones)} sesiones; no se guardó nada.")
+            return
+
+        creadas = guardar_horario(periodo, resultado.sesiones)
+        self.stdout.write(self.style.SUCCESS(f"Se crearon {creadas} clases."))
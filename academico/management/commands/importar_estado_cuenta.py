@@ -0,0 +1,33 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from academico.conciliacion import importar_estado_cuenta
+
+
+class Command(BaseCommand):
+    help = 'Importa un estado de cuenta bancario (CSV) y registra los pagos que pueda conciliar.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='Ruta del archivo CSV.')
+        parser.add_argument('--lote', type=int, default=500, help='Filas procesadas por lote (por defecto 500).')
+
+    def handle(self, *args, **options):
+        try:
+            archivo = open(options['archivo'], encoding='utf-8-sig', newline='')
+        except OSError as e:
+            raise CommandError(f"No se pudo abrir el archivo: {e}")
+
+        with archivo:
+            conciliacion = importar_estado_cuenta(
+                archivo,
+                nombre=os.path.basename(options['archivo']),
+                tamano_lote=options['lote'],
+            )
+
+        for excepcion in conciliacion.excepciones.all():
+            self.stdout.write(self.style.WARNING(str(excepcion)))
+        self.stdout.write(self.style.SUCCESS(
+            f"{conciliacion.filas_leidas} filas leídas, {conciliacion.pagos_creados} pagos registrados "
+            f"por ${conciliacion.total_conciliado} (conciliación #{conciliacion.pk})."
+        ))
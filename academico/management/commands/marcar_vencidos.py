@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from academico.finanzas import marcar_vencidos
+
+
+class Command(BaseCommand):
+    help = 'Marca como VENCIDO los cargos pendientes con fecha pasada y como PAGADO los que ya no tienen saldo. Pensado para correr cada noche (cron).'
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        conteos = marcar_vencidos()
+        segundos = time.monotonic() - inicio
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Vencidos: {conteos['vencidos']}, pagados: {conteos['pagados']}, "
+            f"reabiertos: {conteos['reabiertos']} ({segundos:.2f} s)."
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from academico.finanzas import recalcular_saldos
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el monto pagado y el saldo de cada cargo a partir de sus pagos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Cantidad de cargos por lote (por defecto 1000).')
+        parser.add_argument('--solo-reportar', action='store_true', help='Solo muestra las diferencias, sin corregirlas.')
+
+    def handle(self, *args, **options):
+        revisados, diferencias = recalcular_saldos(
+            tamano_lote=options['lote'],
+            corregir=not options['solo_reportar'],
+        )
+
+        for cargo_id, guardado, real in diferencias:
+            self.stdout.write(f"Cargo #{cargo_id}: pagado guardado {guardado}, pagado real {real}")
+
+        if not diferencias:
+            self.stdout.write(self.style.SUCCESS(f"{revisados} cargos revisados, sin diferencias."))
+        elif options['solo_reportar']:
+            self.stdout.write(self.style.WARNING(f"{revisados} cargos revisados, {len(diferencias)} con diferencias (sin corregir)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{revisados} cargos revisados, {len(diferencias)} corregidos."))
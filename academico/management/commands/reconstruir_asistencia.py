@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from academico.asistencia import reconstruir_resumenes_asistencia
+from academico.models import Clase
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los resúmenes de asistencia (por clase y por mes) desde los registros de asistencia.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=200, help='Cantidad de clases por lote (por defecto 200).')
+        parser.add_argument('--periodo', type=int, help='ID del periodo académico a recalcular (por defecto, todos).')
+
+    def handle(self, *args, **options):
+        clases = Clase.objects.all()
+        if options['periodo']:
+            clases = clases.filter(periodo_id=options['periodo'])
+
+        procesadas, creados = reconstruir_resumenes_asistencia(clases, tamano_lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f"{procesadas} clases procesadas, {creados} resúmenes generados."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from academico.calificaciones import reconstruir_resumen_calificaciones
+from academico.models import Clase
+
+
+class Command(BaseCommand):
+    help = 'Concilia los resúmenes de calificaciones (suma y cantidad de notas por estudiante y clase) con las entregas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=200, help='Cantidad de clases por lote (por defecto 200).')
+        parser.add_argument('--periodo', type=int, help='ID del periodo académico a conciliar (por defecto, todos).')
+
+    def handle(self, *args, **options):
+        clases = Clase.objects.all()
+        if options['periodo']:
+            clases = clases.filter(periodo_id=options['periodo'])
+
+        procesadas, corregidos = reconstruir_resumen_calificaciones(clases, tamano_lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f"{procesadas} clases procesadas, {corregidos} resúmenes corregidos."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from academico.inscripciones import sincronizar_inscripciones
+from academico.models import PeriodoAcademico
+
+
+class Command(BaseCommand):
+    help = 'Inscribe a cada estudiante en las clases de la plantilla de su grado que le falten (no da de baja inscripciones manuales).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--periodo', type=int, help='ID del periodo académico (por defecto, todos).')
+
+    def handle(self, *args, **options):
+        periodo = None
+        if options['periodo']:
+            try:
+                periodo = PeriodoAcademico.objects.get(pk=options['periodo'])
+            except PeriodoAcademico.DoesNotExist:
+                raise CommandError("El periodo indicado no existe.")
+
+        creadas, _ = sincronizar_inscripciones(periodo=periodo)
+        self.stdout.write(self.style.SUCCESS(f"Inscripciones creadas: {creadas}."))
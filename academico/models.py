@@ -1,6 +1,7 @@
 from django.db import models
-from django.db.models import Sum
-import datetime
+from django.core.validators import MinValueValidator
+from django.db.models import F
+from decimal import Decimal
 from django.utils import timezone
 from django.conf import settings
 # Create your models here.
@@ -44,6 +45,8 @@ class PeriodoAcademico(models.Model):
     nombre = models.CharField(max_length=100, unique=True, verbose_name="Nombre del Periodo")
     fecha_inicio = models.DateField()
     fecha_fin = models.DateField()
+    # Al cerrarlo se guardan las clasificaciones (ver academico.clasificacion)
+    cerrado = models.BooleanField(default=False, verbose_name="¿Cerrado?")
 
     class Meta:
         verbose_name = "Periodo Académico"
@@ -92,6 +95,46 @@ class Clase(models.Model):
     def __str__(self):
         return f"{self.curso.nombre} ({self.get_dia_semana_display()} {self.hora_inicio:%H:%M} - {self.hora_fin:%H:%M})"
 
+class DisponibilidadMaestro(models.Model):
+    """
+    Franja en la que un maestro puede dar clases. Un maestro sin franjas
+    registradas se considera disponible en todo el horario escolar.
+    """
+    maestro = models.ForeignKey('users.Maestro', on_delete=models.CASCADE, related_name='disponibilidad')
+    dia_semana = models.CharField(max_length=3, choices=Clase.DiaSemana.choices)
+    hora_inicio = models.TimeField()
+    hora_fin = models.TimeField()
+
+    class Meta:
+        verbose_name = "Disponibilidad de Maestro"
+        verbose_name_plural = "Disponibilidad de Maestros"
+        ordering = ['maestro', 'dia_semana', 'hora_inicio']
+
+    def __str__(self):
+        return f"{self.maestro} - {self.get_dia_semana_display()} {self.hora_inicio:%H:%M} - {self.hora_fin:%H:%M}"
+
+class CategoriaCalificacion(models.Model):
+    """
+    Rubro de evaluación de un curso (Exámenes, Tareas, Proyectos...) con su
+    peso en la nota final. Los pesos son relativos: no tienen que sumar 100.
+    """
+    curso = models.ForeignKey(Curso, on_delete=models.CASCADE, related_name='categorias_calificacion')
+    nombre = models.CharField(max_length=50, verbose_name="Nombre de la Categoría")
+    peso = models.DecimalField(
+        max_digits=5, decimal_places=2,
+        validators=[MinValueValidator(Decimal('0.01'))],
+        verbose_name="Peso",
+    )
+
+    class Meta:
+        verbose_name = "Categoría de Calificación"
+        verbose_name_plural = "Categorías de Calificación"
+        unique_together = ('curso', 'nombre')
+        ordering = ['curso', 'nombre']
+
+    def __str__(self):
+        return f"{self.curso.nombre} - {self.nombre} ({self.peso})"
+
 class Actividad(models.Model):
     """
     Representa una tarea, proyecto o cualquier actividad asignada por un maestro
@@ -102,6 +145,14 @@ class Actividad(models.Model):
     descripcion = models.TextField(blank=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_entrega = models.DateTimeField(verbose_name="Fecha Límite de Entrega")
+    categoria = models.ForeignKey(
+        CategoriaCalificacion,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='actividades',
+        verbose_name="Categoría",
+    )
     recurso_adjunto = models.FileField(
         upload_to='actividades/recursos/', 
         blank=True, 
@@ -128,6 +179,12 @@ class Entrega(models.Model):
     comentarios = models.TextField(blank=True, verbose_name="Comentarios del Estudiante")
     calificacion = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     comentarios_maestro = models.TextField(blank=True, verbose_name="Comentarios del Maestro")
+    # Sube con cada calificación guardada desde el portal; los formularios la
+    # devuelven para detectar que otra pestaña calificó mientras tanto
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # Creada al poner la nota desde el libro de calificaciones, sin que el
+    # estudiante haya entregado nada; deja de serlo cuando él entrega
+    solo_calificacion = models.BooleanField(default=False, editable=False, verbose_name="Solo Calificación")
 
     class Meta:
         verbose_name = "Entrega"
@@ -138,6 +195,31 @@ class Entrega(models.Model):
     def __str__(self):
         return f"Entrega de {self.estudiante.user.get_full_name()} para {self.actividad.titulo}"
 
+class ResumenCalificaciones(models.Model):
+    """
+    Suma y cantidad de las notas de un estudiante en una clase, para leer
+    promedios sin recorrer sus entregas. El periodo es el de la clase. Se
+    mantiene con cada nota guardada (ver academico.calificaciones).
+    """
+    estudiante = models.ForeignKey('users.Estudiante', on_delete=models.CASCADE, related_name='resumenes_calificaciones')
+    clase = models.ForeignKey(Clase, on_delete=models.CASCADE, related_name='resumenes_calificaciones')
+    suma = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Suma de Notas")
+    cantidad = models.IntegerField(default=0, verbose_name="Notas")
+
+    class Meta:
+        verbose_name = "Resumen de Calificaciones"
+        verbose_name_plural = "Resúmenes de Calificaciones"
+        unique_together = ('estudiante', 'clase')
+
+    def __str__(self):
+        return f"{self.estudiante} - {self.clase}"
+
+    @property
+    def promedio(self):
+        if not self.cantidad:
+            return None
+        return self.suma / self.cantidad
+
 
     
 class Cargo(models.Model):
@@ -161,34 +243,69 @@ class Cargo(models.Model):
 
     estado = models.CharField(max_length=10, choices=EstadoCargo.choices, default=EstadoCargo.PENDIENTE)
 
+    # Saldos desnormalizados: los mantienen las señales de Pago (ver aplicar_pago)
+    # y se reconstruyen con el comando `recalcular_saldos`.
+    monto_pagado = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, verbose_name="Monto Pagado")
+    saldo = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, verbose_name="Saldo Pendiente")
+
+    CAMPOS_SALDO = ('monto_pagado', 'saldo')
+
     class Meta:
         verbose_name = "Cargo"
         verbose_name_plural = "Cargos"
         ordering = ['-fecha_vencimiento']
+        indexes = [
+            # Para el barrido nocturno de cargos vencidos (ver finanzas.marcar_vencidos)
+            models.Index(fields=['estado', 'fecha_vencimiento'], name='cargo_estado_venc_idx'),
+            # Cursor de paginación de CargoListView
+            models.Index(fields=['-fecha_emision', '-id'], name='cargo_emision_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.concepto} - {self.estudiante.user.get_full_name()} (${self.monto})"
 
-    @property
-    def monto_pagado(self):
-        """Calcula cuánto se ha pagado para este cargo."""
-        total_pagado = self.pagos.aggregate(Sum('monto'))['monto__sum'] or 0
-        return total_pagado
-
     @property
     def saldo_pendiente(self):
-        """Calcula el saldo que falta por pagar."""
-        return self.monto - self.monto_pagado
-
-    def actualizar_estado(self):
-        """Actualiza el estado del cargo basado en los pagos."""
-        if self.saldo_pendiente <= 0:
-            self.estado = self.EstadoCargo.PAGADO
-        elif self.fecha_vencimiento < datetime.date.today():
-            self.estado = self.EstadoCargo.VENCIDO
-        else:
-            self.estado = self.EstadoCargo.PENDIENTE
-        self.save()
+        """El saldo que falta por pagar (columna almacenada)."""
+        return self.saldo
+
+    def save(self, *args, **kwargs):
+        """
+        Los campos de saldo solo se escriben al crear el cargo. Después los
+        mantiene aplicar_pago(), así que aquí nunca se pisan con valores viejos.
+        """
+        if self._state.adding:
+            self.saldo = self.monto - self.monto_pagado
+            super().save(*args, **kwargs)
+            return
+
+        if kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.CAMPOS_SALDO
+            ]
+        super().save(*args, **kwargs)
+
+        # Si cambió el monto base, el saldo se recalcula en la base de datos
+        # y el estado (un cargo que queda sin saldo pasa a PAGADO) al confirmar
+        if 'monto' in kwargs['update_fields']:
+            from .recalculo import programar_recalculo  # recalculo importa este módulo
+
+            Cargo.objects.filter(pk=self.pk).update(saldo=F('monto') - F('monto_pagado'))
+            self.refresh_from_db(fields=self.CAMPOS_SALDO)
+            programar_recalculo(self.pk)
+
+    @classmethod
+    def aplicar_pago(cls, cargo_id, monto):
+        """
+        Suma `monto` a lo pagado del cargo (o lo resta si es negativo) con un
+        UPDATE atómico. El estado se recalcula aparte, al confirmar la
+        transacción (ver academico.recalculo).
+        """
+        cls.objects.filter(pk=cargo_id).update(
+            monto_pagado=F('monto_pagado') + monto,
+            saldo=F('saldo') - monto,
+        )
 
 class Pago(models.Model):
     """
@@ -206,6 +323,8 @@ class Pago(models.Model):
     fecha_pago = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Pago")
     metodo_pago = models.CharField(max_length=20, choices=MetodoPago.choices)
     referencia = models.CharField(max_length=100, blank=True, null=True, verbose_name="Referencia/Boleta")
+    # Evita registrar dos veces el mismo pago (reenvío del formulario, reimportación)
+    clave_idempotencia = models.CharField(max_length=120, unique=True, null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = "Pago"
@@ -215,6 +334,76 @@ class Pago(models.Model):
     def __str__(self):
         return f"Pago de ${self.monto} por {self.estudiante.user.get_full_name()}"
     
+class ConciliacionBancaria(models.Model):
+    """
+    Una importación de estado de cuenta bancario: registra quién la hizo
+    y cuántas filas se convirtieron en pagos.
+    """
+    archivo = models.CharField(max_length=255, verbose_name="Archivo")
+    fecha = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Importación")
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    filas_leidas = models.PositiveIntegerField(default=0)
+    pagos_creados = models.PositiveIntegerField(default=0)
+    total_conciliado = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Conciliación Bancaria"
+        verbose_name_plural = "Conciliaciones Bancarias"
+        ordering = ['-fecha']
+
+    def __str__(self):
+        return f"{self.archivo} ({self.fecha:%Y-%m-%d %H:%M})"
+
+class ExcepcionConciliacion(models.Model):
+    """
+    Una fila del estado de cuenta que no se pudo aplicar a ningún cargo
+    y queda pendiente de revisión manual.
+    """
+    conciliacion = models.ForeignKey(ConciliacionBancaria, on_delete=models.CASCADE, related_name='excepciones')
+    numero_fila = models.PositiveIntegerField(verbose_name="Fila")
+    matricula = models.CharField(max_length=20, blank=True)
+    referencia = models.CharField(max_length=100, blank=True)
+    monto = models.CharField(max_length=30, blank=True)
+    motivo = models.CharField(max_length=200)
+    resuelta = models.BooleanField(default=False, verbose_name="¿Resuelta?")
+
+    class Meta:
+        verbose_name = "Excepción de Conciliación"
+        verbose_name_plural = "Excepciones de Conciliación"
+        ordering = ['conciliacion', 'numero_fila']
+
+    def __str__(self):
+        return f"Fila {self.numero_fila}: {self.motivo}"
+
+class AntiguedadSaldo(models.Model):
+    """
+    Resumen precalculado de saldos por cobrar según los días de atraso,
+    por periodo y grado. Lo llena finanzas.actualizar_antiguedad(); las
+    señales de Pago y Cargo marcan como no vigentes las filas afectadas.
+    """
+    periodo = models.ForeignKey(PeriodoAcademico, on_delete=models.CASCADE, null=True, blank=True, related_name='antiguedad_saldos')
+    grado = models.ForeignKey('Grado', on_delete=models.CASCADE, null=True, blank=True, related_name='antiguedad_saldos')
+
+    corriente = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Por vencer")
+    dias_0_30 = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="0-30 días")
+    dias_31_60 = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="31-60 días")
+    dias_61_90 = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="61-90 días")
+    dias_mas_90 = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Más de 90 días")
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Saldo Total")
+    cantidad_cargos = models.PositiveIntegerField(default=0, verbose_name="Cargos con Saldo")
+
+    fecha_calculo = models.DateField(null=True, blank=True, verbose_name="Calculado el")
+    vigente = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = "Antigüedad de Saldos"
+        verbose_name_plural = "Antigüedad de Saldos"
+        unique_together = ('periodo', 'grado')
+        ordering = ['periodo', 'grado']
+
+    def __str__(self):
+        return f"{self.periodo or 'Sin periodo'} / {self.grado or 'Sin grado'}"
+
 class AsistenciaClase(models.Model):
     """
     Guarda el registro de asistencia de un estudiante a una clase
@@ -243,10 +432,133 @@ class AsistenciaClase(models.Model):
         # Un estudiante solo tiene un registro por clase por día
         unique_together = ('clase', 'estudiante', 'fecha')
         ordering = ['-fecha', 'estudiante__user__last_name']
+        indexes = [
+            # Cubre las consultas por rango de fechas de toda la escuela
+            # (alertas de ausentismo) sin leer la tabla
+            models.Index(fields=['fecha', 'estudiante', 'estado'], name='asistencia_fecha_idx'),
+        ]
 
     def __str__(self):
         return f"{self.estudiante.user.get_full_name()} - {self.clase.curso.nombre} ({self.fecha})"
-    
+
+class ConteoAsistencia(models.Model):
+    """
+    Conteo de registros de asistencia por estado. Los resúmenes se mantienen
+    al guardar la asistencia (ver academico.asistencia) para no recorrer
+    AsistenciaClase cada vez que se muestra un porcentaje.
+    """
+    presentes = models.IntegerField(default=0)
+    ausentes = models.IntegerField(default=0)
+    tardanzas = models.IntegerField(default=0)
+    justificados = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def tasa_asistencia(self):
+        """Porcentaje de asistencia (las tardanzas cuentan como asistencia y
+        las ausencias justificadas no cuentan en contra). None si no hay datos."""
+        return tasa_asistencia(self.presentes, self.ausentes, self.tardanzas)
+
+def tasa_asistencia(presentes, ausentes, tardanzas):
+    """Porcentaje de asistencia a partir de los conteos; None si no hay base."""
+    asistio = (presentes or 0) + (tardanzas or 0)
+    total = asistio + (ausentes or 0)
+    if not total:
+        return None
+    return round(asistio * 100 / total, 1)
+
+class ResumenAsistencia(ConteoAsistencia):
+    """
+    Asistencia acumulada de un estudiante en una clase. El periodo es el de
+    la clase: los totales del periodo se suman sobre clase__periodo.
+    """
+    estudiante = models.ForeignKey('users.Estudiante', on_delete=models.CASCADE, related_name='resumenes_asistencia')
+    clase = models.ForeignKey(Clase, on_delete=models.CASCADE, related_name='resumenes_asistencia')
+
+    class Meta:
+        verbose_name = "Resumen de Asistencia"
+        verbose_name_plural = "Resúmenes de Asistencia"
+        unique_together = ('estudiante', 'clase')
+
+    def __str__(self):
+        return f"{self.estudiante} - {self.clase}"
+
+class ResumenAsistenciaMensual(ConteoAsistencia):
+    """Asistencia de un estudiante en una clase durante un mes."""
+    estudiante = models.ForeignKey('users.Estudiante', on_delete=models.CASCADE, related_name='resumenes_asistencia_mensual')
+    clase = models.ForeignKey(Clase, on_delete=models.CASCADE, related_name='resumenes_asistencia_mensual')
+    mes = models.DateField(verbose_name="Mes (primer día)")
+
+    class Meta:
+        verbose_name = "Resumen Mensual de Asistencia"
+        verbose_name_plural = "Resúmenes Mensuales de Asistencia"
+        unique_together = ('estudiante', 'clase', 'mes')
+        ordering = ['mes']
+
+    def __str__(self):
+        return f"{self.estudiante} - {self.clase} ({self.mes:%m/%Y})"
+
+class AlertaAusentismo(models.Model):
+    """
+    Estudiante cuya tasa de ausencia en los últimos días lectivos pasó el
+    umbral. La genera el comando alertas_ausentismo (ver
+    academico.asistencia.detectar_ausentismo); hay una fila por estudiante
+    y fecha de corte.
+    """
+    estudiante = models.ForeignKey('users.Estudiante', on_delete=models.CASCADE, related_name='alertas_ausentismo')
+    desde = models.DateField(verbose_name="Desde")
+    hasta = models.DateField(verbose_name="Hasta")
+    registros = models.PositiveIntegerField(verbose_name="Registros de Asistencia")
+    ausencias = models.PositiveIntegerField(verbose_name="Ausencias")
+    tasa_ausencia = models.DecimalField(max_digits=5, decimal_places=1, verbose_name="% Ausencia")
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    atendida = models.BooleanField(default=False, verbose_name="¿Atendida?")
+
+    class Meta:
+        verbose_name = "Alerta de Ausentismo"
+        verbose_name_plural = "Alertas de Ausentismo"
+        unique_together = ('estudiante', 'hasta')
+        ordering = ['-hasta', '-tasa_ausencia']
+
+    def __str__(self):
+        return f"{self.estudiante} - {self.tasa_ausencia}% ({self.desde} a {self.hasta})"
+
+class ClasificacionEstudiante(models.Model):
+    """
+    Posición y percentil de un estudiante por su nota final, dentro de una
+    clase, de su grado o de todo el periodo. Es una foto tomada al cerrar
+    el periodo (ver academico.clasificacion.cerrar_periodo); los portales
+    solo la leen.
+    """
+    class Ambito(models.TextChoices):
+        PERIODO = 'PERIODO', 'Periodo'
+        GRADO = 'GRADO', 'Grado'
+        CLASE = 'CLASE', 'Clase'
+
+    periodo = models.ForeignKey(PeriodoAcademico, on_delete=models.CASCADE, related_name='clasificaciones')
+    estudiante = models.ForeignKey('users.Estudiante', on_delete=models.CASCADE, related_name='clasificaciones')
+    ambito = models.CharField(max_length=10, choices=Ambito.choices, verbose_name="Ámbito")
+    grado = models.ForeignKey('Grado', on_delete=models.CASCADE, null=True, blank=True, related_name='clasificaciones')
+    clase = models.ForeignKey(Clase, on_delete=models.CASCADE, null=True, blank=True, related_name='clasificaciones')
+    promedio = models.DecimalField(max_digits=5, decimal_places=2, verbose_name="Promedio Ponderado")
+    posicion = models.PositiveIntegerField(default=0, verbose_name="Posición")
+    percentil = models.DecimalField(max_digits=4, decimal_places=1, default=0, verbose_name="Percentil")
+    participantes = models.PositiveIntegerField(default=0, verbose_name="Participantes")
+
+    class Meta:
+        verbose_name = "Clasificación de Estudiante"
+        verbose_name_plural = "Clasificaciones de Estudiantes"
+        ordering = ['periodo', 'ambito', 'grado', 'clase', 'posicion']
+        indexes = [
+            models.Index(fields=['periodo', 'ambito', 'posicion'], name='clasificacion_ambito_idx'),
+            models.Index(fields=['estudiante', 'periodo'], name='clasificacion_estudiante_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.estudiante} - {self.get_ambito_display()} {self.periodo}: {self.posicion}°"
+
 class Competencia(models.Model):
     """
     Representa una competencia o estándar de aprendizaje,
@@ -310,6 +622,13 @@ class Grado(models.Model):
         related_name="grados_asignados",
         verbose_name="Plantilla de Clases"
     )
+    # Cursos que el grado debe recibir; las horas semanales son los créditos del curso
+    cursos = models.ManyToManyField(
+        Curso,
+        blank=True,
+        related_name="grados",
+        verbose_name="Plan de Estudios"
+    )
     
     # --- Parte Financiera (La plantilla de costos) ---
     monto_inscripcion = models.DecimalField(
@@ -0,0 +1,13 @@
+"""
+Conversión de HTML a PDF para los procesos de trabajo de
+academico.boletas.
+
+Este módulo no importa Django: un proceso hijo lo puede cargar sin
+configurar el proyecto, sea cual sea la forma en que se inicie el pool.
+"""
+from weasyprint import HTML
+
+
+def escribir_pdf(html):
+    """Convierte un documento HTML completo en los bytes de su PDF."""
+    return HTML(string=html).write_pdf()
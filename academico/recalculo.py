@@ -0,0 +1,74 @@
+"""
+Cola diferida para recalcular el estado de los cargos.
+
+Las señales de Pago no recalculan el cargo en el momento: solo anotan su
+id. Al confirmar la transacción (transaction.on_commit) todos los cargos
+anotados se recalculan juntos con finanzas.marcar_vencidos, así que diez
+pagos al mismo cargo en una transacción cuestan un solo recálculo.
+
+Para procesos masivos que no corren dentro de una transacción se puede
+usar explícitamente:
+
+    with recalculo_diferido():
+        ...  # crear o borrar muchos pagos
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from .finanzas import invalidar_antiguedad, marcar_vencidos
+from .models import Cargo
+
+_estado = threading.local()
+
+
+def _pendientes():
+    if not hasattr(_estado, 'cargos'):
+        _estado.cargos = set()
+        _estado.diferido = 0
+    return _estado.cargos
+
+
+def ejecutar_recalculos():
+    """Recalcula en una sola pasada todos los cargos pendientes."""
+    ids = _pendientes()
+    if not ids:
+        return
+    _estado.cargos = set()
+
+    cargos = Cargo.objects.filter(pk__in=ids)
+    marcar_vencidos(cargos)
+    invalidar_antiguedad(set(cargos.values_list('periodo_id', 'estudiante__grado_id')))
+
+
+def programar_recalculo(cargo_id):
+    """
+    Anota un cargo para recalcular al confirmar la transacción actual (o al
+    salir del bloque recalculo_diferido, si hay uno abierto).
+    """
+    _pendientes().add(cargo_id)
+    if _estado.diferido:
+        return
+
+    # Un solo callback por transacción. Si una transacción anterior se
+    # revirtió, Django descartó su callback y aquí se vuelve a registrar.
+    conexion = transaction.get_connection()
+    if not any(entrada[1] is ejecutar_recalculos for entrada in conexion.run_on_commit):
+        transaction.on_commit(ejecutar_recalculos)
+
+
+@contextmanager
+def recalculo_diferido():
+    """
+    Junta los recálculos de todo el bloque y los ejecuta una sola vez al
+    salir de él (o al confirmar la transacción que lo contiene).
+    """
+    _pendientes()
+    _estado.diferido += 1
+    try:
+        yield
+    finally:
+        _estado.diferido -= 1
+    if not _estado.diferido:
+        transaction.on_commit(ejecutar_recalculos)
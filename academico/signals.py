@@ -1,17 +1,200 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import m2m_changed, pre_save, post_save, post_delete
+from django.db import transaction
 from django.dispatch import receiver
-from .models import Pago
+from users.models import Estudiante, PadreDeFamilia
+from .models import Actividad, AsistenciaClase, Cargo, Clase, Curso, Entrega, Grado, Pago, PeriodoAcademico
+from .finanzas import invalidar_antiguedad
+from .recalculo import programar_recalculo
+from .horarios import invalidar_cache, invalidar_horario
+from .inscripciones import GradoClase, pares_de_plantilla, sincronizar_inscripciones
+from .asistencia import actualizar_resumenes
+from .calificaciones import actualizar_resumen_calificaciones
+
+@receiver(pre_save, sender=Pago)
+def recordar_pago_anterior(sender, instance, **kwargs):
+    """
+    Si el pago ya existía, guarda su cargo y monto anteriores para
+    poder revertirlos en post_save.
+    """
+    instance._pago_anterior = None
+    if instance.pk:
+        instance._pago_anterior = Pago.objects.filter(pk=instance.pk).values_list('cargo_id', 'monto').first()
 
 @receiver(post_save, sender=Pago)
 def actualizar_estado_cargo_on_save(sender, instance, **kwargs):
     """
-    Cuando un pago es guardado, actualiza el estado del cargo asociado.
+    Cuando un pago es guardado, ajusta el saldo del cargo asociado con un
+    incremento atómico y deja su estado en la cola de recálculo.
     """
-    instance.cargo.actualizar_estado()
+    anterior = getattr(instance, '_pago_anterior', None)
+    if anterior:
+        cargo_anterior_id, monto_anterior = anterior
+        if cargo_anterior_id == instance.cargo_id and monto_anterior == instance.monto:
+            return
+        Cargo.aplicar_pago(cargo_anterior_id, -monto_anterior)
+        programar_recalculo(cargo_anterior_id)
+    Cargo.aplicar_pago(instance.cargo_id, instance.monto)
+    programar_recalculo(instance.cargo_id)
 
 @receiver(post_delete, sender=Pago)
 def actualizar_estado_cargo_on_delete(sender, instance, **kwargs):
     """
-    Cuando un pago es eliminado, actualiza el estado del cargo asociado.
+    Cuando un pago es eliminado, descuenta su monto del cargo asociado.
+    """
+    Cargo.aplicar_pago(instance.cargo_id, -instance.monto)
+    programar_recalculo(instance.cargo_id)
+
+@receiver(post_save, sender=Cargo)
+@receiver(post_delete, sender=Cargo)
+def invalidar_antiguedad_on_cargo(sender, instance, **kwargs):
+    """
+    Crear, editar o borrar un cargo invalida la antigüedad de su periodo y grado.
+    (Los pagos la invalidan desde la cola de recálculo.)
+    """
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= {'estado'}:
+        return  # El estado no cambia los tramos de antigüedad
+    grado_id = instance.estudiante.grado_id
+    invalidar_antiguedad([(instance.periodo_id, grado_id)])
+
+@receiver(post_save, sender=Clase)
+@receiver(post_delete, sender=Clase)
+@receiver(post_save, sender=Curso)
+@receiver(post_delete, sender=Curso)
+@receiver(post_save, sender=PeriodoAcademico)
+@receiver(post_delete, sender=PeriodoAcademico)
+def invalidar_horario_on_cambio(sender, instance, **kwargs):
+    """
+    Cualquier cambio en clases, cursos o periodos invalida el horario en caché.
+    Se hace al confirmar la transacción para no cachear datos sin confirmar.
+    """
+    transaction.on_commit(invalidar_horario)
+
+@receiver(m2m_changed, sender=Grado.clases.through)
+def sincronizar_inscripciones_on_plantilla(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Al agregar clases a la plantilla de un grado, inscribe a sus
+    estudiantes; al quitarlas, da de baja solo a esos estudiantes de esas
+    clases (las inscripciones manuales no se tocan).
+    """
+    if action == 'pre_clear':
+        # Después del clear ya no se sabe qué tenía la plantilla
+        if reverse:
+            grados = instance.grados_asignados.values_list('pk', flat=True)
+            instance._inscripciones_perdidas = pares_de_plantilla(grados, [instance.pk])
+        else:
+            clases = instance.clases.values_list('pk', flat=True)
+            instance._inscripciones_perdidas = pares_de_plantilla([instance.pk], clases)
+        return
+    if action == 'post_add':
+        sincronizar_inscripciones(clases=[instance.pk] if reverse else pk_set)
+    elif action == 'post_remove':
+        if reverse:
+            perdidas = pares_de_plantilla(pk_set, [instance.pk])
+        else:
+            perdidas = pares_de_plantilla([instance.pk], pk_set)
+        sincronizar_inscripciones(clases=[], perdidas=perdidas)
+    elif action == 'post_clear':
+        sincronizar_inscripciones(clases=[], perdidas=getattr(instance, '_inscripciones_perdidas', ()))
+
+@receiver(pre_save, sender=Estudiante)
+def recordar_grado_anterior(sender, instance, **kwargs):
+    instance._grado_anterior = None
+    if instance.pk:
+        instance._grado_anterior = Estudiante.objects.filter(pk=instance.pk).values_list('grado_id', flat=True).first()
+
+@receiver(post_save, sender=Estudiante)
+def sincronizar_inscripciones_on_estudiante(sender, instance, created, **kwargs):
+    """
+    Un estudiante nuevo, o que cambia de grado, queda inscrito en las clases
+    de la plantilla de su grado (y fuera de las del grado anterior).
     """
-    instance.cargo.actualizar_estado()
\ No newline at end of file
+    anterior = getattr(instance, '_grado_anterior', None)
+    if created or anterior != instance.grado_id:
+        perdidas = ()
+        if anterior:
+            clases = GradoClase.objects.filter(grado_id=anterior).values_list('clase_id', flat=True)
+            perdidas = {(clase_id, instance.pk) for clase_id in clases}
+        sincronizar_inscripciones(estudiantes=[instance.pk], perdidas=perdidas)
+
+@receiver(post_save, sender=Estudiante)
+def invalidar_antiguedad_on_estudiante(sender, instance, created, **kwargs):
+    """
+    Los saldos de un estudiante cuentan en la antigüedad de su grado: al
+    cambiar de grado se invalidan la del grado anterior y la del nuevo, en
+    cada periodo en que tiene cargos.
+    """
+    anterior = getattr(instance, '_grado_anterior', None)
+    if created or anterior == instance.grado_id:
+        return
+    periodos = set(Cargo.objects.filter(estudiante=instance).values_list('periodo_id', flat=True))
+    invalidar_antiguedad({(periodo_id, grado_id) for periodo_id in periodos for grado_id in (anterior, instance.grado_id)})
+
+@receiver(post_save, sender=Actividad)
+@receiver(post_delete, sender=Actividad)
+@receiver(m2m_changed, sender=Clase.estudiantes.through)
+@receiver(m2m_changed, sender=PadreDeFamilia.hijos.through)
+def invalidar_calendarios(sender, **kwargs):
+    """
+    Las actividades, las inscripciones y los hijos de cada padre cambian lo
+    que muestran los calendarios .ics (ver portal.calendario).
+    """
+    if kwargs.get('action', 'post_').startswith('post_'):
+        transaction.on_commit(lambda: invalidar_cache('calendario'))
+
+@receiver(pre_save, sender=AsistenciaClase)
+def recordar_asistencia_anterior(sender, instance, **kwargs):
+    """Guarda el registro anterior para ajustar los resúmenes en post_save."""
+    instance._asistencia_anterior = None
+    if instance.pk:
+        instance._asistencia_anterior = AsistenciaClase.objects.filter(pk=instance.pk).values_list(
+            'estudiante_id', 'clase_id', 'fecha', 'estado',
+        ).first()
+
+@receiver(post_save, sender=AsistenciaClase)
+def resumir_asistencia_guardada(sender, instance, **kwargs):
+    """
+    Los registros guardados uno por uno (admin, shell) también ajustan
+    ResumenAsistencia; guardar_asistencias lo hace por su cuenta.
+    """
+    cambios = []
+    anterior = getattr(instance, '_asistencia_anterior', None)
+    if anterior:
+        cambios.append((*anterior, None))
+    cambios.append((instance.estudiante_id, instance.clase_id, instance.fecha, None, instance.estado))
+    actualizar_resumenes(cambios)
+
+@receiver(post_delete, sender=AsistenciaClase)
+def resumir_asistencia_borrada(sender, instance, **kwargs):
+    actualizar_resumenes([(instance.estudiante_id, instance.clase_id, instance.fecha, instance.estado, None)])
+
+@receiver(pre_save, sender=Entrega)
+def recordar_nota_anterior(sender, instance, **kwargs):
+    """Guarda la nota anterior para ajustar ResumenCalificaciones en post_save."""
+    instance._nota_anterior = None
+    if instance.pk:
+        instance._nota_anterior = Entrega.objects.filter(pk=instance.pk).values_list(
+            'estudiante_id', 'actividad__clase_id', 'calificacion',
+        ).first()
+
+@receiver(post_save, sender=Entrega)
+def resumir_nota_guardada(sender, instance, **kwargs):
+    """
+    Calificar una entrega (CalificarEntregaView, admin) ajusta la suma y la
+    cantidad de notas del resumen; guardar_calificaciones lo hace por su cuenta.
+    """
+    clase_id = Actividad.objects.filter(pk=instance.actividad_id).values_list('clase_id', flat=True).first()
+    actual = (instance.estudiante_id, clase_id, instance.calificacion)
+    anterior = getattr(instance, '_nota_anterior', None)
+    if anterior == actual:
+        return  # Sin cambio de nota (p. ej. el estudiante reenvió su archivo)
+    cambios = [(anterior[0], anterior[1], anterior[2], None)] if anterior else []
+    cambios.append((actual[0], actual[1], None, actual[2]))
+    actualizar_resumen_calificaciones(cambios)
+
+@receiver(post_delete, sender=Entrega)
+def resumir_nota_borrada(sender, instance, **kwargs):
+    if instance.calificacion is None:
+        return
+    clase_id = Actividad.objects.filter(pk=instance.actividad_id).values_list('clase_id', flat=True).first()
+    actualizar_resumen_calificaciones([(instance.estudiante_id, clase_id, instance.calificacion, None)])
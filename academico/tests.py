@@ -1,3 +1,432 @@
-from django.test import TestCase
+import datetime
+import io
+import threading
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from users.models import Estudiante, Maestro, User
+
+from .asistencia import guardar_asistencias
+from .calificaciones import guardar_calificaciones
+from .conciliacion import importar_estado_cuenta
+from .exportacion import exportar_cargos
+from .finanzas import CONCEPTO_INSCRIPCION, actualizar_antiguedad, generar_cargos, registrar_pago
+from .horarios import version_horario
+from .inscripciones import inscribir_en_clase
+from .models import (
+    Actividad, AntiguedadSaldo, Cargo, Clase, Curso, Entrega, Grado, Pago, PeriodoAcademico, ResumenCalificaciones,
+)
+
+
+def crear_periodo(nombre='2026'):
+    return PeriodoAcademico.objects.create(
+        nombre=nombre, fecha_inicio=datetime.date(2026, 1, 1), fecha_fin=datetime.date(2026, 12, 31),
+    )
+
+
+def crear_estudiante(username, grado=None):
+    usuario = User.objects.create(username=username, user_type='ESTUDIANTE')
+    return Estudiante.objects.create(
+        user=usuario, grado=grado, matricula=username, fecha_nacimiento=datetime.date(2010, 1, 1),
+        nombre_padre='Padre', contacto_emergencia='5555-5555',
+    )
+
+
+def crear_clase(periodo, codigo='MAT'):
+    usuario = User.objects.create(username=f'prof-{codigo}', user_type='MAESTRO')
+    maestro = Maestro.objects.create(
+        user=usuario, numero_empleado=codigo, especialidad='General', fecha_contratacion=datetime.date(2020, 1, 1),
+    )
+    curso = Curso.objects.create(nombre=codigo, codigo=codigo)
+    return Clase.objects.create(
+        periodo=periodo, curso=curso, maestro=maestro, dia_semana='LUN',
+        hora_inicio=datetime.time(7), hora_fin=datetime.time(8),
+    )
+
+
+class SincronizarInscripcionesTests(TestCase):
+    def setUp(self):
+        self.periodo = crear_periodo()
+        self.grado = Grado.objects.create(nombre='1A', periodo=self.periodo)
+        self.clase = crear_clase(self.periodo)
+        self.del_grado = crear_estudiante('del-grado', grado=self.grado)
+        self.manual = crear_estudiante('manual')
+        inscribir_en_clase(self.clase, [self.manual])
+
+    def inscritos(self):
+        return set(self.clase.estudiantes.values_list('pk', flat=True))
+
+    def test_agregar_clase_a_la_plantilla_respeta_inscripciones_manuales(self):
+        self.grado.clases.add(self.clase)
+        self.assertEqual(self.inscritos(), {self.manual.pk, self.del_grado.pk})
+
+    def test_quitar_clase_solo_da_de_baja_a_los_estudiantes_del_grado(self):
+        self.grado.clases.add(self.clase)
+        self.grado.clases.remove(self.clase)
+        self.assertEqual(self.inscritos(), {self.manual.pk})
+
+        self.grado.clases.add(self.clase)
+        self.clase.grados_asignados.clear()
+        self.assertEqual(self.inscritos(), {self.manual.pk})
+
+    def test_cambio_de_grado_solo_quita_las_clases_del_grado_anterior(self):
+        self.grado.clases.add(self.clase)
+        self.manual.grado = self.grado
+        self.manual.save()
+        self.del_grado.grado = Grado.objects.create(nombre='1B', periodo=self.periodo)
+        self.del_grado.save()
+        self.assertEqual(self.inscritos(), {self.manual.pk})
+
+
+class GenerarCargosTests(TestCase):
+    def test_estudiante_que_vuelve_recibe_los_cargos_del_periodo_nuevo(self):
+        anterior = Grado.objects.create(nombre='1A', periodo=crear_periodo('2025'), monto_inscripcion=100)
+        estudiante = crear_estudiante('repite', grado=anterior)
+        generar_cargos(anterior, fecha_base=datetime.date(2025, 1, 10))
+
+        estudiante.grado = Grado.objects.create(nombre='2A', periodo=crear_periodo('2026'), monto_inscripcion=120)
+        estudiante.save()
+        resumen = generar_cargos(estudiante.grado, fecha_base=datetime.date(2026, 1, 10))
+
+        self.assertEqual(resumen['cargos_creados'], 1)
+        self.assertEqual(generar_cargos(estudiante.grado)['cargos_creados'], 0)
+        self.assertEqual(estudiante.cargos.filter(concepto=CONCEPTO_INSCRIPCION).count(), 2)
+
+
+    def test_colegiaturas_fijas_a_los_meses_del_periodo(self):
+        grado = Grado.objects.create(nombre='3A', periodo=crear_periodo(), monto_colegiatura_mensual=50)
+        estudiante = crear_estudiante('mensual', grado=grado)
+
+        self.assertEqual(generar_cargos(grado, fecha_base=datetime.date(2026, 1, 10))['cargos_creados'], 12)
+        # Volver a generar en otro mes no agrega colegiaturas fuera del periodo
+        self.assertEqual(generar_cargos(grado, fecha_base=datetime.date(2026, 2, 10))['cargos_creados'], 0)
+        self.assertEqual(estudiante.cargos.count(), 12)
+        self.assertEqual(estudiante.cargos.order_by('fecha_vencimiento').last().concepto, 'Colegiatura 2026-12')
+
+    def test_quien_entra_a_medio_periodo_paga_desde_su_mes(self):
+        grado = Grado.objects.create(nombre='3B', periodo=crear_periodo(), monto_colegiatura_mensual=50)
+        estudiante = crear_estudiante('tardio', grado=grado)
+
+        generar_cargos(grado, estudiantes=[estudiante], fecha_base=datetime.date(2026, 3, 20))
+        self.assertEqual(estudiante.cargos.order_by('fecha_vencimiento').first().concepto, 'Colegiatura 2026-03')
+        self.assertEqual(estudiante.cargos.count(), 10)
+
+
+class HorarioCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_la_version_no_se_repite_si_se_vacia_la_cache(self):
+        version, _ = version_horario()
+        cache.clear()
+        self.assertNotEqual(version_horario()[0], version)
+
+    def test_etag_distinto_por_usuario(self):
+        crear_periodo()
+        etags = set()
+        for username in ('uno', 'dos'):
+            self.client.force_login(User.objects.create(username=username))
+            respuesta = self.client.get(reverse('horario'))
+            self.assertEqual(respuesta['Cache-Control'], 'private')
+            self.assertIn('Cookie', respuesta['Vary'])
+            etags.add(respuesta['ETag'])
+            # El mismo usuario revalida con el ETag que ya tiene
+            self.assertEqual(self.client.get(reverse('horario'), HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 304)
+        self.assertEqual(len(etags), 2)
+
+
+    def test_cambiar_de_periodo_o_de_sesion_no_da_304(self):
+        periodo = crear_periodo()
+        usuario = User.objects.create(username='sesion')
+        self.client.force_login(usuario)
+        etag = self.client.get(reverse('horario'))['ETag']
+
+        self.client.post(reverse('cambiar_periodo'), {'periodo_id': periodo.pk, 'next': reverse('horario')})
+        respuesta = self.client.get(reverse('horario'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+
+        etag = respuesta['ETag']
+        self.client.logout()
+        self.client.force_login(usuario)
+        self.assertEqual(self.client.get(reverse('horario'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ExportacionTests(TestCase):
+    def test_recorre_todas_las_filas_por_bloques_de_pk(self):
+        estudiante = crear_estudiante('exporta')
+        for i in range(5):
+            Cargo.objects.create(
+                estudiante=estudiante, concepto=f'Cargo {i}', monto=10, fecha_vencimiento=datetime.date(2026, 2, 1),
+            )
+        with mock.patch('academico.exportacion.TAMANO_BLOQUE', 2), self.assertNumQueries(3):
+            _, filas = exportar_cargos()
+            ids = [fila[0] for fila in filas]
+        self.assertEqual(ids, list(Cargo.objects.order_by('pk').values_list('pk', flat=True)))
+
+
+class EstadoCuentaViewTests(TestCase):
+    def test_fecha_imposible_se_ignora(self):
+        estudiante = crear_estudiante('cuenta')
+        self.client.force_login(estudiante.user)
+        respuesta = self.client.get(reverse('estado_cuenta', args=[estudiante.pk]), {'desde': '2024-13-45'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIsNone(respuesta.context['desde'])
+
+
+class RegistrarPagoTests(TestCase):
+    def test_reenvio_que_espero_el_bloqueo_devuelve_el_pago_existente(self):
+        cargo = Cargo.objects.create(
+            estudiante=crear_estudiante('reenvio'), concepto='Colegiatura', monto=100,
+            fecha_vencimiento=datetime.date(2026, 2, 1),
+        )
+        pago, creado = registrar_pago(cargo.pk, Decimal('100'), Pago.MetodoPago.EFECTIVO, clave_idempotencia='recibo-1')
+        self.assertTrue(creado)
+
+        filtrar = Pago.objects.filter
+        consultas = []
+
+        def primero_no_lo_ve(*args, **kwargs):
+            # La primera consulta corre antes de que el otro envío confirme
+            consultas.append(kwargs)
+            return Pago.objects.none() if len(consultas) == 1 else filtrar(*args, **kwargs)
+
+        with mock.patch.object(Pago.objects, 'filter', side_effect=primero_no_lo_ve):
+            resultado = registrar_pago(cargo.pk, Decimal('100'), Pago.MetodoPago.EFECTIVO, clave_idempotencia='recibo-1')
+
+        self.assertEqual(resultado, (pago, False))
+        cargo.refresh_from_db()
+        self.assertEqual((cargo.monto_pagado, cargo.saldo), (Decimal('100'), Decimal('0')))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class RegistrarPagoConcurrenteTests(TransactionTestCase):
+    """Varios cajeros pagando el mismo cargo a la vez, cada uno en su hilo y conexión."""
+
+    def setUp(self):
+        self.cargo = Cargo.objects.create(
+            estudiante=crear_estudiante('concurrente'), concepto='Colegiatura', monto=100,
+            fecha_vencimiento=datetime.date(2026, 2, 1),
+        )
+
+    def pagar_en_hilos(self, pagos):
+        barrera = threading.Barrier(len(pagos))
+        resultados = [None] * len(pagos)
+
+        def pagar(i, monto, clave):
+            try:
+                barrera.wait()
+                resultados[i] = registrar_pago(self.cargo.pk, monto, Pago.MetodoPago.EFECTIVO, clave_idempotencia=clave)
+            except Exception as error:
+                resultados[i] = error
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=pagar, args=(i, *pago)) for i, pago in enumerate(pagos)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual([r for r in resultados if isinstance(r, Exception) and not isinstance(r, ValidationError)], [])
+        self.cargo.refresh_from_db()
+        return resultados
+
+    def test_cada_clave_de_idempotencia_se_aplica_una_sola_vez(self):
+        # Cinco claves, cada una enviada por dos cajeros
+        resultados = self.pagar_en_hilos([(Decimal('10'), f'recibo-{i // 2}') for i in range(10)])
+
+        self.assertEqual(sum(creado for _, creado in resultados), 5)
+        self.assertEqual(Pago.objects.filter(cargo=self.cargo).count(), 5)
+        self.assertEqual(self.cargo.monto_pagado, Decimal('50'))
+        self.assertEqual(self.cargo.saldo, Decimal('50'))
+
+    def test_reenvio_del_saldo_completo_devuelve_el_mismo_pago(self):
+        # El formulario propone el saldo: el doble envío es por el total
+        resultados = self.pagar_en_hilos([(Decimal('100'), 'recibo-total') for _ in range(4)])
+
+        self.assertEqual([isinstance(resultado, ValidationError) for resultado in resultados], [False] * 4)
+        self.assertEqual(sum(creado for _, creado in resultados), 1)
+        self.assertEqual({pago.pk for pago, _ in resultados}, set(Pago.objects.filter(cargo=self.cargo).values_list('pk', flat=True)))
+        self.assertEqual((self.cargo.monto_pagado, self.cargo.saldo), (Decimal('100'), Decimal('0')))
+
+    def test_pagos_simultaneos_nunca_sobrepagan(self):
+        resultados = self.pagar_en_hilos([(Decimal('30'), None) for _ in range(6)])
+
+        self.assertEqual(sum(isinstance(resultado, ValidationError) for resultado in resultados), 3)
+        self.assertEqual(self.cargo.monto_pagado, Decimal('90'))
+        self.assertEqual(self.cargo.saldo, Decimal('10'))
+
+
+class GuardarAsistenciasTests(TestCase):
+    FECHA = datetime.date(2026, 3, 2)
+
+    def clase_con_estudiantes(self, cantidad):
+        clase = crear_clase(crear_periodo(f'P{cantidad}'), codigo=f'C{cantidad}')
+        clase.estudiantes.add(*[crear_estudiante(f'c{cantidad}-{i}') for i in range(cantidad)])
+        return clase, list(clase.estudiantes.values_list('pk', flat=True))
+
+    def hojas(self, ids):
+        # Hoja nueva, y luego la misma hoja con dos ausencias
+        return [dict(zip(ids, ['P'] * len(ids))), dict(zip(ids, ['A', 'A'] + ['P'] * (len(ids) - 2)))]
+
+    def test_las_consultas_no_dependen_del_numero_de_estudiantes(self):
+        clase, ids = self.clase_con_estudiantes(5)
+        consultas = []
+        for estados in self.hojas(ids):
+            with CaptureQueriesContext(connection) as capturadas:
+                guardar_asistencias(clase, self.FECHA, estados)
+            consultas.append(len(capturadas))
+
+        clase, ids = self.clase_con_estudiantes(50)
+        for esperadas, estados in zip(consultas, self.hojas(ids)):
+            with self.assertNumQueries(esperadas):
+                guardar_asistencias(clase, self.FECHA, estados)
+
+
+class GuardarCalificacionesTests(TestCase):
+    def setUp(self):
+        self.clase = crear_clase(crear_periodo())
+        self.estudiante = crear_estudiante('calificado')
+        self.clase.estudiantes.add(self.estudiante)
+        self.actividad = Actividad.objects.create(
+            clase=self.clase, titulo='Tarea 1', fecha_entrega=timezone.now(),
+        )
+
+    def test_la_nota_sin_entrega_no_cuenta_como_entregada(self):
+        guardar_calificaciones(self.clase, {(self.estudiante.pk, self.actividad.pk): Decimal('80')})
+        entrega = Entrega.objects.get(estudiante=self.estudiante, actividad=self.actividad)
+        self.assertTrue(entrega.solo_calificacion)
+        self.assertEqual(entrega.calificacion, Decimal('80'))
+
+    def test_entrega_del_estudiante_durante_el_guardado(self):
+        bulk_create = Entrega.objects.bulk_create
+
+        def entrega_antes(objetos, **kwargs):
+            # El estudiante entrega justo después de que se leyeron las entregas
+            Entrega.objects.create(estudiante=self.estudiante, actividad=self.actividad, comentarios='Mi tarea')
+            return bulk_create(objetos, **kwargs)
+
+        with mock.patch.object(Entrega.objects, 'bulk_create', side_effect=entrega_antes):
+            guardadas = guardar_calificaciones(self.clase, {(self.estudiante.pk, self.actividad.pk): Decimal('90')})
+
+        entrega = Entrega.objects.get(estudiante=self.estudiante, actividad=self.actividad)
+        self.assertEqual(guardadas, 1)
+        self.assertFalse(entrega.solo_calificacion)
+        self.assertEqual((entrega.comentarios, entrega.calificacion), ('Mi tarea', Decimal('90')))
+        resumen = ResumenCalificaciones.objects.get(estudiante=self.estudiante, clase=self.clase)
+        self.assertEqual((resumen.suma, resumen.cantidad), (Decimal('90'), 1))
+
+
+class ImportarEstadoCuentaTests(TestCase):
+    def setUp(self):
+        self.estudiante = crear_estudiante('banco')
+        self.cargo = Cargo.objects.create(
+            estudiante=self.estudiante, concepto='Colegiatura', monto=100, fecha_vencimiento=datetime.date(2026, 2, 1),
+        )
+
+    def importar(self, *filas):
+        archivo = io.StringIO('matricula,referencia,monto\n' + ''.join(f'{fila}\n' for fila in filas))
+        return importar_estado_cuenta(archivo)
+
+    def test_fila_sin_referencia_queda_como_excepcion(self):
+        conciliacion = self.importar('banco,,40')
+        self.assertEqual(conciliacion.pagos_creados, 0)
+        self.assertEqual(conciliacion.excepciones.count(), 1)
+
+    def test_reimportar_no_sobrepaga(self):
+        self.importar('banco,TRX-1,60')
+        registrar_pago(self.cargo.pk, Decimal('30'), Pago.MetodoPago.EFECTIVO)
+        conciliacion = self.importar('banco,TRX-1,60', 'banco,TRX-2,20')
+
+        self.assertEqual(conciliacion.pagos_creados, 0)
+        self.assertEqual(conciliacion.excepciones.count(), 2)
+        self.cargo.refresh_from_db()
+        self.assertEqual((self.cargo.monto_pagado, self.cargo.saldo), (Decimal('90'), Decimal('10')))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ImportarEstadoCuentaConcurrenteTests(TransactionTestCase):
+    def test_importacion_y_cajero_a_la_vez_no_sobrepagan(self):
+        cargo = Cargo.objects.create(
+            estudiante=crear_estudiante('banco-caja'), concepto='Colegiatura', monto=100,
+            fecha_vencimiento=datetime.date(2026, 2, 1),
+        )
+        barrera = threading.Barrier(2)
+        errores = []
+
+        def en_hilo(funcion):
+            def correr():
+                try:
+                    barrera.wait()
+                    funcion()
+                except ValidationError:
+                    pass
+                except Exception as error:
+                    errores.append(error)
+                finally:
+                    connection.close()
+            return threading.Thread(target=correr)
+
+        hilos = [
+            en_hilo(lambda: importar_estado_cuenta(io.StringIO('matricula,referencia,monto\nbanco-caja,TRX-1,100\n'))),
+            en_hilo(lambda: registrar_pago(cargo.pk, Decimal('100'), Pago.MetodoPago.EFECTIVO)),
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        cargo.refresh_from_db()
+        self.assertEqual((cargo.monto_pagado, cargo.saldo), (Decimal('100'), Decimal('0')))
+
+
+class CargoTests(TransactionTestCase):
+    # Sin transacción de prueba alrededor: el recálculo al confirmar corre en cada save
+    def test_bajar_el_monto_hasta_lo_pagado_marca_el_cargo_pagado(self):
+        cargo = Cargo.objects.create(
+            estudiante=crear_estudiante('ajuste'), concepto='Colegiatura', monto=100,
+            fecha_vencimiento=datetime.date(2099, 2, 1),
+        )
+        registrar_pago(cargo.pk, Decimal('60'), Pago.MetodoPago.EFECTIVO)
+
+        for guardar in (lambda: cargo.save(update_fields=['monto']), cargo.save):
+            cargo.refresh_from_db()
+            cargo.monto = Decimal('60')
+            guardar()
+            cargo.refresh_from_db()
+            self.assertEqual((cargo.saldo, cargo.estado), (Decimal('0'), Cargo.EstadoCargo.PAGADO))
+
+            # Se vuelve a abrir para probar el guardado completo
+            cargo.monto = Decimal('100')
+            cargo.save(update_fields=['monto'])
+            cargo.refresh_from_db()
+            self.assertEqual((cargo.saldo, cargo.estado), (Decimal('40'), Cargo.EstadoCargo.PENDIENTE))
+
+
+class AntiguedadSaldoTests(TestCase):
+    def test_cambio_de_grado_invalida_el_grado_anterior_y_el_nuevo(self):
+        periodo = crear_periodo()
+        anterior = Grado.objects.create(nombre='4A', periodo=periodo)
+        nuevo = Grado.objects.create(nombre='4B', periodo=periodo)
+        estudiante = crear_estudiante('cambia', grado=anterior)
+        Cargo.objects.create(
+            estudiante=estudiante, periodo=periodo, concepto='Colegiatura', monto=100,
+            fecha_vencimiento=datetime.date(2026, 2, 1),
+        )
+        actualizar_antiguedad()
+        self.assertFalse(AntiguedadSaldo.objects.filter(vigente=False).exists())
+
+        estudiante.grado = nuevo
+        estudiante.save()
+        self.assertEqual(
+            set(AntiguedadSaldo.objects.filter(vigente=False).values_list('periodo_id', 'grado_id')),
+            {(periodo.pk, anterior.pk), (periodo.pk, nuevo.pk)},
+        )
@@ -28,5 +28,10 @@ urlpatterns = [
     path('cargos/nuevo/', views.CargoCreateView.as_view(), name='cargo_create'),
     path('cargos/<int:pk>/editar/', views.CargoUpdateView.as_view(), name='cargo_update'),
     path('cargo/<int:cargo_pk>/registrar-pago/', views.RegistrarPagoView.as_view(), name='registrar_pago'),
+    path('conciliacion/importar/', views.ImportarEstadoCuentaView.as_view(), name='conciliacion_importar'),
+    path('conciliacion/<int:pk>/', views.ConciliacionDetailView.as_view(), name='conciliacion_detail'),
+    path('estudiantes/<int:pk>/estado-cuenta/', views.EstadoCuentaView.as_view(), name='estado_cuenta'),
+    path('estudiantes/<int:pk>/estado-cuenta/pdf/', views.EstadoCuentaPDFView.as_view(), name='estado_cuenta_pdf'),
+    path('exportar/<slug:recurso>.<slug:formato>', views.ExportarView.as_view(), name='exportar'),
     path('clase/<int:clase_pk>/reporte-ia/', views.DescargarReporteIAView.as_view(), name='descargar_reporte_ia'),
 ]
\ No newline at end of file
@@ -1,15 +1,32 @@
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView, FormView, DetailView, TemplateView
 from django.urls import reverse_lazy
-from .forms import CursoForm, AsignarCursosForm, ClaseForm, PeriodoAcademicoForm, InscribirEstudiantesForm, BitacoraForm, PagoForm, CargoForm
+from .forms import CursoForm, AsignarCursosForm, ClaseForm, PeriodoAcademicoForm, InscribirEstudiantesForm, BitacoraForm, PagoForm, CargoForm, EstadoCuentaBancoForm
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
-from .models import PeriodoAcademico, Clase, Curso, BitacoraPedagogica, Pago, Cargo
+from .models import PeriodoAcademico, Clase, Curso, BitacoraPedagogica, Pago, Cargo, Grado, ConciliacionBancaria
+from .conciliacion import importar_estado_cuenta
+from .exportacion import EXPORTACIONES, FORMATOS
+from .finanzas import estado_de_cuenta, registrar_pago
+from .inscripciones import inscribir_en_clase
+from .horarios import HORAS_VISIBLES, obtener_grid, obtener_periodos, version_horario
+from django.middleware.csrf import get_token
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.cache import cache_control
+from django.views.decorators.vary import vary_on_cookie
+from django.core.exceptions import ValidationError
+import io
+import hashlib
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 import datetime
-from users.models import Maestro, User
+from urllib.parse import urlencode
+from django.db import IntegrityError
+from django.db.models import Q
+from users.models import Estudiante, Maestro, User
+from django.utils.dateparse import parse_date
 from .models import Planificacion
 import requests
-from django.http import JsonResponse, HttpResponseServerError, HttpResponse
+from django.http import JsonResponse, HttpResponseServerError, HttpResponse, StreamingHttpResponse, Http404
 from django.template.loader import render_to_string # 👈 Importa esto
 from weasyprint import HTML # 👈 Importa WeasyPrint
 
@@ -38,37 +55,46 @@ class CursoDeleteView(DeleteView):
     template_name = 'academico/curso_confirm_delete.html'
     success_url = reverse_lazy('gestion_cursos') # Redirige a la lista tras borrar
 
+def _periodo_horario(periodo_id, periodos):
+    """El periodo a mostrar (por defecto, el primero), tomado de la lista en caché."""
+    if periodo_id is None:
+        return periodos[0] if periodos else None
+    for periodo in periodos:
+        if periodo['pk'] == periodo_id:
+            return periodo
+    raise Http404("No existe ese periodo.")
+
+def _etag_horario(request, periodo_id=None):
+    # La página lleva el menú del usuario, el periodo elegido en su sesión y
+    # su token CSRF: un cambio de periodo o un nuevo login no deben dar 304
+    version, modificado = version_horario()
+    get_token(request)  # el mismo secreto CSRF que llevará la página
+    sesion = hashlib.sha256(f"{request.session.session_key}:{request.META['CSRF_COOKIE']}".encode()).hexdigest()[:16]
+    return (
+        f"horario-{periodo_id or 'actual'}-v{version}-{modificado:%Y%m%d%H%M%S}-u{request.user.pk or 0}"
+        f"-p{request.session.get('periodo_seleccionado_id') or 0}-s{sesion}"
+    )
+
 class HorarioView(View):
+    """
+    Horario del periodo en cuadrícula (hora x día). La cuadrícula sale de la
+    caché (ver academico.horarios) y la respuesta admite GET condicional por
+    ETag. No se envía Last-Modified: una fecha no refleja la sesión.
+    """
+    @method_decorator(cache_control(private=True))
+    @method_decorator(vary_on_cookie)
+    @method_decorator(condition(etag_func=_etag_horario))
     def get(self, request, periodo_id=None):
-        if periodo_id:
-            periodo_actual = get_object_or_404(PeriodoAcademico, id=periodo_id)
-        else:
-            # Por defecto, toma el primer periodo que encuentre o crea uno si no existe
-            periodo_actual = PeriodoAcademico.objects.first()
-
-        dias_semana = Clase.DiaSemana.choices
-        # Generar franjas horarias (ej. de 7am a 5pm)
-        horas = list(range(7, 18))
-        # Obtener todas las clases del periodo actual para pintarlas en la tabla
-        clases = Clase.objects.filter(periodo=periodo_actual).select_related('curso', 'maestro__user').order_by('hora_inicio')
-
-        horario_grid = {hora: {dia[0]: [] for dia in dias_semana} for hora in horas}
-        for clase in clases:
-            # Obtenemos la hora como entero (ej. 8:30 -> 8)
-            hora_int = clase.hora_inicio.hour
-            dia_str = clase.dia_semana
-            
-            # Verificamos si la hora está en nuestro rango visible (7am-5pm)
-            if hora_int in horario_grid:
-                # Añadimos la clase a la lista de esa celda
-                horario_grid[hora_int][dia_str].append(clase)
+        version, _ = version_horario()
+        periodos = obtener_periodos(version)
+        periodo_actual = _periodo_horario(periodo_id, periodos)
 
         context = {
-            'periodos': PeriodoAcademico.objects.all(),
+            'periodos': periodos,
             'periodo_actual': periodo_actual,
-            'horario_grid': horario_grid,
-            'horas': horas,
-            'dias_semana': dias_semana
+            'horario_grid': obtener_grid(periodo_actual['pk'], version) if periodo_actual else {},
+            'horas': HORAS_VISIBLES,
+            'dias_semana': Clase.DiaSemana.choices,
         }
         return render(request, 'academico/horario.html', context)
 
@@ -164,8 +190,8 @@ def inscribir_estudiantes_clase(request, pk):
         form = InscribirEstudiantesForm(request.POST)
         if form.is_valid():
             estudiantes_seleccionados = form.cleaned_data['estudiantes']
-            # .set() actualiza la relación: añade los nuevos y quita los desmarcados
-            clase.estudiantes.set(estudiantes_seleccionados)
+            # Añade los nuevos y quita los desmarcados con un solo INSERT y un solo DELETE
+            inscribir_en_clase(clase, estudiantes_seleccionados)
             # Redirigimos de vuelta al horario principal
             return redirect('horario')
     else:
@@ -262,15 +288,86 @@ class BitacoraDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     
 class CargoListView(ListView):
     """
-    (R)ead: Muestra la lista de todos los cargos.
+    (R)ead: Muestra la lista de cargos, filtrable y paginada por cursor.
+
+    La paginación usa (fecha_emision, id) como cursor en lugar de OFFSET,
+    así que cualquier página cuesta lo mismo sin importar qué tan lejos esté.
     """
     model = Cargo
     template_name = 'academico/cargo_list.html'
     context_object_name = 'cargos'
-    
+    tamano_pagina = 50
+
+    def _leer_cursor(self, nombre):
+        """Convierte un cursor 'AAAA-MM-DD_id' de la URL en (fecha, id)."""
+        valor = self.request.GET.get(nombre)
+        if not valor:
+            return None
+        try:
+            fecha_str, pk_str = valor.split('_')
+            return datetime.date.fromisoformat(fecha_str), int(pk_str)
+        except ValueError:
+            return None
+
     def get_queryset(self):
-        # Muestra los cargos más recientes primero
-        return Cargo.objects.all().select_related('estudiante__user').order_by('-fecha_emision')
+        queryset = Cargo.objects.select_related('estudiante__user', 'periodo')
+
+        # 1. Filtros (estado, periodo, grado y búsqueda por estudiante)
+        self.filtros = {
+            'estado': self.request.GET.get('estado', ''),
+            'periodo': self.request.GET.get('periodo', ''),
+            'grado': self.request.GET.get('grado', ''),
+            'q': self.request.GET.get('q', '').strip(),
+        }
+        if self.filtros['estado']:
+            queryset = queryset.filter(estado=self.filtros['estado'])
+        if self.filtros['periodo'].isdigit():
+            queryset = queryset.filter(periodo_id=self.filtros['periodo'])
+        if self.filtros['grado'].isdigit():
+            queryset = queryset.filter(estudiante__grado_id=self.filtros['grado'])
+        if self.filtros['q']:
+            queryset = queryset.filter(
+                Q(estudiante__user__first_name__icontains=self.filtros['q']) |
+                Q(estudiante__user__last_name__icontains=self.filtros['q']) |
+                Q(estudiante__matricula__icontains=self.filtros['q'])
+            )
+
+        # 2. Paginación por cursor: los más recientes primero
+        # (monto_pagado y saldo son columnas del cargo, no cuestan consultas extra)
+        antes = self._leer_cursor('antes')
+        despues = self._leer_cursor('despues')
+        if antes:
+            fecha, pk = antes
+            cargos = list(queryset.filter(
+                Q(fecha_emision__gt=fecha) | Q(fecha_emision=fecha, pk__gt=pk)
+            ).order_by('fecha_emision', 'pk')[:self.tamano_pagina + 1])
+            self.hay_anterior = len(cargos) > self.tamano_pagina
+            self.hay_siguiente = True
+            cargos = cargos[:self.tamano_pagina][::-1]
+        else:
+            if despues:
+                fecha, pk = despues
+                queryset = queryset.filter(Q(fecha_emision__lt=fecha) | Q(fecha_emision=fecha, pk__lt=pk))
+            cargos = list(queryset.order_by('-fecha_emision', '-pk')[:self.tamano_pagina + 1])
+            self.hay_siguiente = len(cargos) > self.tamano_pagina
+            self.hay_anterior = despues is not None
+            cargos = cargos[:self.tamano_pagina]
+        return cargos
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        cargos = context['cargos']
+
+        context['filtros'] = self.filtros
+        context['filtros_qs'] = urlencode({k: v for k, v in self.filtros.items() if v})
+        context['estados'] = Cargo.EstadoCargo.choices
+        context['periodos'] = PeriodoAcademico.objects.order_by('-fecha_inicio')
+        context['grados'] = Grado.objects.select_related('periodo')
+        if cargos and self.hay_anterior:
+            context['cursor_anterior'] = f"{cargos[0].fecha_emision.isoformat()}_{cargos[0].pk}"
+        if cargos and self.hay_siguiente:
+            context['cursor_siguiente'] = f"{cargos[-1].fecha_emision.isoformat()}_{cargos[-1].pk}"
+        return context
 
 class CargoCreateView(CreateView):
     """
@@ -325,21 +422,134 @@ class RegistrarPagoView(CreateView):
 
     def form_valid(self, form):
         """
-        Asigna el cargo y el estudiante al pago antes de guardarlo.
+        Registra el pago con el cargo bloqueado (ver finanzas.registrar_pago):
+        si el monto excede el saldo se muestra el error en el formulario, y si
+        el formulario se reenvía no se duplica el pago.
         """
-        cargo = get_object_or_404(Cargo, pk=self.kwargs['cargo_pk'])
-        
-        # Asignamos las claves foráneas que faltan
-        form.instance.cargo = cargo
-        form.instance.estudiante = cargo.estudiante
-        
-        # Guardamos el pago
-        response = super().form_valid(form)
-        
-        # ¡IMPORTANTE!
-        # La señal (signal) que creamos se disparará automáticamente aquí,
-        # llamará a cargo.actualizar_estado() y marcará el cargo como "Pagado".
-        
+        try:
+            self.object, _ = registrar_pago(
+                self.kwargs['cargo_pk'],
+                form.cleaned_data['monto'],
+                form.cleaned_data['metodo_pago'],
+                referencia=form.cleaned_data.get('referencia'),
+                clave_idempotencia=form.cleaned_data.get('clave_idempotencia'),
+            )
+        except ValidationError as e:
+            form.add_error('monto', e)
+            return self.form_invalid(form)
+
+        # La señal (signal) de Pago descuenta el saldo del cargo y, al
+        # confirmar la transacción, recalcula su estado (ver academico.recalculo).
+        return redirect(self.get_success_url())
+
+class PersonalAdministrativoMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """
+    Restringe la vista al personal administrativo (admins o staff).
+    """
+    def test_func(self):
+        return self.request.user.is_staff or self.request.user.user_type == User.UserType.ADMIN
+
+class ImportarEstadoCuentaView(PersonalAdministrativoMixin, FormView):
+    """
+    Sube un estado de cuenta bancario y lo concilia contra los cargos.
+    """
+    form_class = EstadoCuentaBancoForm
+    template_name = 'academico/conciliacion_form.html'
+
+    def form_valid(self, form):
+        archivo = form.cleaned_data['archivo']
+        # Se lee como texto en streaming, sin cargar el archivo completo
+        texto = io.TextIOWrapper(archivo.file, encoding='utf-8-sig', newline='')
+        try:
+            self.conciliacion = importar_estado_cuenta(texto, nombre=archivo.name, usuario=self.request.user)
+        except IntegrityError:
+            # Otra importación registró las mismas referencias al mismo tiempo
+            form.add_error('archivo', "Algunas referencias del archivo se registraron mientras se importaba. Vuelva a intentarlo.")
+            return self.form_invalid(form)
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse_lazy('conciliacion_detail', kwargs={'pk': self.conciliacion.pk})
+
+class ConciliacionDetailView(PersonalAdministrativoMixin, DetailView):
+    """
+    Muestra el resultado de una conciliación y las filas que quedaron sin aplicar.
+    """
+    model = ConciliacionBancaria
+    template_name = 'academico/conciliacion_detail.html'
+    context_object_name = 'conciliacion'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['excepciones'] = self.object.excepciones.all()
+        return context
+
+class ExportarView(PersonalAdministrativoMixin, View):
+    """
+    Descarga cargos, pagos, calificaciones o asistencias como CSV o XLSX.
+    La respuesta se envía en streaming, con memoria constante.
+    """
+    def get(self, request, recurso, formato):
+        if recurso not in EXPORTACIONES or formato not in FORMATOS:
+            raise Http404("Exportación no disponible.")
+
+        periodo_id = request.GET.get('periodo')
+        encabezados, filas = EXPORTACIONES[recurso](periodo_id if periodo_id and periodo_id.isdigit() else None)
+        generar, content_type = FORMATOS[formato]
+
+        response = StreamingHttpResponse(generar(encabezados, filas), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{recurso}_{datetime.date.today():%Y%m%d}.{formato}"'
+        return response
+
+def _fecha_del_filtro(valor):
+    """La fecha AAAA-MM-DD de un filtro, o None si viene vacía o no existe (2024-13-45)."""
+    try:
+        return parse_date(valor or '')
+    except ValueError:
+        return None
+
+class EstadoCuentaView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    """
+    Estado de cuenta de un estudiante: cargos y pagos con saldo acumulado.
+    Lo pueden ver el personal administrativo, el estudiante y sus padres.
+    Acepta ?desde=AAAA-MM-DD y ?hasta=AAAA-MM-DD.
+    """
+    template_name = 'academico/estado_cuenta.html'
+
+    def test_func(self):
+        self.estudiante = get_object_or_404(Estudiante.objects.select_related('user', 'grado'), pk=self.kwargs['pk'])
+        user = self.request.user
+        if user.is_staff or user.user_type == User.UserType.ADMIN:
+            return True
+        if user.user_type == User.UserType.ESTUDIANTE:
+            return user.pk == self.estudiante.pk
+        if user.user_type == User.UserType.PADRE:
+            return self.estudiante.padres.filter(pk=user.pk).exists()
+        return False
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        desde = _fecha_del_filtro(self.request.GET.get('desde'))
+        hasta = _fecha_del_filtro(self.request.GET.get('hasta'))
+        context['estudiante'] = self.estudiante
+        context['desde'] = desde
+        context['hasta'] = hasta
+        context['filtros_qs'] = urlencode({k: v for k, v in (('desde', desde), ('hasta', hasta)) if v})
+        context['fecha_generacion'] = datetime.date.today()
+        context.update(estado_de_cuenta(self.estudiante, desde, hasta))
+        return context
+
+class EstadoCuentaPDFView(EstadoCuentaView):
+    """
+    El mismo estado de cuenta, como PDF descargable.
+    """
+    template_name = 'academico/estado_cuenta_pdf.html'
+
+    def get(self, request, *args, **kwargs):
+        html_string = render_to_string(self.template_name, self.get_context_data(**kwargs), request=request)
+        pdf_file = HTML(string=html_string).write_pdf()
+        response = HttpResponse(pdf_file, content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="estado_cuenta_{self.estudiante.matricula}.pdf"'
         return response
 
 class DescargarReporteIAView(LoginRequiredMixin, UserPassesTestMixin, View):
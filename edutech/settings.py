@@ -112,6 +112,18 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Con varios procesos (gunicorn, etc.) use un backend compartido (Redis,
+# Memcached o base de datos) para que la invalidación llegue a todos.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='edutech'),
+    }
+}
+
 AUTH_USER_MODEL = 'users.User'
 
 # Password validation
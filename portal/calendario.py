@@ -0,0 +1,161 @@
+"""
+Calendarios iCalendar (.ics) por usuario: el horario de clases y las
+fechas de entrega de actividades, para suscribirse desde el teléfono.
+
+Cada clase es un evento semanal (RRULE) acotado por las fechas de su
+periodo. Las horas de clase se escriben "flotantes" (sin zona horaria):
+el cliente las muestra tal cual, a la hora local. Las entregas sí son un
+instante exacto y van en UTC.
+
+La URL del calendario lleva el id del usuario firmado, porque los
+clientes de calendario no envían la sesión.
+"""
+from datetime import timedelta, timezone
+
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+
+from academico.horarios import DURACION_CACHE, version_cache
+from academico.models import Actividad, Clase
+from users.models import User
+
+SAL_CALENDARIO = 'portal.calendario'
+# Grupos de caché cuyo cambio obliga a regenerar los calendarios
+GRUPOS_CACHE = ('horario', 'calendario')
+
+DIAS_ICAL = {
+    Clase.DiaSemana.LUNES: 'MO',
+    Clase.DiaSemana.MARTES: 'TU',
+    Clase.DiaSemana.MIERCOLES: 'WE',
+    Clase.DiaSemana.JUEVES: 'TH',
+    Clase.DiaSemana.VIERNES: 'FR',
+    Clase.DiaSemana.SABADO: 'SA',
+}
+INDICE_DIA = {dia: indice for indice, dia in enumerate(DIAS_ICAL)}
+
+
+def firmar_usuario(user):
+    """Token firmado para la URL del calendario de `user`."""
+    return signing.Signer(salt=SAL_CALENDARIO).sign(str(user.pk))
+
+
+def usuario_del_token(token):
+    """El id de usuario de un token válido, o None si la firma no coincide."""
+    try:
+        return int(signing.Signer(salt=SAL_CALENDARIO).unsign(token))
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def version_calendario():
+    """(versión, fecha de modificación) combinadas de los datos del calendario."""
+    versiones = [version_cache(grupo) for grupo in GRUPOS_CACHE]
+    return '.'.join(str(version) for version, _ in versiones), max(modificado for _, modificado in versiones)
+
+
+def _escapar(texto):
+    return (
+        str(texto).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def _plegar(linea):
+    """Parte las líneas de más de 75 octetos como pide RFC 5545."""
+    datos = linea.encode('utf-8')
+    if len(datos) <= 75:
+        return linea
+    partes, actual = [], ''
+    for caracter in linea:
+        limite = 75 if not partes else 74  # las continuaciones empiezan con un espacio
+        if len((actual + caracter).encode('utf-8')) > limite:
+            partes.append(actual)
+            actual = ''
+        actual += caracter
+    partes.append(actual)
+    return '\r\n '.join(partes)
+
+
+def _utc(momento):
+    return momento.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _filtro_clases(user):
+    if user.user_type == User.UserType.ESTUDIANTE:
+        return Q(estudiantes=user.pk)
+    if user.user_type == User.UserType.MAESTRO:
+        return Q(maestro=user.pk)
+    if user.user_type == User.UserType.PADRE:
+        return Q(estudiantes__padres=user.pk)
+    return None
+
+
+def generar_ics(user, modificado):
+    """El contenido .ics del calendario de `user`."""
+    lineas = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Edutech//Calendario Escolar//ES',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escapar(f"Edutech - {user.get_full_name() or user.username}")}',
+    ]
+    sello = _utc(modificado)
+
+    filtro = _filtro_clases(user)
+    if filtro is not None:
+        ids = set(Clase.objects.filter(filtro).values_list('pk', flat=True))
+        clases = Clase.objects.filter(pk__in=ids).select_related('curso', 'periodo', 'maestro__user').order_by('pk')
+        for clase in clases:
+            periodo = clase.periodo
+            dias = (INDICE_DIA[clase.dia_semana] - periodo.fecha_inicio.weekday()) % 7
+            primera = periodo.fecha_inicio + timedelta(days=dias)
+            if primera > periodo.fecha_fin:
+                continue
+            maestro = clase.maestro.user.get_full_name() if clase.maestro else ''
+            lineas += [
+                'BEGIN:VEVENT',
+                f'UID:clase-{clase.pk}@edutech',
+                f'DTSTAMP:{sello}',
+                f'SUMMARY:{_escapar(clase.curso.nombre)}',
+                f'DESCRIPTION:{_escapar(f"Maestro: {maestro}" if maestro else periodo.nombre)}',
+                f'DTSTART:{primera:%Y%m%d}T{clase.hora_inicio:%H%M%S}',
+                f'DTEND:{primera:%Y%m%d}T{clase.hora_fin:%H%M%S}',
+                f'RRULE:FREQ=WEEKLY;BYDAY={DIAS_ICAL[clase.dia_semana]};UNTIL={periodo.fecha_fin:%Y%m%d}T235959',
+                'END:VEVENT',
+            ]
+
+        actividades = Actividad.objects.filter(clase_id__in=ids).select_related('clase__curso').order_by('pk')
+        for actividad in actividades:
+            lineas += [
+                'BEGIN:VEVENT',
+                f'UID:actividad-{actividad.pk}@edutech',
+                f'DTSTAMP:{sello}',
+                f'SUMMARY:{_escapar(f"Entrega: {actividad.titulo} ({actividad.clase.curso.nombre})")}',
+                f'DESCRIPTION:{_escapar(actividad.descripcion)}',
+                f'DTSTART:{_utc(actividad.fecha_entrega)}',
+                'DURATION:PT15M',
+                'END:VEVENT',
+            ]
+
+    lineas.append('END:VCALENDAR')
+    return '\r\n'.join(_plegar(linea) for linea in lineas) + '\r\n'
+
+
+def obtener_ics(user_id, version=None, modificado=None):
+    """
+    El .ics del usuario desde la caché (una entrada por usuario y versión).
+    Devuelve None si el usuario no existe.
+    """
+    if version is None:
+        version, modificado = version_calendario()
+    clave = f'calendario:{user_id}:v{version}'
+    contenido = cache.get(clave)
+    if contenido is None:
+        user = User.objects.filter(pk=user_id).first()
+        if user is None:
+            return None
+        contenido = generar_ics(user, modificado)
+        cache.set(clave, contenido, DURACION_CACHE)
+    return contenido
@@ -1,12 +1,12 @@
 # portal/forms.py
 from django import forms
-from academico.models import Actividad, Entrega, AsistenciaClase, Competencia, Planificacion
+from academico.models import Actividad, CategoriaCalificacion, Entrega, AsistenciaClase, Competencia, Planificacion
 from .models import Noticia, Notificacion
 
 class ActividadForm(forms.ModelForm):
     class Meta:
         model = Actividad
-        fields = ['titulo', 'descripcion', 'fecha_entrega', 'recurso_adjunto']
+        fields = ['titulo', 'descripcion', 'fecha_entrega', 'categoria', 'recurso_adjunto']
         widgets = {
             'fecha_entrega': forms.DateTimeInput(attrs={'type': 'datetime-local'}, format='%Y-%m-%dT%H:%M'),
             'descripcion': forms.Textarea(attrs={'rows': 5}), # Un poco más grande
@@ -14,7 +14,15 @@ class ActividadForm(forms.ModelForm):
         }
 
     def __init__(self, *args, **kwargs):
+        clase = kwargs.pop('clase', None)
         super().__init__(*args, **kwargs)
+        # Solo las categorías del curso de la clase; sin categorías, no se pide
+        categorias = CategoriaCalificacion.objects.filter(curso=clase.curso) if clase else CategoriaCalificacion.objects.none()
+        if categorias.exists():
+            self.fields['categoria'].queryset = categorias
+            self.fields['categoria'].required = True
+        else:
+            del self.fields['categoria']
         for field_name, field in self.fields.items():
             field.widget.attrs.update({
                 'class': 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-indigo-500 focus:border-indigo-500'
@@ -39,6 +47,8 @@ class CalificacionForm(forms.ModelForm):
     """
     Formulario para que el maestro califique una entrega.
     """
+    version = forms.IntegerField(widget=forms.HiddenInput())
+
     class Meta:
         model = Entrega
         # Solo exponemos los campos que el maestro debe llenar
@@ -49,6 +59,7 @@ class CalificacionForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.fields['version'].initial = self.instance.version
         for field_name, field in self.fields.items():
             field.widget.attrs.update({
                 'class': 'mt-1 block w-full px-3 py-2 border border-gray-300 rounded-md shadow-sm focus:outline-none focus:ring-indigo-500 focus:border-indigo-500'
@@ -100,6 +111,22 @@ class AsistenciaForm(forms.Form):
         required=True
     )
 
+class NotaLibroForm(forms.Form):
+    """
+    Valida una celda del libro de calificaciones (vacía = sin nota).
+    """
+    calificacion = forms.DecimalField(min_value=0, max_digits=5, decimal_places=2, required=False)
+
+class CalificacionLoteForm(forms.Form):
+    """
+    Una fila de la calificación por lote de una actividad. `version` es la
+    de la entrega cuando se cargó la página.
+    """
+    entrega_id = forms.IntegerField(widget=forms.HiddenInput())
+    version = forms.IntegerField(widget=forms.HiddenInput())
+    calificacion = forms.DecimalField(min_value=0, max_digits=5, decimal_places=2, required=False)
+    comentarios_maestro = forms.CharField(required=False, widget=forms.Textarea(attrs={'rows': 1}))
+
 class PlanificacionForm(forms.ModelForm):
     
     class Meta:
@@ -58,4 +58,5 @@ class Notificacion(models.Model):
         ordering = ['-fecha_envio']
 
     def __str__(self):
-        return f"Notificación para {self.get_audiencia_display()} por {self.autor.username}"
\ No newline at end of file
+        autor = self.autor.username if self.autor else 'el sistema'
+        return f"Notificación para {self.get_audiencia_display()} por {autor}"
\ No newline at end of file
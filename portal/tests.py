@@ -1,3 +1,20 @@
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from users.models import User
+
+from .calendario import firmar_usuario
+
+
+class CalendarioViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('calendario_ics', args=[firmar_usuario(User.objects.create(username='alumno'))])
+
+    def test_etag_viejo_no_revalida_despues_de_vaciar_la_cache(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        cache.clear()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
@@ -15,6 +15,10 @@ urlpatterns = [
     path('noticias/<int:pk>/eliminar/', views.NoticiaDeleteView.as_view(), name='noticia_delete'),
     path('clase/<int:clase_pk>/asistencia/', views.TomarAsistenciaView.as_view(), name='tomar_asistencia'),
     path('clase/<int:clase_pk>/asistencia/<str:fecha>/', views.TomarAsistenciaView.as_view(), name='tomar_asistencia_fecha'),
+    path('clase/<int:clase_pk>/asistencia-semanal/', views.AsistenciaSemanalView.as_view(), name='asistencia_semanal'),
+    path('clase/<int:clase_pk>/asistencia-semanal/<str:fecha>/', views.AsistenciaSemanalView.as_view(), name='asistencia_semanal_fecha'),
+    path('clase/<int:clase_pk>/asistencia-lote/', views.AsistenciaLoteView.as_view(), name='asistencia_lote'),
+    path('clase/<int:clase_pk>/calificaciones/', views.LibroCalificacionesView.as_view(), name='libro_calificaciones'),
     path('clase/<int:clase_pk>/planificacion/', views.PlanificacionListView.as_view(), name='planificacion_list'),
     path('clase/<int:clase_pk>/planificacion/nueva/', views.PlanificacionCreateView.as_view(), name='planificacion_create'),
     path('planificacion/<int:pk>/editar/', views.PlanificacionUpdateView.as_view(), name='planificacion_update'),
@@ -23,5 +27,6 @@ urlpatterns = [
     path('padre/ver/<str:estudiante_pk>/', views.PadreEstudianteDashboardView.as_view(), name='portal_padre_ver_estudiante'),
     path('padre/ver/<str:estudiante_pk>/calificaciones/', views.PadreMisCalificacionesView.as_view(), name='portal_padre_calificaciones'),
     path('estudiante/boleta/', views.CalificacionesPeriodoView.as_view(), name='boleta_estudiante'),
+    path('calendario/<str:token>.ics', views.CalendarioView.as_view(), name='calendario_ics'),
     path('cambiar-periodo/', views.CambiarPeriodoView.as_view(), name='cambiar_periodo'),
 ]
\ No newline at end of file
@@ -1,20 +1,27 @@
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import TemplateView, CreateView, FormView, DetailView, UpdateView, DeleteView, ListView
 from academico.models import Clase, PeriodoAcademico, Actividad, Entrega, AsistenciaClase, Planificacion, Competencia
-from .forms import ActividadForm, EntregaForm, CalificacionForm, NoticiaForm, NotificacionForm, AsistenciaForm, PlanificacionForm
+from .forms import ActividadForm, EntregaForm, CalificacionForm, NoticiaForm, NotificacionForm, AsistenciaForm, PlanificacionForm, NotaLibroForm, CalificacionLoteForm
 from portal.models import Noticia
 from users.models import User, Maestro, Estudiante, PadreDeFamilia
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect, get_object_or_404, render
 from django.urls import reverse_lazy, reverse
-from django.db.models import Exists, OuterRef, Subquery, DecimalField, Avg, Q
+from django.db.models import Exists, OuterRef, Subquery, DecimalField, Q
 from .models import Notificacion
 from django.utils import timezone
 from django.forms import formset_factory
 from django.views import View
 from collections import defaultdict
-from django.http import HttpResponseBadRequest
+import json
+from django.http import HttpResponseBadRequest, HttpResponse, Http404, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .calendario import firmar_usuario, obtener_ics, usuario_del_token, version_calendario
+from academico.calificaciones import calificar_entregas, guardar_calificaciones, libro_de_calificaciones, promedios_por_curso
+from academico.clasificacion import clasificacion_del_estudiante
+from academico.asistencia import asistencia_del_periodo, con_tasa_asistencia, guardar_asistencias, guardar_asistencias_lote
 from django.db import transaction
 
 
@@ -49,13 +56,16 @@ class PortalEstudianteView(LoginRequiredMixin, UserPassesTestMixin, TemplateView
             actividades = Actividad.objects.filter(
                 clase__in=clases_inscritas
             ).select_related('clase__curso').annotate(
-                fue_entregada=Exists(subquery_entrega),
+                fue_entregada=Exists(subquery_entrega.filter(solo_calificacion=False)),
                 calificacion_obtenida=Subquery(subquery_calificacion, output_field=DecimalField())
             ).order_by('fecha_entrega')
 
 
         context['estudiante'] = estudiante
-        context['clases_inscritas'] = clases_inscritas
+        context['url_calendario'] = url_calendario(self.request)
+        context['clases_inscritas'] = con_tasa_asistencia(clases_inscritas, estudiante)
+        context['asistencia'] = asistencia_del_periodo(estudiante, periodo_actual) if periodo_actual else None
+        context['clasificacion'] = clasificacion_del_estudiante(estudiante)
         context['periodo_actual'] = periodo_actual
         context['actividades'] = actividades
         context['titulo'] = 'Mi Portal de Estudiante'
@@ -87,9 +97,10 @@ class PortalMaestroView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
             ).select_related('curso').prefetch_related('estudiantes__user').order_by('dia_semana', 'hora_inicio')
 
         context['maestro'] = maestro
-        context['clases_asignadas'] = clases_asignadas
+        context['clases_asignadas'] = con_tasa_asistencia(clases_asignadas)
         context['periodo_actual'] = periodo_actual
         context['titulo'] = 'Mi Portal de Maestro'
+        context['url_calendario'] = url_calendario(self.request)
         context['notificaciones'] = Notificacion.objects.filter(
             Q(audiencia=Notificacion.TargetAudiencia.TODOS) |
             Q(audiencia=Notificacion.TargetAudiencia.MAESTROS)
@@ -119,6 +130,11 @@ class ActividadCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
         clase = get_object_or_404(Clase, pk=self.kwargs['clase_pk'])
         return self.request.user.user_type == User.UserType.MAESTRO and clase.maestro == self.request.user.maestro
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['clase'] = get_object_or_404(Clase, pk=self.kwargs['clase_pk'])
+        return kwargs
+
     def form_valid(self, form):
         clase = get_object_or_404(Clase, pk=self.kwargs['clase_pk'])
         form.instance.clase = clase
@@ -139,7 +155,8 @@ class ActividadDetailView(LoginRequiredMixin, UserPassesTestMixin, FormView):
         actividad = get_object_or_404(Actividad, pk=self.kwargs['pk'])
         estudiante = self.request.user.estudiante
         
-        entrega_existente = Entrega.objects.filter(actividad=actividad, estudiante=estudiante).first()
+        # Una nota puesta desde el libro no cuenta como entrega del estudiante
+        entrega_existente = Entrega.objects.filter(actividad=actividad, estudiante=estudiante, solo_calificacion=False).first()
 
         context['actividad'] = actividad
         context['entrega_existente'] = entrega_existente
@@ -154,34 +171,120 @@ class ActividadDetailView(LoginRequiredMixin, UserPassesTestMixin, FormView):
             estudiante=estudiante,
             defaults={
                 'archivo': form.cleaned_data.get('archivo'),
-                'comentarios': form.cleaned_data.get('comentarios')
+                'comentarios': form.cleaned_data.get('comentarios'),
+                'solo_calificacion': False,
             }
         )
         return redirect('portal_estudiante')
 
+CalificacionLoteFormSet = formset_factory(CalificacionLoteForm, extra=0)
+
 class ActividadEntregasView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+    """
+    Lista las entregas de una actividad y permite calificarlas todas a la
+    vez; se guardan juntas con calificar_entregas.
+    """
     model = Actividad
     template_name = 'portal/actividad_entregas.html'
     context_object_name = 'actividad'
 
+    def get_queryset(self):
+        return Actividad.objects.select_related('clase__curso')
+
+    def get_object(self, queryset=None):
+        # test_func, get y post lo piden: una sola consulta por petición
+        if not hasattr(self, '_actividad'):
+            self._actividad = super().get_object(queryset)
+        return self._actividad
+
     def test_func(self):
         actividad = self.get_object()
-        return self.request.user.user_type == User.UserType.MAESTRO and actividad.clase.maestro == self.request.user.maestro
+        return self.request.user.user_type == User.UserType.MAESTRO and actividad.clase.maestro_id == self.request.user.maestro.pk
 
-    def get_context_data(self, **kwargs):
+    def get_context_data(self, formset=None, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['entregas'] = self.object.entregas.all().select_related('estudiante__user')
+        entregas = list(self.object.entregas.all().select_related('estudiante__user').order_by('pk'))
+        if formset is None:
+            formset = CalificacionLoteFormSet(initial=[
+                {
+                    'entrega_id': entrega.pk,
+                    'version': entrega.version,
+                    'calificacion': entrega.calificacion,
+                    'comentarios_maestro': entrega.comentarios_maestro,
+                }
+                for entrega in entregas
+            ])
+        por_id = {entrega.pk: entrega for entrega in entregas}
+        filas = []
+        for form in formset:
+            try:
+                entrega = por_id.get(int(form['entrega_id'].value()))
+            except (TypeError, ValueError):
+                entrega = None
+            if entrega is not None:
+                filas.append((entrega, form))
+        context['entregas'] = entregas
+        context['formset'] = formset
+        context['filas'] = filas
         return context
 
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        formset = CalificacionLoteFormSet(request.POST)
+        if not formset.is_valid():
+            return self.render_to_response(self.get_context_data(formset=formset))
+
+        guardadas, conflictos = calificar_entregas(self.object, {
+            datos['entrega_id']: (datos['version'], datos['calificacion'], datos['comentarios_maestro'])
+            for datos in formset.cleaned_data
+        })
+        if not conflictos:
+            return redirect('actividad_entregas', pk=self.object.pk)
+
+        # Las filas en conflicto vuelven con lo que hay guardado ahora; las
+        # demás conservan lo que el maestro escribió
+        actuales = {
+            entrega.pk: entrega
+            for entrega in Entrega.objects.filter(pk__in=conflictos).select_related('estudiante__user')
+        }
+        datos = request.POST.copy()
+        for i, form_datos in enumerate(formset.cleaned_data):
+            entrega = actuales.get(form_datos['entrega_id'])
+            if entrega is not None:
+                datos[f'form-{i}-version'] = entrega.version
+                datos[f'form-{i}-calificacion'] = '' if entrega.calificacion is None else str(entrega.calificacion)
+                datos[f'form-{i}-comentarios_maestro'] = entrega.comentarios_maestro
+        context = self.get_context_data(formset=CalificacionLoteFormSet(datos))
+        context['conflictos'] = [entrega.estudiante.user.get_full_name() for entrega in actuales.values()]
+        return self.render_to_response(context)
+
 class CalificarEntregaView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     model = Entrega
     form_class = CalificacionForm
     template_name = 'portal/calificar_entrega_form.html'
     context_object_name = 'entrega'
 
+    def get_queryset(self):
+        return Entrega.objects.select_related('actividad__clase', 'estudiante__user')
+
+    def get_object(self, queryset=None):
+        # test_func, get y post lo piden: una sola consulta por petición
+        if not hasattr(self, '_entrega'):
+            self._entrega = super().get_object(queryset)
+        return self._entrega
+
     def test_func(self):
         entrega = self.get_object()
-        return self.request.user.user_type == User.UserType.MAESTRO and entrega.actividad.clase.maestro == self.request.user.maestro
+        return self.request.user.user_type == User.UserType.MAESTRO and entrega.actividad.clase.maestro_id == self.request.user.maestro.pk
+
+    def form_valid(self, form):
+        with transaction.atomic():
+            version = Entrega.objects.select_for_update().values_list('version', flat=True).get(pk=self.object.pk)
+            if version != form.cleaned_data['version']:
+                form.add_error(None, "Esta entrega se calificó en otra pestaña mientras la editaba. Recargue la página para ver la calificación actual.")
+                return self.form_invalid(form)
+            form.instance.version = version + 1
+            return super().form_valid(form)
 
     def get_success_url(self):
         return reverse('actividad_entregas', kwargs={'pk': self.object.actividad.pk})
@@ -319,21 +422,143 @@ class TomarAsistenciaView(LoginRequiredMixin, UserPassesTestMixin, View):
         formset = AsistenciaFormSet(request.POST)
 
         if formset.is_valid():
-            for form_data in formset.cleaned_data:
-                estudiante_id = form_data['estudiante_id']
-                estado = form_data['estado']
-                
-                AsistenciaClase.objects.update_or_create(
-                    clase=clase,
-                    estudiante_id=estudiante_id,
-                    fecha=fecha_seleccionada,
-                    defaults={'estado': estado}
-                )
-            
+            estados = {
+                form_data['estudiante_id']: form_data['estado']
+                for form_data in formset.cleaned_data
+            }
+            guardar_asistencias(clase, fecha_seleccionada, estados)
+
             return redirect('portal_maestro')
-        
+
         return self.get(request, *args, **kwargs)
 
+class AsistenciaSemanalView(TomarAsistenciaView):
+    """
+    Cuadrícula estudiantes x días (lunes a sábado) de la semana de la fecha
+    seleccionada. Los cambios se envían juntos a AsistenciaLoteView.
+    """
+    template_name = 'portal/asistencia_semanal.html'
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        clase = self.get_clase()
+        fecha_seleccionada = self.get_fecha_seleccionada()
+        lunes = fecha_seleccionada - timedelta(days=fecha_seleccionada.weekday())
+        fechas = [lunes + timedelta(days=i) for i in range(len(Clase.DiaSemana))]
+
+        asistencia_map = {
+            (estudiante_id, fecha): estado
+            for estudiante_id, fecha, estado in AsistenciaClase.objects.filter(
+                clase=clase, fecha__range=(fechas[0], fechas[-1]),
+            ).values_list('estudiante_id', 'fecha', 'estado')
+        }
+        filas = [
+            {
+                'estudiante': est,
+                'celdas': [{'fecha': fecha, 'estado': asistencia_map.get((est.pk, fecha), '')} for fecha in fechas],
+            }
+            for est in clase.estudiantes.all().select_related('user').order_by('user__last_name', 'user__first_name')
+        ]
+
+        context = {
+            'clase': clase,
+            'fechas': fechas,
+            'dia_de_clase': Clase.DiaSemana.values.index(clase.dia_semana),
+            'filas': filas,
+            'estados': AsistenciaClase.EstadoAsistencia.choices,
+            'semana_anterior_str': (lunes - timedelta(days=7)).isoformat(),
+            'semana_siguiente_str': (lunes + timedelta(days=7)).isoformat(),
+        }
+        return render(request, self.template_name, context)
+
+class AsistenciaLoteView(TomarAsistenciaView):
+    """
+    Recibe en JSON varios días de asistencia de una clase y los guarda con
+    un solo upsert. Cuerpo: {"registros": [{"estudiante_id": 1,
+    "fecha": "2025-03-03", "estado": "P"}, ...]}. Si algún registro no es
+    válido no se guarda nada y se responde 400 con la lista de errores.
+    """
+    http_method_names = ['post']
+    MAXIMO_REGISTROS = 5000
+
+    def post(self, request, *args, **kwargs):
+        clase = self.get_clase()
+        try:
+            recibidos = json.loads(request.body)['registros']
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Se esperaba un objeto JSON con la lista "registros".'}, status=400)
+        if not isinstance(recibidos, list) or len(recibidos) > self.MAXIMO_REGISTROS:
+            return JsonResponse({'error': f'"registros" debe ser una lista de hasta {self.MAXIMO_REGISTROS} elementos.'}, status=400)
+
+        registros, errores = {}, []
+        for indice, registro in enumerate(recibidos):
+            try:
+                estudiante_id = int(registro['estudiante_id'])
+                fecha = date.fromisoformat(registro['fecha'])
+                estado = registro['estado']
+            except (KeyError, TypeError, ValueError):
+                errores.append({'indice': indice, 'error': 'Faltan datos o tienen formato incorrecto.'})
+                continue
+            if estado not in AsistenciaClase.EstadoAsistencia.values:
+                errores.append({'indice': indice, 'error': f'Estado no válido: {estado}.'})
+                continue
+            registros[(estudiante_id, fecha)] = estado
+        if errores:
+            return JsonResponse({'errores': errores}, status=400)
+
+        guardados = guardar_asistencias_lote(clase, registros)
+        return JsonResponse({'recibidos': len(registros), 'guardados': guardados})
+
+class LibroCalificacionesView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Libro de calificaciones de la clase (estudiantes x actividades) con
+    edición en línea. La página envía solo las celdas modificadas y
+    guardar_calificaciones descarta las que ya tienen esa nota.
+    """
+    template_name = 'portal/libro_calificaciones.html'
+
+    def test_func(self):
+        return self.request.user.user_type == User.UserType.MAESTRO
+
+    def get_clase(self):
+        return get_object_or_404(Clase, pk=self.kwargs['clase_pk'], maestro=self.request.user.maestro)
+
+    def render_libro(self, clase, enviados=None, errores=None):
+        libro = libro_de_calificaciones(clase)
+        for fila in libro['filas']:
+            for celda in fila['celdas']:
+                clave = (fila['estudiante'].pk, celda['actividad'].pk)
+                # Al volver con errores se muestra lo que escribió el maestro
+                celda['valor'] = enviados[clave] if enviados and clave in enviados else celda['calificacion']
+        context = {'clase': clase, 'libro': libro, 'errores': errores or []}
+        return render(self.request, self.template_name, context)
+
+    def get(self, request, *args, **kwargs):
+        return self.render_libro(self.get_clase())
+
+    def post(self, request, *args, **kwargs):
+        clase = self.get_clase()
+        cambios, enviados, errores = {}, {}, []
+        for nombre, valor in request.POST.items():
+            if not nombre.startswith('nota-'):
+                continue
+            try:
+                estudiante_id, actividad_id = (int(parte) for parte in nombre.split('-')[1:3])
+            except ValueError:
+                continue
+            valor = valor.strip().replace(',', '.')
+            enviados[(estudiante_id, actividad_id)] = valor
+            form = NotaLibroForm({'calificacion': valor})
+            if form.is_valid():
+                cambios[(estudiante_id, actividad_id)] = form.cleaned_data['calificacion']
+            else:
+                errores.append(f"Nota no válida ({valor}): {' '.join(form.errors['calificacion'])}")
+
+        if errores:
+            return self.render_libro(clase, enviados, errores)
+        guardar_calificaciones(clase, cambios)
+        return redirect('libro_calificaciones', clase_pk=clase.pk)
+
 class PlanificacionListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = Planificacion
     template_name = 'portal/planificacion_list.html'
@@ -408,6 +633,21 @@ class PlanificacionDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteVie
     def get_success_url(self):
         return reverse_lazy('planificacion_list', kwargs={'clase_pk': self.object.clase.pk})
     
+def agrupar_calificaciones(entregas, estudiante):
+    """
+    Agrupa las entregas calificadas por curso; el promedio de cada curso
+    sale de los resúmenes de calificaciones, no de sumar las entregas.
+    """
+    entregas_por_curso = defaultdict(list)
+    for entrega in entregas:
+        entregas_por_curso[entrega.actividad.clase.curso.nombre].append(entrega)
+
+    promedios = {fila['curso']: fila['promedio'] for fila in promedios_por_curso(estudiante)}
+    return {
+        curso: {'entregas': entregas_lista, 'promedio': promedios.get(curso)}
+        for curso, entregas_lista in entregas_por_curso.items()
+    }
+
 class MisCalificacionesView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     model = Entrega
     template_name = 'portal/mis_calificaciones.html'
@@ -428,22 +668,7 @@ class MisCalificacionesView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        entregas_por_curso = defaultdict(list)
-        for entrega in context['entregas']:
-            curso_nombre = entrega.actividad.clase.curso.nombre
-            entregas_por_curso[curso_nombre].append(entrega)
-            
-        calificaciones_agrupadas = {}
-        for curso, entregas_lista in entregas_por_curso.items():
-            total_curso = sum(entrega.calificacion for entrega in entregas_lista)
-            promedio_curso = total_curso / len(entregas_lista)
-            
-            calificaciones_agrupadas[curso] = {
-                'entregas': entregas_lista,
-                'promedio': promedio_curso
-            }
-            
-        context['calificaciones_agrupadas'] = calificaciones_agrupadas
+        context['calificaciones_agrupadas'] = agrupar_calificaciones(context['entregas'], self.request.user.estudiante)
         context['titulo'] = 'Mis Calificaciones'
         return context
 
@@ -459,6 +684,7 @@ class PortalPadreView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
         padre = self.request.user.padre_familia
         context['hijos'] = padre.hijos.all().select_related('user')
         context['titulo'] = 'Portal de Padre de Familia'
+        context['url_calendario'] = url_calendario(self.request)
         return context
 
 class PadreEstudianteDashboardView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
@@ -499,13 +725,15 @@ class PadreEstudianteDashboardView(LoginRequiredMixin, UserPassesTestMixin, Temp
             actividades = Actividad.objects.filter(
                 clase__in=clases_inscritas
             ).select_related('clase__curso').annotate(
-                fue_entregada=Exists(subquery_entrega),
+                fue_entregada=Exists(subquery_entrega.filter(solo_calificacion=False)),
                 calificacion_obtenida=Subquery(subquery_calificacion, output_field=DecimalField())
             ).order_by('fecha_entrega')
 
         context['estudiante'] = estudiante 
         context['user'] = estudiante.user
-        context['clases_inscritas'] = clases_inscritas
+        context['clases_inscritas'] = con_tasa_asistencia(clases_inscritas, estudiante)
+        context['asistencia'] = asistencia_del_periodo(estudiante, periodo_actual) if periodo_actual else None
+        context['clasificacion'] = clasificacion_del_estudiante(estudiante)
         context['periodo_actual'] = periodo_actual
         context['actividades'] = actividades
         context['noticias'] = Noticia.objects.filter(publicado=True).order_by('-fecha_publicacion')[:5]
@@ -552,22 +780,7 @@ class PadreMisCalificacionesView(LoginRequiredMixin, UserPassesTestMixin, ListVi
         context = super().get_context_data(**kwargs)
         estudiante = Estudiante.objects.get(pk=self.kwargs['estudiante_pk'])
 
-        # (Lógica de agrupación de notas, copiada de MisCalificacionesView)
-        calificaciones_por_curso = defaultdict(list)
-        for entrega in context['entregas']:
-            curso_nombre = entrega.actividad.clase.curso.nombre
-            calificaciones_por_curso[curso_nombre].append(entrega)
-
-        calificaciones_agrupadas = {}
-        for curso, entregas_lista in calificaciones_por_curso.items():
-            total_curso = sum(entrega.calificacion for entrega in entregas_lista)
-            promedio_curso = total_curso / len(entregas_lista)
-            calificaciones_agrupadas[curso] = {
-                'entregas': entregas_lista,
-                'promedio': promedio_curso
-            }
-
-        context['calificaciones_agrupadas'] = calificaciones_agrupadas
+        context['calificaciones_agrupadas'] = agrupar_calificaciones(context['entregas'], estudiante)
         context['titulo'] = f"Calificaciones de {estudiante.user.first_name}"
         context['es_padre'] = True # Bandera para la plantilla
         context['estudiante'] = estudiante # Para el enlace de "Volver"
@@ -578,7 +791,7 @@ class CalificacionesPeriodoView(LoginRequiredMixin, UserPassesTestMixin, Templat
     Muestra la "boleta" o el reporte de calificaciones finales
     de un estudiante para un periodo específico.
     """
-    template_name = 'portal/calificaciones_periodo.html'
+    template_name = 'portal/calificacion_periodo.html'
 
     def test_func(self):
         # Pueden entrar estudiantes o padres (viendo a un hijo)
@@ -600,19 +813,8 @@ class CalificacionesPeriodoView(LoginRequiredMixin, UserPassesTestMixin, Templat
         periodo_actual_id = self.request.session.get('periodo_seleccionado_id')
         periodo = get_object_or_404(PeriodoAcademico, pk=periodo_actual_id)
         
-        # --- LA CONSULTA CLAVE ---
-        # Agrupa todas las entregas por curso y calcula el promedio
-        calificaciones_finales = Entrega.objects.filter(
-            estudiante=estudiante,
-            actividad__clase__periodo=periodo,
-            calificacion__isnull=False
-        ).values(
-            'actividad__clase__curso__nombre' # Agrupar por nombre de curso
-        ).annotate(
-            promedio_final=Avg('calificacion') # Calcular el promedio
-        ).order_by(
-            'actividad__clase__curso__nombre'
-        )
+        # Los promedios por curso ya están agregados en los resúmenes
+        calificaciones_finales = promedios_por_curso(estudiante, periodo)
         
         context['estudiante'] = estudiante
         context['periodo'] = periodo
@@ -694,4 +896,36 @@ class CambiarPeriodoView(LoginRequiredMixin, View):
         except ValueError:
             return HttpResponseBadRequest("ID de periodo inválido.")
         
-        return redirect(next_url)
\ No newline at end of file
+        return redirect(next_url)
+
+def url_calendario(request):
+    """URL absoluta del calendario .ics del usuario actual."""
+    return request.build_absolute_uri(reverse('calendario_ics', args=[firmar_usuario(request.user)]))
+
+def _etag_calendario(request, token):
+    user_id = usuario_del_token(token)
+    if user_id is None:
+        return None
+    version, modificado = version_calendario()
+    return f"calendario-{user_id}-v{version}-{modificado:%Y%m%d%H%M%S}"
+
+def _modificado_calendario(request, token):
+    return version_calendario()[1]
+
+class CalendarioView(View):
+    """
+    Calendario .ics (horario y entregas) de un usuario. No pide sesión: la
+    URL lleva el id del usuario firmado. Se sirve desde la caché y admite
+    GET condicional, porque los clientes de calendario consultan seguido.
+    """
+    @method_decorator(condition(etag_func=_etag_calendario, last_modified_func=_modificado_calendario))
+    def get(self, request, token):
+        user_id = usuario_del_token(token)
+        if user_id is None:
+            raise Http404("Calendario no encontrado.")
+        contenido = obtener_ics(user_id)
+        if contenido is None:
+            raise Http404("Calendario no encontrado.")
+        response = HttpResponse(contenido, content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = 'inline; filename="edutech.ics"'
+        return response